@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012 David Townshend
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 675 Mass Ave, Cambridge, MA 02139, USA.
+
+"""
+Measure `Index` insert and remove throughput for increasing numbers of
+records.  Usage::
+
+    python benchmarks/bench_index.py [size ...]
+
+The default sizes run from 10k to 5M records.
+"""
+
+from __future__ import print_function
+
+import random
+import sys
+import time
+
+from norman import Field, Index
+
+
+def bench(size):
+    field = Field()
+    index = Index(field)
+    values = list(range(size))
+    random.shuffle(values)
+    records = [object() for _ in values]
+    pairs = list(zip(values, records))
+
+    start = time.time()
+    for value, record in pairs:
+        index.insert(value, record)
+    insert = time.time() - start
+
+    random.shuffle(pairs)
+    start = time.time()
+    for value, record in pairs:
+        index.remove(value, record)
+    remove = time.time() - start
+    return size / insert, size / remove
+
+
+def main(sizes):
+    print('%10s %16s %16s' % ('records', 'inserts/s', 'removes/s'))
+    for size in sizes:
+        insert, remove = bench(size)
+        print('%10d %16.0f %16.0f' % (size, insert, remove))
+
+
+if __name__ == '__main__':
+    sizes = [int(a) for a in sys.argv[1:]]
+    main(sizes or [10000, 100000, 1000000, 5000000])
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012 David Townshend
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 675 Mass Ave, Cambridge, MA 02139, USA.
+
+"""
+Measure the time taken by ``Field & values`` lookups for increasing numbers
+of values, on a table of one million records, with each type of index.
+Half of the values are in the table.  Usage::
+
+    python benchmarks/bench_isin.py [size ...]
+
+The default sizes run from 10 to 1M values.
+"""
+
+from __future__ import print_function
+
+import random
+import sys
+import time
+
+from norman import Table, Field
+
+RECORDS = 1000000
+
+
+def make_table():
+    attrs = {'ordered': Field(), 'hashed': Field(index='hash'),
+             'scanned': Field(index=False)}
+    table = type(Table)('T', (Table,), attrs)
+    table.bulk_create({'ordered': i, 'hashed': i, 'scanned': i}
+                      for i in range(RECORDS))
+    return table
+
+
+def bench(table, field, values):
+    start = time.time()
+    n = len(set(field & values))
+    return time.time() - start, n
+
+
+def main(sizes):
+    table = make_table()
+    print('%10s %12s %12s %12s' % ('values', 'ordered (s)', 'hash (s)',
+                                    'scan (s)'))
+    for size in sizes:
+        values = random.sample(range(2 * RECORDS), size)
+        times = [bench(table, f, values)[0]
+                 for f in (table.ordered, table.hashed, table.scanned)]
+        print('%10d %12.4f %12.4f %12.4f' % tuple([size] + times))
+
+
+if __name__ == '__main__':
+    sizes = [int(a) for a in sys.argv[1:]]
+    main(sizes or [10, 1000, 100000, 1000000])
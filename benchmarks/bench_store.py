@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012 David Townshend
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 675 Mass Ave, Cambridge, MA 02139, USA.
+
+"""
+Compare the memory used by `Store`, `ColumnarStore` and `CompactTable`,
+and the time taken to scan a field with `Store.iter_field`.  Usage::
+
+    python benchmarks/bench_store.py [size ...]
+
+Memory is measured with `tracemalloc`, so Python 3.4 or later is needed.
+"""
+
+from __future__ import print_function
+
+import gc
+import sys
+import time
+import tracemalloc
+
+from norman import Table, CompactTable, Field, Store, ColumnarStore
+
+
+def make_table(store):
+    # A CompactTable is used if store is None
+    attrs = {'x': Field(default=0.0), 'y': Field(default=0.0),
+             'name': Field(index='hash')}
+    if store is None:
+        return type(Table)('Point', (CompactTable,), attrs)
+    attrs['_store'] = store
+    return type(Table)('Point', (Table,), attrs)
+
+
+def bench(name, store, size):
+    gc.collect()
+    tracemalloc.start()
+    table = make_table(store)
+    before = tracemalloc.get_traced_memory()[0]
+    table.bulk_create({'x': float(i), 'y': float(-i), 'name': str(i % 100)}
+                      for i in range(size))
+    memory = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    start = time.time()
+    total = 0.0
+    for record, value in table._store.iter_field(table.x):
+        total += value
+    scan = time.time() - start
+    print('%10d %-24s %12.1f %12.3f' % (size, name, memory / 2.0 ** 20,
+                                        scan))
+
+
+def main(sizes):
+    print('%10s %-24s %12s %12s' % ('records', 'store', 'memory (MB)',
+                                    'scan (s)'))
+    for size in sizes:
+        bench('Store', Store(), size)
+        bench('ColumnarStore', ColumnarStore(), size)
+        bench('ColumnarStore (typed)',
+              ColumnarStore(typecodes={'x': 'd', 'y': 'd'}), size)
+        bench('CompactTable', None, size)
+
+
+if __name__ == '__main__':
+    sizes = [int(a) for a in sys.argv[1:]]
+    main(sizes or [10000, 100000, 1000000])
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2012 David Townshend
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 675 Mass Ave, Cambridge, MA 02139, USA.
+"""
+Measure the time taken to change a few records in a large table, with
+`Query.update` and `Table.bulk_create`, compared with setting attributes
+and creating records one at a time.  Usage::
+
+    python benchmarks/bench_update.py [size ...]
+
+Each size is the number of records in the table, and the default sizes run
+from 10k to 1M records.  Times are given per batch of ten records.
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+
+from norman import Table, Field
+
+BATCH = 10
+REPEAT = 20
+
+
+def make_table(size):
+    table = type(Table)('T', (Table,), {'a': Field(), 'b': Field()})
+    table.bulk_create({'a': i, 'b': i} for i in range(size))
+    return table
+
+
+def bench(size):
+    table = make_table(size)
+    n = size
+
+    start = time.time()
+    for i in range(REPEAT):
+        for record in table.a < BATCH:
+            record.b = i
+    setattr_ = (time.time() - start) / REPEAT
+
+    start = time.time()
+    for i in range(REPEAT):
+        (table.a < BATCH).update(b=-i)
+    update = (time.time() - start) / REPEAT
+
+    start = time.time()
+    for i in range(REPEAT):
+        for j in range(BATCH):
+            table(a=n, b=n)
+            n += 1
+    create = (time.time() - start) / REPEAT
+
+    start = time.time()
+    for i in range(REPEAT):
+        table.bulk_create({'a': n + j, 'b': n + j} for j in range(BATCH))
+        n += BATCH
+    bulk = (time.time() - start) / REPEAT
+    return setattr_, update, create, bulk
+
+
+def main(sizes):
+    print('%10s %12s %12s %12s %12s' % ('records', 'setattr (s)',
+                                        'update (s)', 'create (s)',
+                                        'bulk (s)'))
+    for size in sizes:
+        print('%10d %12.6f %12.6f %12.6f %12.6f' % ((size,) + bench(size)))
+
+
+if __name__ == '__main__':
+    sizes = [int(a) for a in sys.argv[1:]]
+    main(sizes or [10000, 100000, 1000000])
@@ -19,12 +19,14 @@
 __version__ = '0.7.2'
 __author__ = 'David Townshend'
 
-from ._table import AutoTable, Table
+from ._table import AutoTable, CompactTable, Table
 from ._field import Field, Join, NotSet
-from ._query import query, Query
+from ._query import query, Query, LiveQuery, OrderedQuery, QueryPlan
 from ._database import AutoDatabase, Database
 from ._except import (NormanWarning,
                       NormanError,
                       ConsistencyError,
                       ValidationError)
-from ._store import Store, Index
+from ._store import (Store, ColumnarStore, SlotStore, Index, HashIndex,
+                     NgramIndex, FullTextIndex, MultiIndex, BitmapIndex,
+                     SpatialIndex, ScanIndex, CompositeIndex)
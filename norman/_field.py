@@ -18,13 +18,15 @@
 # 675 Mass Ave, Cambridge, MA 02139, USA.
 
 import functools
+import heapq
+import math
 import numbers
 import operator
+import re
 
 from ._except import ConsistencyError, ValidationError
 from ._query import Query
-from ._six.moves import reduce
-from ._six import itervalues
+from ._six import itervalues, string_types, text_type, binary_type
 
 
 class NotSet(object):
@@ -50,6 +52,219 @@ def _key(value):
         raise TypeError
 
 
+_word = re.compile(r'\w+', re.UNICODE)
+
+
+def _tokens(value):
+    """
+    Return a list of the lower case words in *value*, or an empty list if
+    it is not a string.
+    """
+    if isinstance(value, string_types):
+        return _word.findall(value.lower())
+    return []
+
+
+def _elements(value):
+    """
+    Return the elements of a collection *value*, or an empty tuple if it is
+    not a collection.  Strings are not treated as collections.
+    """
+    if isinstance(value, (string_types, bytes)):
+        return ()
+    try:
+        iter(value)
+    except TypeError:
+        return ()
+    return value
+
+
+def _has_element(value, element):
+    try:
+        return element in _elements(value)
+    except TypeError:
+        # Unhashable elements cannot be in a set
+        return False
+
+
+def _point(value):
+    """
+    Return *value* as an ``(x, y)`` tuple if it is a pair of real numbers,
+    otherwise `None`.
+    """
+    try:
+        x, y = value
+    except (TypeError, ValueError):
+        return None
+    if isinstance(x, numbers.Real) and isinstance(y, numbers.Real):
+        return x, y
+    return None
+
+
+def _in_box(point, lower, upper):
+    return (point is not None and lower[0] <= point[0] <= upper[0] and
+            lower[1] <= point[1] <= upper[1])
+
+
+def _distance2(a, b):
+    return (a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2
+
+
+def _check_string(value):
+    # Raise TypeError if *value* cannot be used to search string values
+    if not isinstance(value, (text_type, binary_type)):
+        raise TypeError('Expected a text or bytes string, not %r' % (value,))
+
+
+def _has_prefix(value, prefix):
+    return isinstance(value, type(prefix)) and value.startswith(prefix)
+
+
+def _has_substring(value, substring):
+    return isinstance(value, type(substring)) and substring in value
+
+
+def _startswith(index, prefix):
+    return index.startswith(prefix)
+
+
+def _match_startswith(record, index, prefix):
+    store = index.field.owner._store
+    return (store.has_record(record) and
+            _has_prefix(store.get(record, index.field), prefix))
+
+
+def _estimate_startswith(index, prefix):
+    n = index.count_prefix(prefix)
+    return len(index) if n is None else n
+
+_startswith.match = _match_startswith
+_startswith.kind = 'index'
+_startswith.count = lambda index, prefix: index.count_prefix(prefix)
+_startswith.estimate = _estimate_startswith
+
+
+def _substring(index, substring):
+    return index.contains(substring)
+
+
+def _match_substring(record, index, substring):
+    store = index.field.owner._store
+    return (store.has_record(record) and
+            _has_substring(store.get(record, index.field), substring))
+
+_substring.match = _match_substring
+_substring.kind = 'index'
+
+
+def _all_words(index, tokens):
+    if not tokens:
+        return ()
+    postings = index.postings(tokens)
+    if len(postings) < len(tokens):
+        return ()
+    sets = sorted(postings.values(), key=len)
+    return set(sets[0]).intersection(*sets[1:])
+
+
+def _match_all_words(record, index, tokens):
+    store = index.field.owner._store
+    if not tokens or not store.has_record(record):
+        return False
+    return set(tokens).issubset(_tokens(store.get(record, index.field)))
+
+
+def _estimate_all_words(index, tokens):
+    counts = [index.count_token(t) for t in tokens]
+    if None in counts:
+        return len(index)
+    return min(counts) if counts else 0
+
+_all_words.match = _match_all_words
+_all_words.kind = 'index'
+_all_words.estimate = _estimate_all_words
+
+
+def _any_words(index, tokens):
+    found = set()
+    for records in index.postings(tokens).values():
+        found.update(records)
+    return found
+
+
+def _match_any_words(record, index, tokens):
+    store = index.field.owner._store
+    if not store.has_record(record):
+        return False
+    return not set(tokens).isdisjoint(_tokens(store.get(record, index.field)))
+
+
+def _estimate_any_words(index, tokens):
+    counts = [index.count_token(t) for t in tokens]
+    if None in counts:
+        return len(index)
+    return min(sum(counts), len(index))
+
+_any_words.match = _match_any_words
+_any_words.kind = 'index'
+_any_words.estimate = _estimate_any_words
+
+
+def _has(index, element):
+    return index.has(element)
+
+
+def _match_has(record, index, element):
+    store = index.field.owner._store
+    return (store.has_record(record) and
+            _has_element(store.get(record, index.field), element))
+
+
+def _estimate_has(index, element):
+    n = index.count_element(element)
+    return len(index) if n is None else n
+
+_has.match = _match_has
+_has.kind = 'index'
+_has.count = lambda index, element: index.count_element(element)
+_has.estimate = _estimate_has
+
+
+def _within_box(index, lower, upper):
+    return index.within_box(lower, upper)
+
+
+def _match_within_box(record, index, lower, upper):
+    store = index.field.owner._store
+    return (store.has_record(record) and
+            _in_box(_point(store.get(record, index.field)), lower, upper))
+
+_within_box.match = _match_within_box
+_within_box.kind = 'index'
+
+
+def _within_radius(index, centre, radius):
+    return index.within_radius(centre, radius)
+
+
+def _match_within_radius(record, index, centre, radius):
+    store = index.field.owner._store
+    if not store.has_record(record):
+        return False
+    point = _point(store.get(record, index.field))
+    return point is not None and _distance2(point, centre) <= radius * radius
+
+_within_radius.match = _match_within_radius
+_within_radius.kind = 'index'
+
+
+def _nearest(index, point, k):
+    return index.nearest(point, k)
+
+_nearest.kind = 'index'
+_nearest.estimate = lambda index, point, k: min(k, len(index))
+
+
 class Field(object):
 
     """
@@ -59,8 +274,8 @@ class Field(object):
     ...     name = Field()
 
     Fields may be created with a combination of properties as keyword
-    arguments, including `default`, `key`, `readonly`, `unique` and
-    `validators`.
+    arguments, including `default`, `index`, `key`, `multi`, `readonly`,
+    `unique` and `validators`.
 
     Fields can be used with comparison operators to return a `Query`
     object containing matching records.  For example::
@@ -90,12 +305,16 @@ class Field(object):
     """
 
     def __init__(self, unique=False, default=NotSet,
-                 readonly=False, validators=None, key=None):
+                 readonly=False, validators=None, key=None, index=True,
+                 multi=False):
         self._unique = unique
         self._default = default
         self._readonly = readonly
         self._validators = [] if validators is None else validators
         self._key = _key if key is None else key
+        self._index = index
+        self._multi = multi
+        self._slot = None
 
     def _copy(self):
         """
@@ -105,7 +324,9 @@ class Field(object):
                      default=self._default,
                      readonly=self._readonly,
                      validators=[v for v in self._validators],
-                     key=self._key)
+                     key=self._key,
+                     index=self._index,
+                     multi=self._multi)
 
     @property
     def default(self):
@@ -119,6 +340,52 @@ class Field(object):
         self.owner._store.setdefault(self, value)
         self._default = value
 
+    @property
+    def index(self):
+        """
+        The type of index maintained for the field (default: `True`).  This
+        is set when the field is created and is read-only.  Supported values
+        are:
+
+        `True`
+            Values are kept in an ordered `Index`, which supports all
+            comparison operators.
+
+        ``'hash'``
+            Values are kept in a `HashIndex`, a `dict` of records by value.
+            Equality and ``&`` lookups are O(1) and `key` is not used for
+            them, so equality is based on the value itself.  Other
+            comparisons are still supported, but scan all values.
+
+        `False`
+            No index is kept, and queries on the field use a `ScanIndex`,
+            which scans every record in the table.  Equality is based on
+            the value itself, as for ``'hash'``.
+
+        ``'ngram'``
+            Values are kept in an `NgramIndex`, which is an ordered `Index`
+            that also indexes the substrings of string values, so that
+            `contains` does not need to check every value.
+
+        ``'fulltext'``
+            Values are kept in a `FullTextIndex`, which is an ordered `Index`
+            that also keeps the records containing each word of string
+            values, for `match`, `match_any` and `ranked`.
+
+        ``'bitmap'``
+            Values are kept in a `BitmapIndex`, which is a `HashIndex` that
+            also keeps a bitmap of the records for each value.  This suits
+            fields with few distinct values, since equality tests combined
+            with ``&``, ``|``, ``-`` and ``^`` are evaluated as bitwise
+            operations.
+
+        ``'spatial'``
+            Values are kept in a `SpatialIndex`, which is an ordered `Index`
+            that also keeps ``(x, y)`` point values ordered by position, for
+            `within_box`, `within_radius` and `nearest`.
+        """
+        return self._index
+
     @property
     def key(self):
         """
@@ -158,6 +425,19 @@ class Field(object):
         """
         return self._key
 
+    @property
+    def multi(self):
+        """
+        If `True`, values are collections, such as lists or sets of tags,
+        and each element is indexed separately in a `MultiIndex` as well as
+        the whole value (default: `False`).  This makes `has` an O(1) lookup
+        for hashable elements.  Multi-valued fields only support the default
+        `index`, and values should be replaced rather than modified in
+        place, since the index is only updated when the field is set.  This
+        is set when the field is created and is read-only.
+        """
+        return self._multi
+
     @property
     def name(self):
         """
@@ -201,22 +481,16 @@ class Field(object):
 
     @unique.setter
     def unique(self, value):
+        value = bool(value)
         if value == self._unique:
             return
-        elif value:
-            # Get a list of unique values in the table
-            store = self.owner._store
-            data = [tuple(v for _, v in store.iter_field(self))]
-            for field in store.fields.values():
-                if field.unique:
-                    data.append(tuple(v for _, v in store.iter_fields(field)))
-            data = list(zip(*data))
-            if len(data) != len(set(data)):
-                raise ValidationError
-            else:
-                self._unique = True
-        else:
-            self._unique = False
+        self._unique = value
+        if getattr(self, '_owner', None) is not None:
+            try:
+                self.owner._store.reindex_unique()
+            except ValidationError:
+                self._unique = not value
+                raise
 
     @property
     def validators(self):
@@ -234,11 +508,15 @@ class Field(object):
                      default=self.default,
                      key=self.key,
                      readonly=self.readonly,
-                     validators=self.validators)
+                     validators=self.validators,
+                     index=self.index,
+                     multi=self.multi)
 
     def __get__(self, instance, owner):
         if instance is None:
             return self
+        elif self._slot is not None:
+            return getattr(instance, self._slot, self._default)
         else:
             return self.owner._store.get(instance, self)
 
@@ -248,6 +526,7 @@ class Field(object):
     def __eq__(self, value):
         q = Query(operator.eq, self.owner._store.indexes[self], value, table=self.owner)
         q._adder.add_kwargs(**{self.name: value})
+        q._terms = {self: value}
         return q
 
     def __ne__(self, value):
@@ -265,10 +544,186 @@ class Field(object):
     def __le__(self, value):
         return Query(operator.le, self.owner._store.indexes[self], value, table=self.owner)
 
+    def min(self):
+        """
+        Return the lowest value in the field, in the order of `key`.  If the
+        field has an ordered `Index`, this is read from the start of the
+        index in constant time.  `NotSet` and values which cannot be ordered
+        are ignored, and `NotSet` is returned if there are no other values.
+        """
+        return self.owner._store.indexes[self].first()
+
+    def max(self):
+        """
+        Return the highest value in the field, in the same way as `min`.
+        """
+        return self.owner._store.indexes[self].first(reverse=True)
+
+    def startswith(self, prefix):
+        """
+        Return a `Query` of records with string values starting with
+        *prefix*, which is a `str` or `bytes`.  If the field has an ordered
+        `Index` and the default `key`, these are a single range of the
+        index, found by bisection.  Otherwise every value is checked.
+        `TypeError` is raised if *prefix* is not a text or bytes string.
+        """
+        _check_string(prefix)
+        return Query(_startswith, self.owner._store.indexes[self], prefix,
+                     table=self.owner)
+
+    def contains(self, substring):
+        """
+        Return a `Query` of records with string values containing
+        *substring*.  This checks every value, unless the field was created
+        with ``index='ngram'``, in which case only values which contain all
+        the n-grams of *substring* are checked.  `TypeError` is raised if
+        *substring* is not a text or bytes string.
+        """
+        _check_string(substring)
+        return Query(_substring, self.owner._store.indexes[self], substring,
+                     table=self.owner)
+
+    def has(self, element):
+        """
+        Return a `Query` of records with collection values containing
+        *element*.  For example:
+
+            >>> class MyTable(Table):
+            ...     tags = Field(multi=True)
+            >>> r1 = MyTable(tags=['red', 'blue'])
+            >>> r2 = MyTable(tags=['blue'])
+            >>> set(MyTable.tags.has('red')) == set((r1,))
+            True
+
+        If the field was not created with ``multi=True``, every value is
+        checked.  String values are not treated as collections.
+        """
+        return Query(_has, self.owner._store.indexes[self], element,
+                     table=self.owner)
+
+    def match(self, text):
+        """
+        Return a `Query` of records with string values containing every
+        word in *text*.  Words are found by splitting on non-alphanumeric
+        characters, and are not case sensitive, so that:
+
+            >>> class MyTable(Table):
+            ...     text = Field(index='fulltext')
+            >>> r1 = MyTable(text='The Knights who say "Ni"')
+            >>> r2 = MyTable(text='Knights of the round table')
+            >>> set(MyTable.text.match('ni knights')) == set((r1,))
+            True
+
+        If *text* contains no words, no records match.  This checks every
+        value, unless the field was created with ``index='fulltext'``.
+        """
+        tokens = tuple(sorted(set(_tokens(text))))
+        return Query(_all_words, self.owner._store.indexes[self], tokens,
+                     table=self.owner)
+
+    def match_any(self, text):
+        """
+        Return a `Query` of records with string values containing any of the
+        words in *text*.  This is similar to `match`.
+        """
+        tokens = tuple(sorted(set(_tokens(text))))
+        return Query(_any_words, self.owner._store.indexes[self], tokens,
+                     table=self.owner)
+
+    def ranked(self, text, limit=None):
+        """
+        Return a list of records containing any of the words in *text*,
+        ordered from the most to the least relevant, and truncated to
+        *limit* records if it is given.  Each record is scored by the number
+        of times each word appears in its value, weighted by how rare the
+        word is in the table (tf-idf).
+        """
+        tokens = sorted(set(_tokens(text)))
+        store = self.owner._store
+        postings = store.indexes[self].postings(tokens)
+        n = store.record_count()
+        scores = {}
+        for records in postings.values():
+            idf = math.log(1.0 + float(n) / len(records))
+            for record, tf in records.items():
+                scores[record] = scores.get(record, 0.0) + tf * idf
+        if limit is None:
+            return sorted(scores, key=scores.get, reverse=True)
+        return heapq.nlargest(limit, scores, key=scores.get)
+
+    def within_box(self, lower, upper):
+        """
+        Return a `Query` of records with point values, which are pairs of
+        real numbers ``(x, y)``, inside the box with corners *lower* and
+        *upper*, including its edges.  For example:
+
+            >>> class Node(Table):
+            ...     position = Field(index='spatial')
+            >>> n1 = Node(position=(1, 1))
+            >>> n2 = Node(position=(5, 2))
+            >>> set(Node.position.within_box((0, 0), (2, 2))) == set((n1,))
+            True
+
+        This checks every value, unless the field was created with
+        ``index='spatial'``.
+        """
+        return Query(_within_box, self.owner._store.indexes[self],
+                     tuple(lower), tuple(upper), table=self.owner)
+
+    def within_radius(self, centre, radius):
+        """
+        Return a `Query` of records with point values no further than
+        *radius* from the point *centre*.  This is similar to `within_box`.
+        """
+        return Query(_within_radius, self.owner._store.indexes[self],
+                     tuple(centre), radius, table=self.owner)
+
+    def nearest(self, point, k=1):
+        """
+        Return a `Query` of the *k* records with point values closest to
+        *point*, or fewer if there are not enough.  Records at the same
+        distance are chosen arbitrarily.  This is similar to `within_box`,
+        but note that the query results are not ordered by distance.
+        """
+        return Query(_nearest, self.owner._store.indexes[self],
+                     tuple(point), k, table=self.owner)
+
+    def count_range(self, lower, upper):
+        """
+        Return the number of records with ``lower <= value < upper``.  If the
+        field has an ordered `Index`, this is found from the positions of
+        the bounds in the index, without reading any records.  This is the
+        same as::
+
+            ((field >= lower) & (field < upper)).count()
+        """
+        return ((self >= lower) & (self < upper)).count()
+
     def __and__(self, values):
+        # The tokens of values are found once for each index, so that
+        # matching records takes constant time, except for values which
+        # cannot be hashed.
+        tokens = {}
+
         def _and(f, vals):
-            i = f.owner._store.indexes[f]
-            return reduce(operator.or_, (set(i == v) for v in vals))
+            return f.owner._store.indexes[f].isin(vals)
+
+        def match(record, f, vals):
+            store = f.owner._store
+            if not store.has_record(record):
+                return False
+            i = store.indexes[f]
+            if tokens.get('index') is not i:
+                tokens['index'] = i
+                tokens['tokens'] = set(i._token(v) for v in vals)
+                tokens['unhashed'] = [v for v in vals
+                                      if getattr(v, '__hash__', None) is None]
+            value = store.get(record, f)
+            return (i._token(value) in tokens['tokens'] or
+                    any(i.matches(operator.eq, v, value)
+                        for v in tokens['unhashed']))
+        _and.match = match
+        _and.kind = 'index'
         return Query(_and, self, values, table=self.owner)
 
     def __str__(self):
@@ -16,6 +16,13 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 675 Mass Ave, Cambridge, MA 02139, USA.
 
+from __future__ import division
+
+import heapq
+import itertools
+import operator
+from timeit import default_timer
+
 
 class _Sentinal:
     pass
@@ -28,6 +35,10 @@ def query(arg1, arg2=None):
     *table* is a `Table` or `Query` object.  If *func* is missing, all
     records are assumed to pass.  If it is specified, is should accept a
     record as its argument and return `True` for passing records.
+
+    If *table* is a `Table`, the results are stored until any data in
+    *table* changes, so *func* should only depend on the record it is
+    given.  If *table* is a `Query`, the results are never stored.
     """
     if arg2 is None:
         table = arg1
@@ -36,11 +47,22 @@ def query(arg1, arg2=None):
         table = arg2
         func = arg1
 
+    from ._table import TableMeta
+
     def op(t):
-        return set(r for r in t if func(r))
+        return (r for r in t if func(r))
+
+    def match(record, t):
+        return t._store.has_record(record) and bool(func(record))
 
     op.__name__ = func.__name__
+    op.kind = 'function'
+    if isinstance(table, TableMeta):
+        op.match = match
+        if arg2 is None:
+            op.count = op.estimate = lambda t: t._store.record_count()
     q = Query(op, table, table=table)
+    q._volatile = isinstance(table, Query)
     # If its just a table, add function should be available
     if arg2 is None:
         q._add_kwargs = {}
@@ -63,6 +85,264 @@ def _xor(a, b):
     return set(a) ^ set(b)
 
 
+def _stream_or(a, b):
+    seen = set()
+    for r in a._iter():
+        seen.add(r)
+        yield r
+    for r in b._iter():
+        if r not in seen:
+            yield r
+
+
+def _stream_and(a, b):
+    # Read from each side in turn, so that the smaller side is exhausted
+    # first.  The rest of the other side is then only checked against it.
+    its = (a._iter(), b._iter())
+    seen = (set(), set())
+    while True:
+        for i in (0, 1):
+            try:
+                r = next(its[i])
+            except StopIteration:
+                for r in its[1 - i]:
+                    if r in seen[i]:
+                        yield r
+                return
+            if r in seen[1 - i]:
+                yield r
+            seen[i].add(r)
+
+
+def _stream_sub(a, b):
+    exclude = set(b._iter())
+    for r in a._iter():
+        if r not in exclude:
+            yield r
+
+
+# Streaming implementations of operations on queries.  Each accepts the
+# `Query` arguments and generates unique records.
+_streams = {_or: _stream_or, _and: _stream_and, _sub: _stream_sub}
+
+# Bitwise equivalents of set operations, for `BitmapIndex` bitmaps.
+_bitwise = {_or: operator.or_, _and: operator.and_,
+            _sub: lambda a, b: a & ~b, _xor: operator.xor}
+
+# Operations of queries created by `Field` comparisons, which are called
+# with an index and a value.
+_comparisons = (operator.eq, operator.ne, operator.lt, operator.le,
+                operator.gt, operator.ge)
+
+_lower = (operator.gt, operator.ge)
+_upper = (operator.lt, operator.le)
+
+
+def _between(index, lower_op, lower, upper_op, upper):
+    return index.between(lower_op, lower, upper_op, upper)
+
+
+def _match_between(record, index, lower_op, lower, upper_op, upper):
+    store = index.field.owner._store
+    if not store.has_record(record):
+        return False
+    cell = store.get(record, index.field)
+    return (index.matches(lower_op, lower, cell) and
+            index.matches(upper_op, upper, cell))
+
+_between.match = _match_between
+_between.kind = 'range'
+
+
+def _collapse(terms):
+    # Replace pairs of lower and upper bounds on the same ordered index
+    # with a single range, which is found with one pair of bisections.
+    from ._store import Index
+    lower, upper, rest = {}, {}, []
+    for q in terms:
+        if (q._op in _lower + _upper and isinstance(q._args[0], Index) and
+                q._args[0]._sort_key(q._args[1])[0]):
+            bounds = lower if q._op in _lower else upper
+            bounds.setdefault(id(q._args[0]), []).append(q)
+        else:
+            rest.append(q)
+    for key, lows in lower.items():
+        highs = upper.pop(key, [])
+        while lows and highs:
+            a, b = lows.pop(), highs.pop()
+            rest.append(Query(_between, a._args[0], a._op, a._args[1],
+                              b._op, b._args[1]))
+        rest.extend(lows)
+        rest.extend(highs)
+    for highs in upper.values():
+        rest.extend(highs)
+    return rest
+
+
+def _contains(it):
+    # Return a membership test for the records generated by *it*, which
+    # reads only as far as needed.
+    seen = set()
+
+    def contains(record):
+        if record in seen:
+            return True
+        for r in it:
+            seen.add(r)
+            if r is record:
+                return True
+        return False
+    return contains
+
+
+def _walk(index, contains, reverse):
+    # Generate the records in an `Index` which pass *contains*, in key
+    # order.  Records with values which cannot be ordered are last.  If
+    # *contains* is `None`, all records are generated.
+    for r in index._sorted.values(None, None, reverse):
+        if contains is None or contains(r):
+            yield r
+    for items in index._unordered.values():
+        for v, r in items:
+            if contains is None or contains(r):
+                yield r
+
+
+def _top(records, field, reverse, stop):
+    # Return a list of the first *stop* records ordered by *field*, or all
+    # of them if *stop* is `None`.  Records with values which cannot be
+    # ordered are last.
+    from ._field import NotSet
+    store = field.owner._store
+    unordered = []
+
+    def keyed():
+        for r in records:
+            value = store.get(r, field)
+            if value is not NotSet:
+                try:
+                    yield field.key(value), r
+                    continue
+                except (TypeError, ValueError):
+                    pass
+            unordered.append(r)
+    key = operator.itemgetter(0)
+    if stop is None:
+        ordered = sorted(keyed(), key=key, reverse=reverse)
+    elif reverse:
+        ordered = heapq.nlargest(stop, keyed(), key=key)
+    else:
+        ordered = heapq.nsmallest(stop, keyed(), key=key)
+    results = [r for k, r in ordered]
+    results.extend(unordered)
+    return results if stop is None else results[:stop]
+
+
+def _group(records, field, index):
+    # Return a list of (value, records) pairs, grouping *records* by the
+    # values of *field* which *index* considers equal, in key order.
+    store = field.owner._store
+    groups = {}
+    for r in records:
+        value = store.get(r, field)
+        token = index._token(value)
+        if token in groups:
+            groups[token][1].append(r)
+        else:
+            groups[token] = (value, [r])
+    groups = dict((id(g[1][0]), g) for g in groups.values())
+    firsts = _top([g[1][0] for g in groups.values()], field, False, None)
+    return [groups[id(r)] for r in firsts]
+
+
+def _column(records, field):
+    # Return a list of the values of *field* for a set of records, reading
+    # the whole column if most of the records are needed.
+    store = field.owner._store
+    if 2 * len(records) >= store.record_count():
+        return [v for r, v in store.iter_field(field) if r in records]
+    get = store.get
+    return [get(r, field) for r in records]
+
+
+def _extreme(field, values, reverse):
+    from ._field import NotSet
+    best, best_key = NotSet, None
+    for value in values:
+        if value is NotSet:
+            continue
+        try:
+            key = field.key(value)
+        except (TypeError, ValueError):
+            continue
+        if best is NotSet or (key > best_key if reverse else key < best_key):
+            best, best_key = value, key
+    return best
+
+
+def _avg(field, values):
+    from ._field import NotSet
+    values = [v for v in values if v is not NotSet]
+    return sum(values) / len(values) if values else NotSet
+
+
+def _sum(field, values):
+    from ._field import NotSet
+    return sum(v for v in values if v is not NotSet)
+
+
+def _count_values(field, values):
+    from ._field import NotSet
+    return sum(1 for v in values if v is not NotSet)
+
+
+# Aggregate functions for `Query.aggregate`, which are called with a field
+# and a list of its values.
+_aggregates = {'avg': _avg,
+               'count': _count_values,
+               'max': lambda f, v: _extreme(f, v, True),
+               'min': lambda f, v: _extreme(f, v, False),
+               'sum': _sum}
+
+
+def _compile_comparison(op, index, value):
+    # Return a function which returns `True` if a record is in the results
+    # of ``op(index, value)``, with the parts which only depend on *value*
+    # found once.
+    from ._store import Index
+    field = index.field
+    store = field.owner._store
+    has, get = store.has_record, store.get
+    if op is operator.eq:
+        token, tokenize = index._token(value), index._token
+        return lambda r: has(r) and tokenize(get(r, field)) == token
+    elif op is not operator.ne and isinstance(index, Index):
+        try:
+            key = field.key(value)
+        except (TypeError, ValueError):
+            pass
+        else:
+            sort_key = index._sort_key
+
+            def compare(r):
+                if not has(r):
+                    return False
+                sorted_, k = sort_key(get(r, field))
+                return sorted_ and bool(op(k, key))
+            return compare
+    return lambda r: has(r) and index.matches(op, value, get(r, field))
+
+
+def _stream_plan(first, rest):
+    filters = [q._filter() for q in rest]
+    for r in first._iter():
+        for f in filters:
+            if not f(r):
+                break
+        else:
+            yield r
+
+
 class _Adder(object):
 
     """
@@ -199,8 +479,14 @@ class Query(object):
     Queries evaluate to `True` if they contain any results, and `False`
     if they do not.
 
-    Calling a query forces it to be re-evaluated, and the query object is
-    returned.
+    The results of a query are stored when it is evaluated, and are used
+    again until the data which they depend on changes, as determined by
+    `Store.version` and `Store.field_versions`.  Calling a query forces it
+    to be re-evaluated, and the query object is returned.
+
+    Results are evaluated lazily when possible, so `bool`, `one`,
+    ``r in q`` and `stream` stop as soon as the result is known, without
+    evaluating the entire query.
     """
 
     def __init__(self, op, *args, **kwargs):
@@ -210,6 +496,16 @@ class Query(object):
         self._op = op
         self._args = args
         self._results = None
+        # _version is the result of _get_version() when _results were
+        # evaluated.  _volatile queries have no known version.
+        self._version = None
+        self._volatile = False
+        # _predicate is the function returned by _compile(), once it has
+        # been created.
+        self._predicate = None
+        # _terms maps fields to values if the query is a conjunction of
+        # equality tests, otherwise it is None.
+        self._terms = None
         if 'adder' in kwargs:
             self._adder = kwargs['adder']
         else:
@@ -230,37 +526,428 @@ class Query(object):
         except IndexError:
             return False
         return True
+    __nonzero__ = __bool__
 
     def __call__(self):
-        args = []
+        version = self._get_version()
+        self._results = set(self._evaluate())
+        self._version = version
+        return self
+
+    def _get_version(self):
+        """
+        Return a tuple of the versions of all the data the query depends
+        on, or `None` if it cannot be determined.
+        """
+        from ._field import Field
+        from ._store import Index, HashIndex
+        from ._table import TableMeta
+        if self._volatile:
+            return None
+        version = []
         for a in self._args:
             if isinstance(a, Query):
-                a()
-                args.append(a._results)
+                v = a._get_version()
+                if v is None:
+                    return None
+                version.extend(v)
+            elif isinstance(a, TableMeta):
+                version.append(a._store.version)
+            elif isinstance(a, Field):
+                version.append(a.owner._store.field_versions[a])
+            elif isinstance(a, (Index, HashIndex)):
+                version.append(a.field.owner._store.field_versions[a.field])
+        return tuple(version)
+
+    def _fresh(self):
+        """
+        Return `True` if the stored results are still valid.
+        """
+        return (self._results is not None and self._version is not None and
+                self._version == self._get_version())
+
+    def _iter(self):
+        """
+        Return an iterator over the results, using the stored results if
+        they are still valid, or else evaluating the query as it is read.
+        """
+        if self._fresh():
+            return iter(self._results)
+        return self._evaluate()
+
+    def _evaluate(self):
+        """
+        Return an iterator which evaluates the query as it is read, and
+        generates each matching record once.
+        """
+        results = self._unique_lookup()
+        if results is not None:
+            return iter(results)
+        bitmap = self._bitmap() if self._op in _bitwise else None
+        if bitmap is not None:
+            return bitmap[0].records(bitmap[1])
+        if self._op is _and:
+            order = self._plan()
+            if order is not None:
+                return _stream_plan(order[0], order[1:])
+        stream = _streams.get(self._op)
+        if stream is not None:
+            return stream(*self._args)
+        args = [set(a._iter()) if isinstance(a, Query) else a
+                for a in self._args]
+        return iter(self._op(*args))
+
+    def _bitmap(self):
+        """
+        Return ``(rows, bits)`` if the query is an equality test on a
+        `BitmapIndex`, or a set operation on such queries in the same
+        `Store`, where *bits* is an `int` with the row id of each result in
+        *rows* set.  Otherwise, `None` is returned.
+        """
+        op = self._op
+        if op is operator.eq:
+            bitmap = getattr(self._args[0], 'bitmap', None)
+            return None if bitmap is None else bitmap(self._args[1])
+        elif op not in _bitwise:
+            return None
+        a = self._args[0]._bitmap()
+        if a is None:
+            return None
+        b = self._args[1]._bitmap()
+        if b is None or b[0] is not a[0]:
+            return None
+        return a[0], _bitwise[op](a[1], b[1])
+
+    def _unique_store(self):
+        """
+        Return the `Store` if this is a conjunction of equality tests which
+        includes all the unique fields of a table, otherwise `None`.
+        """
+        if self._op is not _and or not self._terms:
+            return None
+        owners = set(f.owner for f in self._terms)
+        if len(owners) != 1:
+            return None
+        store = owners.pop()._store
+        index = store.unique_index
+        if index is None or not set(index.fields) <= set(self._terms):
+            return None
+        return store
+
+    def _unique_lookup(self):
+        """
+        Return the results of a conjunction of equality tests which includes
+        all the unique fields of a table, using `Store.unique_index`.  If
+        this is not possible, `None` is returned.
+        """
+        store = self._unique_store()
+        if store is None:
+            return None
+        index = store.unique_index
+        records = set(index == tuple(self._terms[f] for f in index.fields))
+        for field, value in self._terms.items():
+            if field not in index.fields:
+                token = store.indexes[field]._token
+                records = set(r for r in records
+                              if token(store.get(r, field)) == token(value))
+        return records
+
+    def _conjuncts(self):
+        """
+        Return a list of queries, the intersection of which is equivalent to
+        this query.  Only intersections which are not already evaluated are
+        split.
+        """
+        if self._op is _and and not self._fresh():
+            return self._args[0]._conjuncts() + self._args[1]._conjuncts()
+        return [self]
+
+    def _estimate(self):
+        """
+        Return the maximum number of results, found from index statistics
+        without evaluating the query, or `None` if this is not known.
+        """
+        from ._store import Index, HashIndex
+        op = self._op
+        if self._fresh():
+            return len(self._results)
+        elif op in _comparisons:
+            if isinstance(self._args[0], (Index, HashIndex)):
+                return self._args[0].estimate(op, self._args[1])
+        elif op is _between:
+            index, lower_op, lower, upper_op, upper = self._args
+            n = index.count_between(lower_op, lower, upper_op, upper)
+            if n is None:
+                n = min(index.estimate(lower_op, lower),
+                        index.estimate(upper_op, upper))
+            return n
+        elif getattr(op, 'estimate', None) is not None:
+            return op.estimate(*self._args)
+        elif op in (_and, _or, _sub, _xor):
+            estimates = [a._estimate() for a in self._args]
+            if op is _and:
+                known = [e for e in estimates if e is not None]
+                return min(known) if known else None
+            elif None in estimates:
+                return None
+            elif op is _sub:
+                return estimates[0]
+            return sum(estimates)
+        return None
+
+    def _count(self):
+        """
+        Return the number of results if it can be found without evaluating
+        the query, from stored results or positions in the indexes,
+        otherwise `None`.
+        """
+        from ._store import Index, HashIndex
+        op = self._op
+        if self._fresh():
+            return len(self._results)
+        bitmap = self._bitmap() if op in _bitwise else None
+        if bitmap is not None:
+            return bin(bitmap[1]).count('1')
+        elif op in _comparisons:
+            if isinstance(self._args[0], (Index, HashIndex)):
+                return self._args[0].count(op, self._args[1])
+        elif op is _between:
+            return self._args[0].count_between(*self._args[1:])
+        elif op is _and:
+            terms = _collapse(self._args[0]._conjuncts() +
+                              self._args[1]._conjuncts())
+            counts = [q._count() for q in terms]
+            if len(counts) == 1:
+                return counts[0]
+            elif 0 in counts:
+                return 0
+        elif op in (_or, _sub, _xor):
+            a, b = [q._count() for q in self._args]
+            if b == 0:
+                return a
+            elif a == 0:
+                return 0 if op is _sub else b
+        elif getattr(op, 'count', None) is not None:
+            return op.count(*self._args)
+        return None
+
+    def _read_index(self, index, stop):
+        """
+        Return `True` if the results should be found by reading records from
+        *index* in order and checking them, until *stop* results are found,
+        or all of them if *stop* is `None`.  This checks about ``stop *
+        len(index) / n`` records, where *n* is the number of results,
+        compared to *n* for evaluating the query.  If *stop* is `None`, the
+        whole index is read if at least half of it is in the results.
+        """
+        from ._store import Index
+        if not isinstance(index, Index):
+            return False
+        n = self._count()
+        if n is None:
+            n = self._estimate()
+        if not n:
+            return False
+        if stop is None:
+            return n * 2 >= len(index)
+        return stop * len(index) <= n * n
+
+    def _index_filter(self, index):
+        """
+        Return a function which accepts a record in *index* and returns
+        `True` if it is in the results, or `None` if every record in the
+        index is in the results.
+        """
+        if (self.table is index.field.owner and
+                self._count() == len(index)):
+            return None
+        return self._filter()
+
+    def _filter(self):
+        """
+        Return a function which accepts a record and returns `True` if it is
+        in the results.
+        """
+        if self._fresh():
+            return self._results.__contains__
+        elif self._matchable():
+            if self._predicate is None:
+                self._predicate = self._compile()
+            return self._predicate
+        return _contains(self._iter())
+
+    def _plan(self):
+        """
+        Return a list of the parts of an intersection, in the order in which
+        they should be evaluated, or `None` if the size of no part of it can
+        be estimated.
+
+        The intersection is split into its parts, and bounds on the same
+        ordered index are combined into a single range.  Records are then
+        read from the part with the fewest estimated results, and checked
+        against the others in order of increasing size.
+        """
+        terms = _collapse(self._args[0]._conjuncts() +
+                          self._args[1]._conjuncts())
+        estimates = [(q._estimate(), i) for i, q in enumerate(terms)]
+        if all(e is None for e, i in estimates):
+            return None
+        estimates.sort(key=lambda a: (a[0] is None, a[0], a[1]))
+        return [terms[i] for e, i in estimates]
+
+    def _explain(self, analyze, root=False):
+        """
+        Return a `QueryPlan` for this query.  *root* is `True` if the query
+        is being evaluated, and not read as part of another query.
+        """
+        from ._field import Field
+        from ._store import Index, HashIndex, ScanIndex
+        op = self._op
+        estimate = self._estimate()
+        children = []
+        index = None
+        if not root and self._fresh():
+            kind, description = 'results', 'stored results'
+        elif self._unique_store() is not None:
+            kind, description = 'unique', str(self)
+            index = self._unique_store().unique_index
+        elif op in (_and, _or, _sub, _xor):
+            kind = 'set'
+            order = self._plan() if op is _and else None
+            if order is None:
+                description = str(self)
+                children = list(self._args)
             else:
-                args.append(a)
-        self._results = set(self._op(*args))
-        return self
+                description = 'planned %s' % ' & '.join(
+                    '(%s)' % q for q in order)
+                children = order
+        else:
+            kind = getattr(op, 'kind', 'function')
+            description = str(self)
+            for a in self._args:
+                if isinstance(a, Query):
+                    children.append(a)
+                elif isinstance(a, (Index, HashIndex)):
+                    index = a
+                elif isinstance(a, Field):
+                    index = a.owner._store.indexes.get(a)
+            if isinstance(index, ScanIndex):
+                kind = 'scan'
+            elif op in _comparisons:
+                kind = 'index'
+        plan = QueryPlan(kind, description, index, estimate,
+                         [q._explain(analyze) for q in children])
+        if analyze:
+            start = default_timer()
+            plan.rows = len(set(self._evaluate() if root else self._iter()))
+            plan.time = default_timer() - start
+        return plan
+
+    def _matchable(self):
+        """
+        Return `True` if `_match` can be used for this query.
+        """
+        from ._store import Index, HashIndex
+        if self._op in _comparisons:
+            return isinstance(self._args[0], (Index, HashIndex))
+        elif self._op in (_and, _or, _sub, _xor):
+            return all(a._matchable() for a in self._args)
+        else:
+            return getattr(self._op, 'match', None) is not None
+
+    def _match(self, record):
+        """
+        Return `True` if *record* is in the results, by evaluating the query
+        for *record* only.  This may only be used if `_matchable` returns
+        `True`.
+        """
+        if self._predicate is None:
+            self._predicate = self._compile()
+        return self._predicate(record)
+
+    def _compile(self):
+        """
+        Return a function which accepts a record and returns `True` if it is
+        in the results, by evaluating the query for that record only.  This
+        may only be used if `_matchable` returns `True`.  Comparisons are
+        evaluated from the record's value, set operations combine the
+        functions of their arguments, and other operations are evaluated by
+        calling ``op.match(record, *args)``.
+        """
+        op, args = self._op, self._args
+        if op in _comparisons:
+            return _compile_comparison(op, *args)
+        elif op in (_and, _or, _sub, _xor):
+            a, b = [q._compile() for q in args]
+            if op is _and:
+                return lambda r: a(r) and b(r)
+            elif op is _or:
+                return lambda r: a(r) or b(r)
+            elif op is _sub:
+                return lambda r: a(r) and not b(r)
+            else:
+                return lambda r: a(r) != b(r)
+        match = op.match
+        return lambda r: match(r, *args)
+
+    def _depends(self):
+        """
+        Return a pair of the set of stores which the query depends on, and
+        the set of fields, or `None` if any field may affect the results.
+        """
+        from ._field import Field
+        from ._store import Index, HashIndex
+        from ._table import TableMeta
+        stores, fields = set(), set()
+        for a in self._args:
+            if isinstance(a, Query):
+                s, f = a._depends()
+                stores.update(s)
+                fields = None if f is None or fields is None else fields | f
+            elif isinstance(a, TableMeta):
+                stores.add(a._store)
+                fields = None
+            elif isinstance(a, (Field, Index, HashIndex)):
+                field = a if isinstance(a, Field) else a.field
+                stores.add(field.owner._store)
+                if fields is not None:
+                    fields.add(field)
+        if self._volatile:
+            fields = None
+        return stores, fields
 
     def __contains__(self, record):
-        return record in set(self)
+        if self._fresh():
+            return record in self._results
+        elif self._matchable():
+            return self._match(record)
+        return any(r is record for r in self._evaluate())
 
     def __eq__(self, other):
         return isinstance(other, Query) and set(self) == set(other)
 
     def __iter__(self):
-        if self._results is None:
+        if not self._fresh():
             self()
         return iter(self._results)
 
     def __len__(self):
-        return len(set(self))
+        n = self._count()
+        if n is None:
+            if not self._fresh():
+                self()
+            n = len(self._results)
+        return n
 
     def __and__(self, other):
         if not isinstance(other, Query):
             raise TypeError("Target of '&' operation must be another query.")
         q = Query(_and, self, other)
         q._adder.inherit(self).inherit(other)
+        if (self._terms is not None and other._terms is not None and
+                not set(self._terms) & set(other._terms)):
+            q._terms = dict(self._terms)
+            q._terms.update(other._terms)
         return q
 
     def __or__(self, other):
@@ -301,6 +988,12 @@ class Query(object):
                  'le': ' <= ',
                  'and': ' & '}
 
+        if self._op is _between:
+            index, lower_op, lower, upper_op, upper = self._args
+            ops = {operator.gt: '<', operator.ge: '<=',
+                   operator.lt: '<', operator.le: '<='}
+            return '%s %s %s %s %s' % (lower, ops[lower_op], index,
+                                       ops[upper_op], upper)
         strargs = []
         for a in self._args:
             if isinstance(a, Query):
@@ -346,14 +1039,116 @@ class Query(object):
         self._results = None
         return record
 
+    def aggregate(self, **kwargs):
+        """
+        Return a `dict` of aggregate values of fields over the results.  Each
+        keyword is the name of an aggregate function, and its value is a
+        `Field` of the queried table.  For example::
+
+            >>> from norman import Table, Field, query
+            >>> class Sale(Table):
+            ...     amount = Field()
+            >>> for amount in (5, 10, 30):
+            ...     sale = Sale(amount=amount)
+            >>> totals = (Sale.amount > 5).aggregate(sum=Sale.amount,
+            ...                                      avg=Sale.amount)
+            >>> sorted(totals.items())
+            [('avg', 20.0), ('sum', 40)]
+
+        The aggregate functions are ``sum``, ``avg``, ``min``, ``max`` and
+        ``count``.  `NotSet` values are ignored, and ``avg``, ``min`` and
+        ``max`` return `NotSet` if there are no other values.  ``min`` and
+        ``max`` compare values using `Field.key`.
+
+        The values are read directly from the store, and if most of the
+        records in the table are in the results, the whole column is read
+        at once.
+        """
+        for name in kwargs:
+            if name not in _aggregates:
+                raise TypeError("Unknown aggregate '%s'" % name)
+        records = None
+        columns = {}
+        results = {}
+        for name, field in kwargs.items():
+            store = field.owner._store
+            if id(field) in columns:
+                pass
+            elif (self.table is field.owner and
+                    self._count() == store.record_count()):
+                columns[id(field)] = [v for r, v in store.iter_field(field)]
+            else:
+                if records is None:
+                    records = (self._results if self._fresh() else
+                               set(self._iter()))
+                columns[id(field)] = _column(records, field)
+            results[name] = _aggregates[name](field, columns[id(field)])
+        return results
+
+    def count(self):
+        """
+        Return the number of results, without storing them.  Where possible,
+        this is found from positions in the indexes, without reading any
+        records.  This includes comparisons on a field (except for ``!=``
+        on an ordered field with a value which cannot be ordered), ranges
+        such as ``(MyTable.age >= 18) & (MyTable.age < 65)``, and stored
+        results.  Otherwise, the results are counted as they are evaluated.
+        """
+        n = self._count()
+        if n is None:
+            n = sum(1 for r in self._iter())
+        return n
+
     def delete(self):
         """
         Delete all records matching the query from their table.  If no
-        records match, nothing is deleted.
+        records match, nothing is deleted.  Records are deleted in a single
+        batch for each table, as by `Table.delete`.
+        """
+        groups = {}
+        for record in self:
+            groups.setdefault(record.__class__, []).append(record)
+        for table, records in groups.items():
+            table.delete(records)
+
+    def update(self, **kwargs):
+        """
+        Set field values, given as keyword arguments, in all records
+        matching the query.  For example::
+
+            (MyTable.status == 'open').update(status='closed')
+
+        This is similar to setting the attributes of each record in turn,
+        but each new value is validated once and the indexes are updated in
+        a single batch.  Records are then validated with `Table.validate`
+        and the validation hooks.  If any of this fails, then all records
+        are returned to their previous values and the exception is
+        re-raised.
         """
-        for r in self:
-            # Check if its been deleted by validate_delete
-            r.__class__.delete(r)
+        groups = {}
+        for record in self:
+            groups.setdefault(record.__class__, []).append(record)
+        changes = []
+        for table, records in groups.items():
+            data = table._update_data(records, kwargs)
+            items = [(r, data) for r in records]
+            table._store.check_unique(items)
+            changes.append((table._store, items))
+        done = []
+        try:
+            for store, items in changes:
+                old = [(r, dict((f, store.get(r, f)) for f in data))
+                       for r, data in items]
+                done.append((store, old))
+                store.bulk_set(items)
+            for records in groups.values():
+                for record in records:
+                    record._validate()
+        except:
+            for store, old in reversed(done):
+                store.bulk_set(old)
+            raise
+        self._results = None
 
     def field(self, fieldname):
         """
@@ -387,9 +1182,74 @@ class Query(object):
             return result
         q = Query(op, self, fieldname, table=False,
                   adder=_FieldAdder(self.table, fieldname))
+        op.kind = 'field'
         q._adder.inherit(self)
+        q._volatile = True
         return q
 
+    def explain(self, analyze=False):
+        """
+        Return a `QueryPlan` describing how the query is evaluated.  This is
+        a tree of nodes, one for each part of the query, with the estimated
+        number of results of each.  If *analyze* is `True`, each part is also
+        evaluated, and the actual number of results and the time taken are
+        recorded.  For example::
+
+            >>> from norman import Table, Field
+            >>> class Person(Table):
+            ...     name = Field(index='hash')
+            ...     age = Field()
+            >>> for i in range(10):
+            ...     person = Person(name='P' + str(i), age=i)
+            >>> plan = ((Person.age > 2) & (Person.name == 'P5')).explain()
+            >>> print(plan)
+            set: planned (Person.name == P5) & (Person.age > 2) (estimate 1)
+                index: Person.name == P5 (estimate 1)
+                index: Person.age > 2 (estimate 7)
+            >>> print(plan.children[0].index.field)
+            Person.name
+        """
+        return self._explain(analyze, root=True)
+
+    def group_by(self, field):
+        """
+        Return a list of ``(value, records)`` pairs, grouping the results by
+        the values of *field*, where *records* is a list of the results with
+        that value.  Values are grouped if the index for the field considers
+        them equal, so for an ordered `Index`, values with the same
+        `Field.key` are grouped, and *value* is the value of the first
+        record.  The groups are ordered by `Field.key`, with values which
+        cannot be ordered last.
+
+        If the field has an ordered `Index` and the query matches at least
+        half of the table, the groups are read from runs of equal keys in
+        the index, and each record is checked against the query.  Otherwise,
+        the results are evaluated and grouped by value.
+        """
+        store = field.owner._store
+        index = store.indexes[field]
+        if not self._read_index(index, None):
+            return _group(list(self._iter()), field, index)
+        contains = self._index_filter(index)
+        groups = []
+        for key, run in index._sorted.runs():
+            if contains is not None:
+                run = [r for r in run if contains(r)]
+            if run:
+                groups.append((store.get(run[0], field), run))
+        records = [r for items in index._unordered.values()
+                   for v, r in items if contains is None or contains(r)]
+        return groups + _group(records, field, index)
+
+    def live(self, callback=None):
+        """
+        Return a `LiveQuery` of the results, which is kept up to date as
+        records change.  If *callback* is given, it is called as
+        ``callback(added, removed)`` with sets of records whenever the
+        results change.
+        """
+        return LiveQuery(self, callback)
+
     def one(self, default=_Sentinal):
         """
         Return a single value from the query results.  If the query is
@@ -397,7 +1257,7 @@ class Query(object):
         otherwise an `IndexError` is raised.
         """
         try:
-            return next(iter(self))
+            return next(self.stream())
         except StopIteration:
             pass
         except:
@@ -406,3 +1266,231 @@ class Query(object):
             raise IndexError('Query has no results')
         else:
             return default
+
+    def order_by(self, field, reverse=False):
+        """
+        Return an `OrderedQuery` of the results, ordered by the values of
+        *field*, which is a `Field` of the queried table.  The methods
+        `OrderedQuery.limit` and `OrderedQuery.offset` can then be used to
+        select a page of results, for example::
+
+            newest = query(Order).order_by(Order.date, reverse=True).limit(20)
+        """
+        return OrderedQuery(self, field, reverse)
+
+    def stream(self):
+        """
+        Return an iterator over the query results, which evaluates the
+        query as it is read.  This is useful if only the first few results
+        are needed, for example::
+
+            first = list(itertools.islice(query.stream(), 10))
+
+        If the query has stored results which are still valid, they are
+        used instead.  Unlike ``iter(query)``, the results are not stored,
+        and records in the queried tables should not be changed while
+        reading from the iterator.
+        """
+        return self._iter()
+
+
+class OrderedQuery(object):
+
+    """
+    The results of a `Query`, ordered by the values of a field.  This is
+    created by `Query.order_by`, and supports iteration over the results
+    in order.  Records with values which cannot be ordered, such as
+    `NotSet`, are returned last, in no particular order.  The results are
+    evaluated each time they are read, and are not stored.
+
+    If the field has an ordered `Index` and the query matches a large part
+    of the table, records are read from the index in order, and checked
+    against the query, so that only as many as are needed are read.
+    Otherwise, the query is evaluated, and only the first ``offset + limit``
+    results are kept and sorted, so selecting a page of *k* results takes
+    O(n log k) time.
+    """
+
+    def __init__(self, query, field, reverse=False, offset=0, limit=None):
+        self.query = query
+        self.field = field
+        self.reverse = reverse
+        self._offset = offset
+        self._limit = limit
+
+    def limit(self, n):
+        """
+        Return a new `OrderedQuery` containing at most the first *n* results.
+        """
+        if self._limit is not None:
+            n = min(n, self._limit)
+        return OrderedQuery(self.query, self.field, self.reverse,
+                            self._offset, n)
+
+    def offset(self, k):
+        """
+        Return a new `OrderedQuery` which skips the first *k* results.
+        """
+        limit = self._limit
+        if limit is not None:
+            limit = max(0, limit - k)
+        return OrderedQuery(self.query, self.field, self.reverse,
+                            self._offset + k, limit)
+
+    def _stop(self):
+        if self._limit is not None:
+            return self._offset + self._limit
+
+    def __iter__(self):
+        store = self.field.owner._store
+        index = store.indexes[self.field]
+        stop = self._stop()
+        if self.query._read_index(index, stop):
+            records = _walk(index, self.query._index_filter(index),
+                            self.reverse)
+            # The page is copied, so records may be changed while iterating
+            return iter(list(itertools.islice(records, self._offset, stop)))
+        records = _top(self.query._iter(), self.field, self.reverse, stop)
+        return iter(records[self._offset:])
+
+
+class QueryPlan(object):
+
+    """
+    A node in the tree returned by `Query.explain`, describing one part of a
+    query.  `kind` is one of the following:
+
+    =========== ===============================================================
+    Kind        Description
+    =========== ===============================================================
+    index       A comparison using an `Index` or `HashIndex`.
+    scan        A comparison which scans every record, using a `ScanIndex`.
+    range       Lower and upper bounds on a field, found with one `Index`
+                lookup.
+    unique      A lookup in `Store.unique_index`.
+    set         A set operation.  If it is a planned intersection, the first
+                of the `children` is evaluated, and its records are checked
+                against the others in order.
+    field       A `Query.field` traversal.
+    function    A custom function, created by `query`.
+    results     Stored results of a query which are still valid.
+    =========== ===============================================================
+
+    `description` is a string describing the node, `index` is the index
+    used, if any, and `estimate` is the estimated maximum number of results,
+    or `None` if this is not known.  `children` is a list of nodes for
+    the queries this one is evaluated from.
+
+    If the plan was analyzed, `rows` is the number of results of the node
+    and `time` is the time in seconds taken to evaluate them, including the
+    time taken by its children.  Each node is evaluated separately, so the
+    time taken by a child node may also be counted in its parent.  If the
+    plan was not analyzed, these are `None`.
+
+    The string representation of a plan is an indented tree, with one line
+    per node.
+    """
+
+    def __init__(self, kind, description, index=None, estimate=None,
+                 children=()):
+        self.kind = kind
+        self.description = description
+        self.index = index
+        self.estimate = estimate
+        self.children = list(children)
+        self.rows = None
+        self.time = None
+
+    def _lines(self, indent):
+        stats = ['estimate %s' % ('?' if self.estimate is None
+                                  else self.estimate)]
+        if self.rows is not None:
+            stats.append('rows %s' % self.rows)
+        if self.time is not None:
+            stats.append('time %.3f ms' % (self.time * 1000))
+        lines = ['%s%s: %s (%s)' % (indent, self.kind, self.description,
+                                    ', '.join(stats))]
+        for child in self.children:
+            lines.extend(child._lines(indent + '    '))
+        return lines
+
+    def __str__(self):
+        return '\n'.join(self._lines(''))
+
+
+class LiveQuery(object):
+
+    """
+    The results of a `Query`, which are updated whenever the queried tables
+    change.  This is created by `Query.live`, and supports ``len``, ``in``
+    and iteration over the current results, which are also available
+    as `results`.  For example::
+
+        >>> from norman import Table, Field
+        >>> class Order(Table):
+        ...     status = Field()
+        >>> live = (Order.status == 'open').live()
+        >>> order = Order(status='open')
+        >>> order in live
+        True
+        >>> order.status = 'closed'
+        >>> len(live)
+        0
+
+    For queries built from `Field` comparisons, the set operations and
+    `query` on a table, only the records which have changed are checked,
+    so each change takes constant time.  Other queries, such as those
+    created by `Query.field` or by `query` on another query, are evaluated
+    again whenever a table they depend on changes.
+
+    A `LiveQuery` is updated until `close` is called, so this should be
+    called when it is no longer needed.
+    """
+
+    def __init__(self, query, callback=None):
+        self.query = query
+        self.callback = callback
+        self._matchable = query._matchable()
+        self._stores, self._fields = query._depends()
+        self.results = set(query._evaluate())
+        for store in self._stores:
+            store.listeners.append(self._changed)
+
+    def close(self):
+        """
+        Stop updating the results.
+        """
+        for store in self._stores:
+            store.listeners.remove(self._changed)
+        self._stores = set()
+
+    def _changed(self, records, fields):
+        if (fields is not None and self._fields is not None and
+                not self._fields.intersection(fields)):
+            return
+        if records is None or not self._matchable:
+            results = set(self.query._evaluate())
+            added = results - self.results
+            removed = self.results - results
+            self.results = results
+        else:
+            added, removed = set(), set()
+            for record in records:
+                if self.query._match(record):
+                    if record not in self.results:
+                        added.add(record)
+                elif record in self.results:
+                    removed.add(record)
+            self.results |= added
+            self.results -= removed
+        if self.callback is not None and (added or removed):
+            self.callback(added, removed)
+
+    def __contains__(self, record):
+        return record in self.results
+
+    def __iter__(self):
+        return iter(self.results)
+
+    def __len__(self):
+        return len(self.results)
@@ -16,15 +16,322 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 675 Mass Ave, Cambridge, MA 02139, USA.
 
+import array
+import binascii
 import collections
+import heapq
+import operator
+import sys
 from bisect import bisect_left, bisect_right
-from ._field import NotSet
+from ._except import ValidationError
+from ._field import (NotSet, _key, _elements, _has_element, _has_prefix,
+                     _has_substring, _tokens, _point, _in_box, _distance2,
+                     _check_string)
+from ._six import text_type
+
+try:
+    _unichr = unichr
+except NameError:
+    _unichr = chr
+
+
+def _successor(prefix):
+    """
+    Return the lowest string which is greater than every string starting
+    with *prefix*, or `None` if there is none.
+    """
+    if isinstance(prefix, text_type):
+        prefix = prefix.rstrip(_unichr(sys.maxunicode))
+        if prefix:
+            return prefix[:-1] + _unichr(ord(prefix[-1]) + 1)
+    else:
+        prefix = bytearray(prefix.rstrip(b'\xff'))
+        if prefix:
+            prefix[-1] += 1
+            return bytes(prefix)
+    return None
+
+
+_LIST = object()
+_UNHASHABLE = object()
+
+
+def _freeze(key):
+    """
+    Return a hashable form of *key*, which may be an unhashable key such as
+    a list.  Lists become tuples, marked so that they are not equal to a
+    tuple with the same items, and sets become frozensets.  Other
+    unhashable keys are wrapped with their `id`.
+    """
+    if isinstance(key, list):
+        return (_LIST, tuple(_freeze(k) for k in key))
+    elif isinstance(key, tuple):
+        return tuple(_freeze(k) for k in key)
+    elif isinstance(key, (set, frozenset)):
+        return frozenset(_freeze(k) for k in key)
+    try:
+        hash(key)
+    except TypeError:
+        return (_UNHASHABLE, id(key))
+    return key
+
+
+def _points_in_box(points, lower, upper):
+    # Filter (record, point) items by a box
+    return (r for r, p in points if _in_box(p, lower, upper))
+
+
+def _points_in_radius(points, centre, radius):
+    # Filter (record, point) items by distance from centre
+    radius = radius * radius
+    return (r for r, p in points if _distance2(p, centre) <= radius)
+
+
+def _nearest_points(points, point, k):
+    # Return the records of the k (record, point) items closest to point
+    nearest = heapq.nsmallest(k, points,
+                              key=lambda item: _distance2(item[1], point))
+    return [r for r, p in nearest]
+
+
+class _SortedList(object):
+
+    """
+    A sorted sequence of ``(key, value)`` pairs, stored as a list of
+    blocks, each containing at most ``2 * _load`` items.  Lookups bisect
+    the block maximums and then a single block, and writes only shift the
+    items within one block, so both are effectively O(log n).
+
+    Positions in the list are given as ``(block, offset)`` tuples, as
+    returned by `bisect_left` and `bisect_right`, and the end of the list
+    is ``(len(blocks), 0)``.
+    """
+
+    _load = 1000
+
+    def __init__(self):
+        self.clear()
+
+    def __len__(self):
+        return self._len
+
+    def clear(self):
+        """
+        Delete all items.
+        """
+        self._keys = []
+        self._values = []
+        self._maxes = []
+        self._len = 0
+
+    def load(self, keys, values):
+        """
+        Replace the contents with *keys* and *values*, which must already
+        be sorted by key.
+        """
+        load = self._load
+        keys = list(keys)
+        values = list(values)
+        self._keys = [keys[i:i + load] for i in range(0, len(keys), load)]
+        self._values = [values[i:i + load]
+                        for i in range(0, len(values), load)]
+        self._maxes = [k[-1] for k in self._keys]
+        self._len = len(keys)
+
+    def keys(self, start=None, stop=None, reverse=False):
+        """
+        Iterate over keys between two positions.
+        """
+        return self._iter(self._keys, start, stop, reverse)
+
+    def values(self, start=None, stop=None, reverse=False):
+        """
+        Iterate over values between two positions.
+        """
+        return self._iter(self._values, start, stop, reverse)
+
+    def find(self, keys):
+        """
+        Iterate over the values of all items with any of *keys*, which must
+        be sorted.  The items are read in a single pass, by bisecting from
+        the position of the previous key.
+        """
+        nblocks = len(self._keys)
+        b, i = 0, 0
+        for n, key in enumerate(keys):
+            if n and key == previous:
+                continue
+            previous = key
+            start = b
+            b = bisect_left(self._maxes, key, b)
+            if b == nblocks:
+                return
+            i = bisect_left(self._keys[b], key, i if b == start else 0)
+            j, c = i, b
+            while c < nblocks:
+                block, values = self._keys[c], self._values[c]
+                while j < len(block) and block[j] == key:
+                    yield values[j]
+                    j += 1
+                if j < len(block):
+                    break
+                c, j = c + 1, 0
+
+    def runs(self):
+        """
+        Iterate over ``(key, values)`` for each run of equal keys, in order.
+        """
+        key, run = None, []
+        for keys, values in zip(self._keys, self._values):
+            for k, v in zip(keys, values):
+                if run and k == key:
+                    run.append(v)
+                else:
+                    if run:
+                        yield key, run
+                    key, run = k, [v]
+        if run:
+            yield key, run
+
+    def count(self, start=None, stop=None):
+        """
+        Return the number of items between two positions.
+        """
+        b0, i0 = (0, 0) if start is None else start
+        b1, i1 = (len(self._keys), 0) if stop is None else stop
+        if (b0, i0) >= (b1, i1):
+            return 0
+        elif b0 == b1:
+            return i1 - i0
+        return (len(self._keys[b0]) - i0 + i1 +
+                sum(len(k) for k in self._keys[b0 + 1:b1]))
+
+    def _iter(self, blocks, start, stop, reverse):
+        b0, i0 = (0, 0) if start is None else start
+        b1, i1 = (len(blocks), 0) if stop is None else stop
+        last = min(b1, len(blocks) - 1)
+        if reverse:
+            for b in range(last, b0 - 1, -1):
+                block = blocks[b]
+                lo = i0 if b == b0 else 0
+                hi = i1 if b == b1 else len(block)
+                for i in range(hi - 1, lo - 1, -1):
+                    yield block[i]
+        else:
+            for b in range(b0, last + 1):
+                block = blocks[b]
+                lo = i0 if b == b0 else 0
+                hi = i1 if b == b1 else len(block)
+                for i in range(lo, hi):
+                    yield block[i]
+
+    def bisect_left(self, key):
+        """
+        Return the position of the first item with a key not less than
+        *key*.
+        """
+        b = bisect_left(self._maxes, key)
+        if b == len(self._maxes):
+            return (b, 0)
+        return (b, bisect_left(self._keys[b], key))
+
+    def bisect_right(self, key):
+        """
+        Return the position of the first item with a key greater than
+        *key*.
+        """
+        b = bisect_right(self._maxes, key)
+        if b == len(self._maxes):
+            return (b, 0)
+        return (b, bisect_right(self._keys[b], key))
+
+    def add(self, key, value):
+        """
+        Insert a new item.  If equal keys are found, add to the right.
+        """
+        keys, values, maxes = self._keys, self._values, self._maxes
+        if not maxes:
+            keys.append([key])
+            values.append([value])
+            maxes.append(key)
+            self._len = 1
+            return
+        b = bisect_right(maxes, key)
+        if b == len(maxes):
+            b -= 1
+            keys[b].append(key)
+            values[b].append(value)
+            maxes[b] = key
+        else:
+            i = bisect_right(keys[b], key)
+            keys[b].insert(i, key)
+            values[b].insert(i, value)
+        self._len += 1
+        if len(keys[b]) > 2 * self._load:
+            self._split(b)
+
+    def remove(self, key, value):
+        """
+        Remove the first item matching *key* and *value*.  `ValueError` is
+        raised if there is no such item.
+        """
+        keys, values = self._keys, self._values
+        b, i = self.bisect_left(key)
+        while b < len(keys):
+            kblock, vblock = keys[b], values[b]
+            while i < len(kblock):
+                if key < kblock[i]:
+                    raise ValueError('%r is not in list' % (value,))
+                if vblock[i] == value:
+                    self._delete(b, i)
+                    return
+                i += 1
+            b, i = b + 1, 0
+        raise ValueError('%r is not in list' % (value,))
+
+    def _delete(self, b, i):
+        keys, values, maxes = self._keys, self._values, self._maxes
+        del keys[b][i]
+        del values[b][i]
+        self._len -= 1
+        if not keys[b]:
+            del keys[b]
+            del values[b]
+            del maxes[b]
+        else:
+            maxes[b] = keys[b][-1]
+            if len(keys[b]) < self._load // 2 and len(keys) > 1:
+                self._merge(b - 1 if b > 0 else b)
+
+    def _split(self, b):
+        keys, values, maxes = self._keys, self._values, self._maxes
+        half = len(keys[b]) // 2
+        keys.insert(b + 1, keys[b][half:])
+        values.insert(b + 1, values[b][half:])
+        del keys[b][half:]
+        del values[b][half:]
+        maxes[b] = keys[b][-1]
+        maxes.insert(b + 1, keys[b + 1][-1])
+
+    def _merge(self, b):
+        """
+        Merge block *b* with block ``b + 1``.
+        """
+        keys, values, maxes = self._keys, self._values, self._maxes
+        keys[b].extend(keys[b + 1])
+        values[b].extend(values[b + 1])
+        maxes[b] = maxes[b + 1]
+        del keys[b + 1]
+        del values[b + 1]
+        del maxes[b + 1]
+        if len(keys[b]) > 2 * self._load:
+            self._split(b)
 
 
 class Index(object):
 
     """
-    An index stores records as sorted lists of ``(keyvalue, record)`` pairs,
+    An index stores records as a sorted list of ``(keyvalue, record)`` pairs,
     where *keyvalue* is a key based on the data cell value, determined by
     the return value of `Field.key`, which should always return the same,
     sortable type.  If a return value cannot be sorted, then it is stored
@@ -60,6 +367,10 @@ class Index(object):
         True
         >>> set(MyTable.numbers < '1 or 2') == set((r4,))
         True
+
+    The sorted pairs are held in fixed size blocks rather than a single
+    list, so inserting and removing records is O(log n), and range lookups
+    iterate over the blocks in place rather than copying them.
     """
 
     def __init__(self, field):
@@ -67,16 +378,48 @@ class Index(object):
         self.clear()
 
     def __len__(self):
-        return (len(self._ordered[0]) +
+        return (len(self._sorted) +
                 sum(len(d) for d in self._unordered.values()))
 
+    @property
+    def _ordered(self):
+        """
+        The ordered items as a tuple of ``(keys, records)`` lists.
+        """
+        return (list(self._sorted.keys()), list(self._sorted.values()))
+
+    @_ordered.setter
+    def _ordered(self, value):
+        self._sorted.load(*value)
+
     def clear(self):
         """
         Delete all items from the index.
         """
-        self._ordered = ([], [])
+        self._sorted = _SortedList()
         self._unordered = collections.defaultdict(list)
 
+    def _token(self, value):
+        """
+        Return a hashable token for *value*, such that equal tokens are
+        given for values which this index considers equal.
+        """
+        if value is NotSet:
+            return NotSet
+        try:
+            key = self.field.key(value)
+        except (TypeError, ValueError):
+            try:
+                hash(value)
+            except TypeError:
+                return (2, id(value))
+            return (1, value)
+        try:
+            hash(key)
+        except TypeError:
+            key = _freeze(key)
+        return (0, key)
+
     def insert(self, value, record):
         """
         Insert a new item.  If equal keys are found, add to the right.
@@ -86,16 +429,47 @@ class Index(object):
         else:
             try:
                 key = self.field.key(value)
-                i = bisect_right(self._ordered[0], key)
+                self._sorted.add(key, record)
             except (TypeError, ValueError):
                 try:
                     key = hash(value)
                 except TypeError:
                     key = id(value)
                 self._unordered[key].append((value, record))
+
+    def update(self, items):
+        """
+        Insert many ``(value, record)`` items.  This is equivalent to calling
+        `insert` for each item, but when the items are a large part of the
+        index, the ordered items are sorted once instead.
+        """
+        items = list(items)
+        ordered = []
+        for value, record in items:
+            if value is NotSet:
+                self.insert(value, record)
+                continue
+            try:
+                key = self.field.key(value)
+            except (TypeError, ValueError):
+                self.insert(value, record)
             else:
-                self._ordered[0].insert(i, key)
-                self._ordered[1].insert(i, record)
+                ordered.append((key, value, record))
+        if len(ordered) * 8 < len(self._sorted):
+            for key, value, record in ordered:
+                self.insert(value, record)
+            return
+        merged = [(k, None, r) for k, r in zip(self._sorted.keys(),
+                                                self._sorted.values())]
+        merged.extend(ordered)
+        try:
+            merged.sort(key=operator.itemgetter(0))
+        except TypeError:
+            # Some keys cannot be sorted together, so find them one by one
+            for key, value, record in ordered:
+                self.insert(value, record)
+        else:
+            self._sorted.load([i[0] for i in merged], [i[2] for i in merged])
 
     def remove(self, value, record):
         """
@@ -108,8 +482,7 @@ class Index(object):
         else:
             try:
                 key = self.field.key(value)
-                i = bisect_left(self._ordered[0], key)
-                j = bisect_right(self._ordered[0], key)
+                self._sorted.bisect_left(key)
             except (TypeError, ValueError):
                 try:
                     key = hash(value)
@@ -119,9 +492,294 @@ class Index(object):
                 if len(self._unordered[key]) == 0:
                     del self._unordered[key]
             else:
-                index = self._ordered[1][i:j].index(record) + i
-                del self._ordered[0][index]
-                del self._ordered[1][index]
+                self._sorted.remove(key, record)
+
+    def remove_many(self, items):
+        """
+        Remove many ``(value, record)`` items.  This is equivalent to calling
+        `remove` for each item, but when a large part of the index is
+        removed, it is done in a single pass over the ordered items.
+        """
+        ordered = []
+        for value, record in items:
+            if value is NotSet:
+                self.remove(value, record)
+                continue
+            try:
+                key = self.field.key(value)
+                self._sorted.bisect_left(key)
+            except (TypeError, ValueError):
+                self.remove(value, record)
+            else:
+                ordered.append((key, record))
+        if len(ordered) * 8 < len(self._sorted):
+            for key, record in ordered:
+                self._sorted.remove(key, record)
+            return
+        pending = {}
+        for key, record in ordered:
+            pending.setdefault(record, []).append(key)
+        keys, values = [], []
+        for key, record in zip(self._sorted.keys(), self._sorted.values()):
+            removed = pending.get(record)
+            if removed and key in removed:
+                removed.remove(key)
+            else:
+                keys.append(key)
+                values.append(record)
+        if len(keys) != len(self._sorted) - len(ordered):
+            raise ValueError('Items are not in the index')
+        self._sorted.load(keys, values)
+
+    def _sort_key(self, value):
+        """
+        Return ``(True, key)`` if *value* is kept in the ordered part of the
+        index, or ``(False, None)`` otherwise.
+        """
+        if value is NotSet:
+            return False, None
+        try:
+            return True, self.field.key(value)
+        except (TypeError, ValueError):
+            return False, None
+
+    def _span(self, op, key):
+        """
+        Return the start and stop positions of the ordered items in
+        ``op(index, value)`` for a value with *key*, where *op* is one of
+        `operator.eq`, `operator.lt`, `operator.le`, `operator.gt` or
+        `operator.ge`.
+        """
+        if op is operator.eq:
+            return (self._sorted.bisect_left(key),
+                    self._sorted.bisect_right(key))
+        elif op is operator.lt:
+            return None, self._sorted.bisect_left(key)
+        elif op is operator.le:
+            return None, self._sorted.bisect_right(key)
+        elif op is operator.gt:
+            return self._sorted.bisect_right(key), None
+        else:
+            return self._sorted.bisect_left(key), None
+
+    def count(self, op, value):
+        """
+        Return the number of records in ``op(index, value)``, found from
+        positions in the index without evaluating it, where *op* is a
+        comparison function from the `operator` module.  If the value cannot
+        be ordered, so that the count is not known, `None` is returned.
+        """
+        if op is operator.ne:
+            n = self.count(operator.eq, value)
+            return None if n is None else len(self) - n
+        elif value is NotSet:
+            if op is operator.eq:
+                return len(self._unordered.get(NotSet, ()))
+            return None
+        sorted_, key = self._sort_key(value)
+        if sorted_:
+            try:
+                return self._sorted.count(*self._span(op, key))
+            except TypeError:
+                pass
+        return None
+
+    def count_between(self, lower_op, lower, upper_op, upper):
+        """
+        Return the number of records in ``between(lower_op, lower, upper_op,
+        upper)``, found from positions in the index, or `None` if the bounds
+        cannot be ordered.
+        """
+        try:
+            start, stop = self._between(lower_op, lower, upper_op, upper)
+        except (TypeError, ValueError):
+            return None
+        return self._sorted.count(start, stop)
+
+    def estimate(self, op, value):
+        """
+        Return the maximum number of records in ``op(index, value)``,
+        without evaluating it, where *op* is a comparison function from the
+        `operator` module.  This is the same as `count` if it is known.
+        """
+        n = self.count(op, value)
+        if n is not None:
+            return n
+        elif op is operator.eq:
+            try:
+                return len(self._unordered.get(hash(value), ()))
+            except TypeError:
+                return len(self._unordered.get(id(value), ()))
+        return len(self)
+
+    def first(self, reverse=False):
+        """
+        Return the lowest value in the index in the order of `Field.key`, or
+        the highest if *reverse* is `True`.  This is read from the end of
+        the ordered items, so takes constant time.  If there are no values
+        which can be ordered, `NotSet` is returned.
+        """
+        for record in self._sorted.values(None, None, reverse):
+            return self.field.owner._store.get(record, self.field)
+        return NotSet
+
+    def _between(self, lower_op, lower, upper_op, upper):
+        # Return the start and stop positions for `between`.
+        start = self._span(lower_op, self.field.key(lower))[0]
+        stop = self._span(upper_op, self.field.key(upper))[1]
+        return start, max(start, stop)
+
+    def _prefix_span(self, prefix):
+        # Return the start and stop positions of values starting with
+        # *prefix*, which are consecutive when ordered by the default key.
+        lower = self.field.key(prefix)
+        upper = _successor(prefix)
+        if upper is None:
+            # Greater than all keys with the same type as lower
+            upper = (lower[0] + '\x00',)
+        else:
+            upper = self.field.key(upper)
+        start = self._sorted.bisect_left(lower)
+        return start, max(start, self._sorted.bisect_left(upper))
+
+    def startswith(self, prefix):
+        """
+        Iterate over all records with string values starting with *prefix*.
+        If the field uses the default `Field.key`, these are a single range
+        of the index, otherwise every value is checked.
+        """
+        if self.field.key is _key:
+            return self._sorted.values(*self._prefix_span(prefix))
+        return (r for r, v in self.field.owner._store.iter_field(self.field)
+                if _has_prefix(v, prefix))
+
+    def count_prefix(self, prefix):
+        """
+        Return the number of records with string values starting with
+        *prefix*, found from positions in the index, or `None` if the field
+        does not use the default `Field.key`.
+        """
+        if self.field.key is _key:
+            return self._sorted.count(*self._prefix_span(prefix))
+        return None
+
+    def contains(self, substring):
+        """
+        Iterate over all records with string values containing *substring*,
+        by checking every value.
+        """
+        return (r for r, v in self.field.owner._store.iter_field(self.field)
+                if _has_substring(v, substring))
+
+    def postings(self, tokens):
+        """
+        Return a `dict` mapping each of *tokens* which is a word in any
+        string value to a `dict` of ``{record: count}``, where *count* is the
+        number of times it appears in the record's value.  This checks
+        every value.
+        """
+        return _postings(self.field.owner._store.iter_field(self.field),
+                         tokens)
+
+    def count_token(self, token):
+        """
+        Return `None`, since the number of records containing the word
+        *token* is not known without checking them.
+        """
+        return None
+
+    def _scan_points(self):
+        for record, value in self.field.owner._store.iter_field(self.field):
+            point = _point(value)
+            if point is not None:
+                yield record, point
+
+    def within_box(self, lower, upper):
+        """
+        Iterate over all records with point values inside the box with
+        corners *lower* and *upper*, by checking every value.
+        """
+        return _points_in_box(self._scan_points(), lower, upper)
+
+    def within_radius(self, centre, radius):
+        """
+        Iterate over all records with point values no further than *radius*
+        from *centre*, by checking every value.
+        """
+        return _points_in_radius(self._scan_points(), centre, radius)
+
+    def nearest(self, point, k):
+        """
+        Return a list of the *k* records with point values closest to
+        *point*, by checking every value.
+        """
+        return _nearest_points(self._scan_points(), point, k)
+
+    def has(self, element):
+        """
+        Iterate over all records with collection values containing
+        *element*, by checking every value.
+        """
+        return (r for r, v in self.field.owner._store.iter_field(self.field)
+                if _has_element(v, element))
+
+    def count_element(self, element):
+        """
+        Return `None`, since the number of records containing *element* is
+        not known without checking them.
+        """
+        return None
+
+    def isin(self, values):
+        """
+        Return a set of the records with any of *values*.  The keys of
+        values which can be ordered are sorted, and found in a single pass
+        through the index.
+        """
+        records = set()
+        keys = []
+        for value in values:
+            sorted_, key = self._sort_key(value)
+            if sorted_:
+                keys.append(key)
+            else:
+                records.update(self == value)
+        try:
+            keys.sort()
+            records.update(self._sorted.find(keys))
+        except TypeError:
+            # Keys which cannot be compared are found one at a time
+            for value in values:
+                records.update(self == value)
+        return records
+
+    def between(self, lower_op, lower, upper_op, upper):
+        """
+        Iterate over all items with ``lower_op(key, lower)`` and
+        ``upper_op(key, upper)``, where *lower_op* is `operator.gt` or
+        `operator.ge` and *upper_op* is `operator.lt` or `operator.le`.
+        This is the same as the intersection of the two comparisons, but
+        is found directly from the ordered items.
+        """
+        return self._sorted.values(*self._between(lower_op, lower,
+                                                  upper_op, upper))
+
+    def matches(self, op, value, cell):
+        """
+        Return `True` if a record containing *cell* is in the results of
+        ``op(index, value)``, where *op* is a comparison function from the
+        `operator` module, such as `operator.eq`.
+        """
+        if op is operator.eq:
+            return self._token(cell) == self._token(value)
+        sorted_, key = self._sort_key(cell)
+        if op is operator.ne:
+            value_sorted, value_key = self._sort_key(value)
+            if not value_sorted:
+                return sorted_ or cell != value
+            return not sorted_ or key != value_key
+        value_key = self.field.key(value)
+        return sorted_ and bool(op(key, value_key))
 
     def __eq__(self, value):
         """
@@ -131,8 +789,8 @@ class Index(object):
             return (r for v, r in self._unordered[NotSet])
         try:
             key = self.field.key(value)
-            i = bisect_left(self._ordered[0], key)
-            j = bisect_right(self._ordered[0], key)
+            i = self._sorted.bisect_left(key)
+            j = self._sorted.bisect_right(key)
         except (TypeError, ValueError):
             try:
                 key = hash(value)
@@ -140,7 +798,7 @@ class Index(object):
                 key = id(value)
             return (r for v, r in self._unordered[key] if v == value)
         else:
-            return iter(self._ordered[1][i:j])
+            return self._sorted.values(i, j)
 
     def __ne__(self, value):
         """
@@ -148,8 +806,8 @@ class Index(object):
         """
         try:
             key = self.field.key(value)
-            i = bisect_left(self._ordered[0], key)
-            j = bisect_right(self._ordered[0], key)
+            i = self._sorted.bisect_left(key)
+            j = self._sorted.bisect_right(key)
         except (TypeError, ValueError):
             try:
                 key = hash(value)
@@ -159,15 +817,15 @@ class Index(object):
                 for d in l:
                     if d[0] != value:
                         yield d[1]
-            for r in self._ordered[1]:
+            for r in self._sorted.values():
                 yield r
         else:
             for l in self._unordered.values():
                 for r in l:
                     yield r[1]
-            for r in self._ordered[1][:i]:
+            for r in self._sorted.values(None, i):
                 yield r
-            for r in self._ordered[1][j:]:
+            for r in self._sorted.values(j, None):
                 yield r
 
     def __le__(self, value):
@@ -175,151 +833,1725 @@ class Index(object):
         Iterate over all items with ``key <= k``
         """
         key = self.field.key(value)
-        i = bisect_right(self._ordered[0], key)
-        return iter(self._ordered[1][:i])
+        i = self._sorted.bisect_right(key)
+        return self._sorted.values(None, i)
 
     def __lt__(self, value):
         """
         Iterate over all items with ``key < k``
         """
         key = self.field.key(value)
-        i = bisect_left(self._ordered[0], key)
-        return iter(self._ordered[1][:i])
+        i = self._sorted.bisect_left(key)
+        return self._sorted.values(None, i)
 
     def __ge__(self, value):
         """
         Iterate over all items with ``key >= k``
         """
         key = self.field.key(value)
-        i = bisect_left(self._ordered[0], key)
-        return iter(self._ordered[1][i:])
+        i = self._sorted.bisect_left(key)
+        return self._sorted.values(i, None)
 
     def __gt__(self, value):
         """
         Iterate over all items with ``key > k``
         """
         key = self.field.key(value)
-        i = bisect_right(self._ordered[0], key)
-        return iter(self._ordered[1][i:])
+        i = self._sorted.bisect_right(key)
+        return self._sorted.values(i, None)
 
     def __str__(self):
         return str(self.field)
 
 
-class Store(object):
+class HashIndex(object):
 
     """
-    Stores are designed to hide the implementation details and expose
-    a consistent API, so that they can be switched out without any other
-    changes to the table.
+    A hash index stores records in a `dict` of sets, keyed by the data
+    cell value.  This is used for fields created with ``index='hash'``,
+    which are only expected to be queried for equality.  Inserting and
+    removing records, as well as equality lookups, are O(1) and never
+    evaluate `Field.key`.  Values which are not hashable are stored by `id`,
+    so equality checks return identity matches, as for `Index`.
 
-    Tables are exposed as an array of cells, where each cell is identified
-    by `Table` and `Field` instances.  Cells are unordered, although
-    implementations may order them internally.
+    Ordering comparisons are supported for compatibility with `Index`, but
+    scan every distinct value in the index, using `Field.key` to compare
+    them.
 
-    The Store is tolerant of missing values.  `get` will return defaults if
-    the record requested does not exist.  `set` will add a new record
-    if the record does not exist.
+        >>> from norman import Table, Field
+        >>> class MyTable(Table):
+        ...    status = Field(index='hash')
+        ...
+        >>> r1 = MyTable(status='open')
+        >>> r2 = MyTable(status='closed')
+        >>> set(MyTable.status == 'open') == set((r1,))
+        True
     """
 
-    def __init__(self):
-        self.indexes = {}
-        self.fields = {}
+    def __init__(self, field):
+        self.field = field
         self.clear()
 
-    def add_field(self, field):
+    def __len__(self):
+        return (sum(len(s) for s in self._hashed.values()) +
+                sum(len(l) for l in self._unhashed.values()))
+
+    def clear(self):
         """
-        Called whenever a new field is added to the table.
+        Delete all items from the index.
         """
-        self.indexes[field] = Index(field)
-        self.fields[field.name] = field
+        self._hashed = {}
+        self._unhashed = {}
 
-    def add_record(self, record):
+    def _token(self, value):
         """
-        Called whenever a new record is created.
+        Return a hashable token for *value*, such that equal tokens are
+        given for values which this index considers equal.
         """
-        self._data.setdefault(record, {})
-        for field in self.fields.values():
-            self.indexes[field].insert(field.default, record)
+        try:
+            hash(value)
+        except TypeError:
+            return (2, id(value))
+        return (1, value)
 
-    def clear(self):
+    def insert(self, value, record):
         """
-        Delete all records in the store.
+        Insert a new item.
         """
-        self._data = {}
-        for i in self.indexes.values():
-            i.clear()
+        try:
+            self._hashed.setdefault(value, set()).add(record)
+        except TypeError:
+            self._unhashed.setdefault(id(value), []).append((value, record))
 
-    def get(self, record, field):
+    def update(self, items):
         """
-        Return the value in a cell specified by *record* and *field*.  This
-        should respect any field defaults.  If this is called with a record
-        that has not been added, it will be added.
+        Insert many ``(value, record)`` items.
         """
-        return self._data.get(record, {}).get(field, field.default)
+        for value, record in items:
+            self.insert(value, record)
 
-    def has_record(self, record):
+    def remove_many(self, items):
         """
-        Return True if the record has an entry in the data store.
+        Remove many ``(value, record)`` items.
         """
-        return record in self._data
+        for value, record in items:
+            self.remove(value, record)
 
-    def iter_field(self, field):
+    def remove(self, value, record):
         """
-        Iterate over pairs of ``(record, value)`` for the specified field.
-        This should respect any field defaults.  If this is called with a
-        field that has not been added, the behaviour is unspecified.
+        Remove ``(value, record)``.
         """
-        for record, data in self._data.items():
-            yield record, data.get(field, field.default)
+        try:
+            records = self._hashed[value]
+        except TypeError:
+            items = self._unhashed[id(value)]
+            items.remove((value, record))
+            if not items:
+                del self._unhashed[id(value)]
+        else:
+            records.remove(record)
+            if not records:
+                del self._hashed[value]
 
-    def iter_records(self):
+    def _items(self):
         """
-        Return an iterator over all records in the data store.
+        Iterate over ``(value, records)`` for every distinct value.
         """
-        return iter(self._data.keys())
+        for value, records in self._hashed.items():
+            yield value, records
+        for items in self._unhashed.values():
+            for value, record in items:
+                yield value, (record,)
 
-    def record_count(self):
+    def count(self, op, value):
         """
-        Return the number of records in the table.
+        Return the number of records in ``op(index, value)`` without
+        evaluating it, where *op* is `operator.eq` or `operator.ne`.  For
+        other comparisons, `None` is returned.
         """
-        return len(self._data)
+        if op is operator.eq:
+            try:
+                return len(self._hashed.get(value, ()))
+            except TypeError:
+                return len(self._unhashed.get(id(value), ()))
+        elif op is operator.ne and not self._unhashed:
+            n = self.count(operator.eq, value)
+            return len(self) - n
+        return None
 
-    def remove_record(self, record):
+    def estimate(self, op, value):
         """
-        Remove a record.
+        Return the maximum number of records in ``op(index, value)``,
+        without evaluating it, where *op* is a comparison function from the
+        `operator` module.  This is the same as `count` if it is known.
         """
-        for field in self.fields.values():
-            value = self.get(record, field)
-            self.indexes[field].remove(value, record)
-        del self._data[record]
+        n = self.count(op, value)
+        return len(self) if n is None else n
 
-    def remove_field(self, field):
+    def startswith(self, prefix):
         """
-        Remove a field.
+        Iterate over all records with string values starting with *prefix*,
+        by checking every distinct value.
         """
-        for r in self._data.values():
-            r.pop(field, None)
+        for value, records in self._items():
+            if _has_prefix(value, prefix):
+                for r in records:
+                    yield r
 
-    def set(self, record, field, value):
+    def count_prefix(self, prefix):
         """
-        Set the data in a record.
+        Return `None`, since the number of records with values starting with
+        *prefix* is not known without checking them.
         """
-        old = self.get(record, field)
-        if old is not value:
-            self._data[record][field] = value
-            index = self.indexes[field]
-            index.remove(old, record)
-            index.insert(value, record)
+        return None
 
-    def setdefault(self, field, value):
+    def contains(self, substring):
         """
-        Called when the default value of a field in changed.
+        Iterate over all records with string values containing *substring*,
+        by checking every distinct value.
         """
-        if value != field.default:
-            index = self.indexes[field]
-            unset = set(r for r, d in self._data.items() if field not in d)
-            for r in (index == field.default):
-                if r in unset:
-                    index.remove(self._default, r)
-                    index.insert(value, r)
+        for value, records in self._items():
+            if _has_substring(value, substring):
+                for r in records:
+                    yield r
+
+    def postings(self, tokens):
+        """
+        Return a `dict` mapping each of *tokens* to the records containing
+        it, as for `Index.postings`, by checking every distinct value.
+        """
+        return _postings(((r, v) for v, records in self._items()
+                          for r in records), tokens)
+
+    def count_token(self, token):
+        """
+        Return `None`, as for `Index.count_token`.
+        """
+        return None
+
+    def _scan_points(self):
+        for value, records in self._items():
+            point = _point(value)
+            if point is not None:
+                for record in records:
+                    yield record, point
+
+    def within_box(self, lower, upper):
+        """
+        Iterate over all records with point values inside the box with
+        corners *lower* and *upper*, by checking every distinct value.
+        """
+        return _points_in_box(self._scan_points(), lower, upper)
+
+    def within_radius(self, centre, radius):
+        """
+        Iterate over all records with point values no further than *radius*
+        from *centre*, by checking every distinct value.
+        """
+        return _points_in_radius(self._scan_points(), centre, radius)
+
+    def nearest(self, point, k):
+        """
+        Return a list of the *k* records with point values closest to
+        *point*, by checking every distinct value.
+        """
+        return _nearest_points(self._scan_points(), point, k)
+
+    def has(self, element):
+        """
+        Iterate over all records with collection values containing
+        *element*, by checking every distinct value.
+        """
+        for value, records in self._items():
+            if _has_element(value, element):
+                for r in records:
+                    yield r
+
+    def count_element(self, element):
+        """
+        Return `None`, as for `Index.count_element`.
+        """
+        return None
+
+    def isin(self, values):
+        """
+        Return a set of the records with any of *values*, by looking up
+        each value.
+        """
+        records = set()
+        for value in values:
+            records.update(self == value)
+        return records
+
+    def first(self, reverse=False):
+        """
+        Return the lowest value in the index in the order of `Field.key`, or
+        the highest if *reverse* is `True`, by comparing every distinct value.
+        If there are no values which can be ordered, `NotSet` is returned.
+        """
+        best, best_key = NotSet, None
+        for value, records in self._items():
+            if value is NotSet:
+                continue
+            try:
+                key = self.field.key(value)
+            except (TypeError, ValueError):
+                continue
+            if (best is NotSet or
+                    (key > best_key if reverse else key < best_key)):
+                best, best_key = value, key
+        return best
+
+    def matches(self, op, value, cell):
+        """
+        Return `True` if a record containing *cell* is in the results of
+        ``op(index, value)``, where *op* is a comparison function from the
+        `operator` module, such as `operator.eq`.
+        """
+        if op is operator.eq:
+            return self._token(cell) == self._token(value)
+        if op is operator.ne:
+            return not (cell is value or cell == value)
+        if cell is NotSet:
+            return False
+        key = self.field.key(value)
+        try:
+            return bool(op(self.field.key(cell), key))
+        except (TypeError, ValueError):
+            return False
+
+    def _scan(self, op, value):
+        key = self.field.key(value)
+        for v, records in self._items():
+            if v is NotSet:
+                continue
+            try:
+                match = op(self.field.key(v), key)
+            except (TypeError, ValueError):
+                continue
+            if match:
+                for r in records:
+                    yield r
+
+    def __eq__(self, value):
+        """
+        Iterate over all items with ``value == value``
+        """
+        try:
+            return iter(self._hashed.get(value, ()))
+        except TypeError:
+            items = self._unhashed.get(id(value), ())
+            return (r for v, r in items if v == value)
+
+    def __ne__(self, value):
+        """
+        Iterate over all items with ``value != value``.
+        """
+        for v, records in self._items():
+            if v is value or v == value:
+                continue
+            for r in records:
+                yield r
+
+    def __le__(self, value):
+        """
+        Iterate over all items with ``key <= k``
+        """
+        return self._scan(operator.le, value)
+
+    def __lt__(self, value):
+        """
+        Iterate over all items with ``key < k``
+        """
+        return self._scan(operator.lt, value)
+
+    def __ge__(self, value):
+        """
+        Iterate over all items with ``key >= k``
+        """
+        return self._scan(operator.ge, value)
+
+    def __gt__(self, value):
+        """
+        Iterate over all items with ``key > k``
+        """
+        return self._scan(operator.gt, value)
+
+    def __str__(self):
+        return str(self.field)
+
+
+def _postings(items, tokens):
+    # Return {token: {record: count}} for the (record, value) items.
+    tokens = set(tokens)
+    postings = {}
+    for record, value in items:
+        for token in _tokens(value):
+            if token in tokens:
+                records = postings.setdefault(token, {})
+                records[record] = records.get(record, 0) + 1
+    return postings
+
+
+class _TermIndex(Index):
+
+    """
+    An ordered `Index` which also keeps terms derived from each value.
+    Subclasses implement ``_add(value, record)`` and
+    ``_discard(value, record)``, which are called once for each item, and
+    may implement ``_add_many(items)`` to add many items at once.
+    """
+
+    # True while `Index.update` or `Index.remove_many` may call insert or
+    # remove, which then leave the terms to the batch method.
+    _batch = False
+
+    def insert(self, value, record):
+        """
+        Insert a new item.
+        """
+        super(_TermIndex, self).insert(value, record)
+        if not self._batch:
+            self._add(value, record)
+
+    def update(self, items):
+        """
+        Insert many ``(value, record)`` items.
+        """
+        items = list(items)
+        self._batch = True
+        try:
+            super(_TermIndex, self).update(items)
+        finally:
+            self._batch = False
+        self._add_many(items)
+
+    def _add_many(self, items):
+        for value, record in items:
+            self._add(value, record)
+
+    def remove(self, value, record):
+        """
+        Remove ``(value, record)``.
+        """
+        super(_TermIndex, self).remove(value, record)
+        if not self._batch:
+            self._discard(value, record)
+
+    def remove_many(self, items):
+        """
+        Remove many ``(value, record)`` items.
+        """
+        items = list(items)
+        self._batch = True
+        try:
+            super(_TermIndex, self).remove_many(items)
+        finally:
+            self._batch = False
+        for value, record in items:
+            self._discard(value, record)
+
+
+class NgramIndex(_TermIndex):
+
+    """
+    An ordered `Index` which also keeps the records containing each
+    sequence of `n` characters (an n-gram) in their string values.  This is
+    used for fields created with ``index='ngram'``, so that `Field.contains`
+    only needs to check the values which contain every n-gram of the
+    substring.  Shorter substrings are found by checking each distinct
+    n-gram and each value shorter than `n`.
+
+        >>> from norman import Table, Field
+        >>> class MyTable(Table):
+        ...    name = Field(index='ngram')
+        ...
+        >>> r1 = MyTable(name='Sir Robin')
+        >>> r2 = MyTable(name='Sir Lancelot')
+        >>> set(MyTable.name.contains('Rob')) == set((r1,))
+        True
+        >>> set(MyTable.name.contains('o')) == set((r1, r2))
+        True
+    """
+
+    n = 3
+
+    def clear(self):
+        """
+        Delete all items from the index.
+        """
+        super(NgramIndex, self).clear()
+        self._grams = {}
+        self._short = {}
+
+    def _grams_of(self, value):
+        n = self.n
+        return set(value[i:i + n] for i in range(len(value) - n + 1))
+
+    def _add(self, value, record):
+        if not isinstance(value, (text_type, bytes)):
+            return
+        if len(value) < self.n:
+            self._short.setdefault(value, set()).add(record)
+        for gram in self._grams_of(value):
+            self._grams.setdefault(gram, set()).add(record)
+
+    def _discard(self, value, record):
+        if not isinstance(value, (text_type, bytes)):
+            return
+        grams = self._grams_of(value)
+        if len(value) < self.n:
+            grams, index = [value], self._short
+        else:
+            index = self._grams
+        for gram in grams:
+            records = index.get(gram)
+            if records is not None:
+                records.discard(record)
+                if not records:
+                    del index[gram]
+
+    def contains(self, substring):
+        """
+        Iterate over all records with string values containing *substring*.
+        Candidates are found from the n-grams, and then checked.  `TypeError`
+        is raised if *substring* is not a text or bytes string.
+        """
+        _check_string(substring)
+        if len(substring) >= self.n:
+            sets = []
+            for gram in self._grams_of(substring):
+                if gram not in self._grams:
+                    return iter(())
+                sets.append(self._grams[gram])
+            sets.sort(key=len)
+            candidates = set(sets[0]).intersection(*sets[1:])
+        else:
+            candidates = set()
+            for index in (self._grams, self._short):
+                for gram, records in index.items():
+                    if _has_substring(gram, substring):
+                        candidates.update(records)
+        store = self.field.owner._store
+        return (r for r in candidates
+                if _has_substring(store.get(r, self.field), substring))
+
+
+class FullTextIndex(_TermIndex):
+
+    """
+    An ordered `Index` which also keeps an inverted index of the words in
+    string values, mapping each word to the records containing it and the
+    number of times it appears in each.  This is used for fields created
+    with ``index='fulltext'``, so that `Field.match`, `Field.match_any` and
+    `Field.ranked` do not need to check every value.  Words are found as
+    for `Field.match`.
+    """
+
+    def clear(self):
+        """
+        Delete all items from the index.
+        """
+        super(FullTextIndex, self).clear()
+        self._postings = {}
+
+    def _add(self, value, record):
+        counts = {}
+        for token in _tokens(value):
+            counts[token] = counts.get(token, 0) + 1
+        for token, count in counts.items():
+            self._postings.setdefault(token, {})[record] = count
+
+    def _discard(self, value, record):
+        for token in set(_tokens(value)):
+            records = self._postings.get(token)
+            if records is not None:
+                records.pop(record, None)
+                if not records:
+                    del self._postings[token]
+
+    def postings(self, tokens):
+        """
+        Return a `dict` mapping each of *tokens* to the records containing
+        it, as for `Index.postings`, from the inverted index.
+        """
+        return dict((t, self._postings[t]) for t in tokens
+                    if t in self._postings)
+
+    def count_token(self, token):
+        """
+        Return the number of records containing the word *token*.
+        """
+        return len(self._postings.get(token, ()))
+
+
+class MultiIndex(_TermIndex):
+
+    """
+    An ordered `Index` of collection values, which also keeps the records
+    containing each hashable element.  This is used for fields created
+    with ``multi=True``, so that `Field.has` is a single lookup.  Other
+    elements are found by checking every value.
+    """
+
+    def clear(self):
+        """
+        Delete all items from the index.
+        """
+        super(MultiIndex, self).clear()
+        self._elements = {}
+
+    def _add(self, value, record):
+        for element in _elements(value):
+            try:
+                self._elements.setdefault(element, set()).add(record)
+            except TypeError:
+                pass
+
+    def _discard(self, value, record):
+        for element in _elements(value):
+            try:
+                records = self._elements.get(element)
+            except TypeError:
+                continue
+            if records is not None:
+                records.discard(record)
+                if not records:
+                    del self._elements[element]
+
+    def has(self, element):
+        """
+        Return a set of the records with collection values containing
+        *element*.
+        """
+        try:
+            return set(self._elements.get(element, ()))
+        except TypeError:
+            return super(MultiIndex, self).has(element)
+
+    def count_element(self, element):
+        """
+        Return the number of records with collection values containing
+        *element*, or `None` if it is not hashable.
+        """
+        try:
+            return len(self._elements.get(element, ()))
+        except TypeError:
+            return None
+
+
+class SpatialIndex(_TermIndex):
+
+    """
+    An ordered `Index` which also keeps point values, which are pairs of
+    real numbers ``(x, y)``, sorted by *x* and then *y*.  This is used for
+    fields created with ``index='spatial'``.  `Field.within_box` and
+    `Field.within_radius` only check the points with *x* inside the box,
+    found by bisection, and `Field.nearest` checks points outwards from
+    *x* in both directions until they are further than the *k* nearest
+    found so far.
+    """
+
+    def clear(self):
+        """
+        Delete all items from the index.
+        """
+        super(SpatialIndex, self).clear()
+        self._points = _SortedList()
+
+    def _add(self, value, record):
+        point = _point(value)
+        if point is not None:
+            self._points.add(point, record)
+
+    def _add_many(self, items):
+        items = [(_point(v), r) for v, r in items]
+        items = [(p, r) for p, r in items if p is not None]
+        if len(items) * 8 < len(self._points):
+            for point, record in items:
+                self._points.add(point, record)
+            return
+        # Sort all the points once, as for `Index.update`
+        items.extend(zip(self._points.keys(), self._points.values()))
+        items.sort(key=operator.itemgetter(0))
+        self._points.load([i[0] for i in items], [i[1] for i in items])
+
+    def _discard(self, value, record):
+        point = _point(value)
+        if point is not None:
+            self._points.remove(point, record)
+
+    def _slab(self, x0, x1):
+        # Iterate over (record, point) items with x0 <= x <= x1
+        points = self._points
+        start = points.bisect_left((x0,))
+        stop = points.bisect_right((x1, float('inf')))
+        return zip(points.values(start, stop), points.keys(start, stop))
+
+    def within_box(self, lower, upper):
+        """
+        Iterate over all records with point values inside the box with
+        corners *lower* and *upper*.
+        """
+        return _points_in_box(self._slab(lower[0], upper[0]), lower, upper)
+
+    def within_radius(self, centre, radius):
+        """
+        Iterate over all records with point values no further than *radius*
+        from *centre*.
+        """
+        points = self._slab(centre[0] - radius, centre[0] + radius)
+        return _points_in_radius(points, centre, radius)
+
+    def nearest(self, point, k):
+        """
+        Return a list of the *k* records with point values closest to
+        *point*.
+        """
+        if k <= 0:
+            return []
+        points = self._points
+        start = points.bisect_left(tuple(point))
+        sides = [(points.keys(start), points.values(start)),
+                 (points.keys(None, start, reverse=True),
+                  points.values(None, start, reverse=True))]
+        # A heap of (-distance, n, record) for the nearest points so far
+        nearest = []
+        n = 0
+        while sides:
+            for side in list(sides):
+                keys, values = side
+                try:
+                    key = next(keys)
+                except StopIteration:
+                    sides.remove(side)
+                    continue
+                record = next(values)
+                dx = (key[0] - point[0]) ** 2
+                if len(nearest) == k and dx > -nearest[0][0]:
+                    sides.remove(side)
+                    continue
+                item = (-_distance2(key, point), n, record)
+                n += 1
+                if len(nearest) < k:
+                    heapq.heappush(nearest, item)
+                elif item > nearest[0]:
+                    heapq.heapreplace(nearest, item)
+        return [record for d, n, record in nearest]
+
+
+def _bits(data):
+    # Return a bytearray bitmap as an int, with bit i in byte i // 8
+    try:
+        return int.from_bytes(bytes(data), 'little')
+    except AttributeError:
+        return int(binascii.hexlify(bytes(data[::-1])) or b'0', 16)
+
+
+class _RowIds(object):
+
+    """
+    Dense integer ids for records, shared by the `BitmapIndex` instances of
+    a store so that their bitmaps can be combined.  Each index acquires an
+    id for every record it holds and releases it when the record is
+    removed, and ids which are no longer used are reused.
+    """
+
+    def __init__(self):
+        self._ids = {}
+        self._refs = {}
+        self._records = []
+        self._free = []
+
+    def __len__(self):
+        return len(self._ids)
+
+    def acquire(self, record):
+        """
+        Return the id of *record*, assigning one if it does not have one.
+        """
+        try:
+            row = self._ids[record]
+        except KeyError:
+            if self._free:
+                row = self._free.pop()
+                self._records[row] = record
+            else:
+                row = len(self._records)
+                self._records.append(record)
+            self._ids[record] = row
+            self._refs[record] = 1
+        else:
+            self._refs[record] += 1
+        return row
+
+    def release(self, record):
+        """
+        Release the id of *record*, which is reused once every index which
+        acquired it has released it.
+        """
+        self._refs[record] -= 1
+        if not self._refs[record]:
+            row = self._ids.pop(record)
+            del self._refs[record]
+            self._records[row] = None
+            self._free.append(row)
+
+    def discard(self, record):
+        """
+        Release the id of *record*, as for `release`, and return the id it
+        had.
+        """
+        row = self._ids[record]
+        self.release(record)
+        return row
+
+    def records(self, bits):
+        """
+        Iterate over the records with ids set in the `int` *bits*.
+        """
+        # Bits in order from the least significant, without the '0b'
+        bits = bin(bits)[:1:-1]
+        records = self._records
+        row = bits.find('1')
+        while row >= 0:
+            yield records[row]
+            row = bits.find('1', row + 1)
+
+
+class BitmapIndex(HashIndex):
+
+    """
+    A `HashIndex` which also keeps a bitmap for each distinct hashable
+    value, with a bit set for the row id of each record in `Store.row_ids`.
+    This is used for fields created with ``index='bitmap'``, which are
+    expected to have few distinct values, such as a status.  Queries which
+    combine equality tests on these fields with ``&``, ``|``, ``-`` and
+    ``^`` are evaluated as bitwise operations on the bitmaps, and only the
+    final result is converted to records.
+
+        >>> from norman import Table, Field
+        >>> class MyTable(Table):
+        ...    status = Field(index='bitmap')
+        ...    colour = Field(index='bitmap')
+        ...
+        >>> r1 = MyTable(status='open', colour='red')
+        >>> r2 = MyTable(status='closed', colour='red')
+        >>> q = (MyTable.status == 'open') | (MyTable.colour == 'blue')
+        >>> set(q) == set((r1,))
+        True
+    """
+
+    @property
+    def rows(self):
+        """
+        The `Store.row_ids` used for the bitmaps.
+        """
+        return self.field.owner._store.row_ids
+
+    def clear(self):
+        """
+        Delete all items from the index.
+        """
+        if getattr(self, '_bitmaps', None):
+            rows = self.rows
+            for records in self._hashed.values():
+                for record in records:
+                    rows.release(record)
+        super(BitmapIndex, self).clear()
+        self._bitmaps = {}
+        self._ints = {}
+
+    def insert(self, value, record):
+        """
+        Insert a new item.
+        """
+        super(BitmapIndex, self).insert(value, record)
+        try:
+            data = self._bitmaps.setdefault(value, bytearray())
+        except TypeError:
+            return
+        row = self.rows.acquire(record)
+        if len(data) <= row >> 3:
+            data.extend(bytearray((row >> 3) - len(data) + 1))
+        data[row >> 3] |= 1 << (row & 7)
+        self._ints.pop(value, None)
+
+    def remove(self, value, record):
+        """
+        Remove ``(value, record)``.
+        """
+        super(BitmapIndex, self).remove(value, record)
+        try:
+            data = self._bitmaps[value]
+        except TypeError:
+            return
+        row = self.rows.discard(record)
+        data[row >> 3] &= 0xff ^ (1 << (row & 7))
+        self._ints.pop(value, None)
+        if value not in self._hashed:
+            del self._bitmaps[value]
+
+    def bitmap(self, value):
+        """
+        Return ``(rows, bits)`` for the records equal to *value*, where
+        *rows* is the `Store.row_ids` and *bits* is an `int` with the bit for
+        each record's id set.  `None` is returned if *value* is not
+        hashable.
+        """
+        try:
+            bits = self._ints.get(value)
+        except TypeError:
+            return None
+        if bits is None:
+            data = self._bitmaps.get(value)
+            bits = 0 if data is None else _bits(data)
+            if data is not None:
+                self._ints[value] = bits
+        return self.rows, bits
+
+
+class ScanIndex(HashIndex):
+
+    """
+    A scan index stores nothing, and is used for fields created with
+    ``index=False``.  Inserting and removing records do nothing, and every
+    comparison scans all the values of the field in the owning table's
+    store.  This is useful for fields which are written often but seldom
+    queried.  Equality is based on the value itself, as for `HashIndex`.
+
+        >>> from norman import Table, Field
+        >>> class MyTable(Table):
+        ...    note = Field(index=False)
+        ...
+        >>> r1 = MyTable(note='first')
+        >>> r2 = MyTable(note='second')
+        >>> set(MyTable.note == 'first') == set((r1,))
+        True
+    """
+
+    def __len__(self):
+        return self.field.owner._store.record_count()
+
+    def clear(self):
+        """
+        Delete all items from the index.  This does nothing.
+        """
+        pass
+
+    def insert(self, value, record):
+        """
+        Insert a new item.  This does nothing.
+        """
+        pass
+
+    def update(self, items):
+        """
+        Insert many ``(value, record)`` items.  This does nothing.
+        """
+        pass
+
+    def remove(self, value, record):
+        """
+        Remove ``(value, record)``.  This does nothing.
+        """
+        pass
+
+    def remove_many(self, items):
+        """
+        Remove many ``(value, record)`` items.  This does nothing.
+        """
+        pass
+
+    def count(self, op, value):
+        """
+        Return `None`, since the number of records in ``op(index, value)``
+        can only be found by scanning them.
+        """
+        return None
+
+    def estimate(self, op, value):
+        """
+        Return the maximum number of records in ``op(index, value)``, which
+        is the number of records in the table.
+        """
+        return len(self)
+
+    def matches(self, op, value, cell):
+        """
+        Return `True` if a record containing *cell* is in the results of
+        ``op(index, value)``.
+        """
+        if op is operator.eq:
+            return cell is value or cell == value
+        return super(ScanIndex, self).matches(op, value, cell)
+
+    def isin(self, values):
+        """
+        Return a set of the records with any of *values*, in a single scan.
+        """
+        hashed, unhashed = set(), []
+        for value in values:
+            try:
+                hashed.add(value)
+            except TypeError:
+                unhashed.append(value)
+        records = set()
+        for value, rs in self._items():
+            try:
+                found = value in hashed
+            except TypeError:
+                found = any(value is v or value == v for v in unhashed)
+            if found:
+                records.update(rs)
+        return records
+
+    def _items(self):
+        """
+        Iterate over ``(value, records)`` for every record in the store.
+        """
+        for record, value in self.field.owner._store.iter_field(self.field):
+            yield value, (record,)
+
+    def __eq__(self, value):
+        """
+        Iterate over all items with ``value == value``
+        """
+        for v, records in self._items():
+            if v is value or v == value:
+                for r in records:
+                    yield r
+
+
+class CompositeIndex(object):
+
+    """
+    A composite index is a hash index on a tuple of values, one for each of
+    its `fields`.  Each value is compared the same way as by the field's
+    own index, so ``composite == values`` returns the same records as
+    intersecting ``index == value`` for each field, but in O(1).
+
+    `Store` uses this to keep an index on all fields with `Field.unique`
+    set, which is used to check uniqueness and for queries which test
+    all of those fields for equality.
+    """
+
+    def __init__(self, fields, indexes):
+        self.fields = tuple(fields)
+        self._tokens = tuple(i._token for i in indexes)
+        self.clear()
+
+    def __len__(self):
+        return sum(len(s) for s in self._data.values())
+
+    def clear(self):
+        """
+        Delete all items from the index.
+        """
+        self._data = {}
+
+    def key(self, values):
+        """
+        Return the hashable key used for the tuple *values*.
+        """
+        return tuple(t(v) for t, v in zip(self._tokens, values))
+
+    def insert(self, values, record):
+        """
+        Insert a new item, where *values* is a tuple of values in the same
+        order as `fields`.
+        """
+        self._data.setdefault(self.key(values), set()).add(record)
+
+    def remove(self, values, record):
+        """
+        Remove ``(values, record)``.
+        """
+        key = self.key(values)
+        records = self._data[key]
+        records.remove(record)
+        if not records:
+            del self._data[key]
+
+    def __eq__(self, values):
+        """
+        Iterate over all items matching the tuple *values*.
+        """
+        return iter(self._data.get(self.key(values), ()))
+
+    def __str__(self):
+        return ', '.join(str(f) for f in self.fields)
+
+
+class Store(object):
+
+    """
+    Stores are designed to hide the implementation details and expose
+    a consistent API, so that they can be switched out without any other
+    changes to the table.
+
+    Tables are exposed as an array of cells, where each cell is identified
+    by `Table` and `Field` instances.  Cells are unordered, although
+    implementations may order them internally.
+
+    The Store is tolerant of missing values.  `get` will return defaults if
+    the record requested does not exist.  `set` will add a new record
+    if the record does not exist.
+
+    The type of index created for each field is looked up by `Field.index`
+    in `index_types`, which maps index types to index classes.  In addition,
+    a `CompositeIndex` of all unique fields is kept in `unique_index`, or
+    `None` if there are no unique fields.
+
+    If *lazy* is `True`, the index for a field is only built when it is
+    first used, e.g. by a query on the field, and is then maintained as
+    usual.  Until then, only the data is updated when records change.
+    This is useful for tables which are written often but only queried
+    on a few fields.
+
+    Changes to the data are tracked by `version`, which is incremented
+    whenever any data in the store changes, and `field_versions`, which maps
+    each field to a number which is incremented whenever its values
+    change.  These are used by `Query` to determine whether stored results
+    are still valid.  Changes are also reported to each function in
+    `listeners`, which is called as ``listener(records, fields)`` after the
+    change, with lists of the records and fields which changed.  Either
+    may be `None` if all of them may have changed.
+
+    Records in fields with a `BitmapIndex` are given dense integer ids in
+    `row_ids`, which is shared by all the bitmap indexes in the store.
+    """
+
+    index_types = {True: Index, 'hash': HashIndex, False: ScanIndex,
+                   'ngram': NgramIndex, 'fulltext': FullTextIndex,
+                   'bitmap': BitmapIndex, 'spatial': SpatialIndex}
+
+    def __init__(self, lazy=False):
+        self.lazy = lazy
+        self.indexes = _IndexMap(self) if lazy else {}
+        self.fields = {}
+        self.unique_index = None
+        self.version = 0
+        self.field_versions = {}
+        self.listeners = []
+        self.row_ids = _RowIds()
+        self.clear()
+
+    def add_field(self, field):
+        """
+        Called whenever a new field is added to the table.
+        """
+        index = self._create_index(field)
+        if not self.lazy:
+            index.update((v, r) for r, v in self.iter_field(field))
+            self.indexes[field] = index
+        self.fields[field.name] = field
+        self.field_versions[field] = 0
+        self._changed([field])
+        if field.unique:
+            self.reindex_unique()
+
+    def add_record(self, record, data=None):
+        """
+        Called whenever a new record is created.  *data* is an optional
+        `dict` of values keyed by field, and missing fields use their
+        default values.  Each index is updated once with the final value.
+        If an index cannot be updated, the record is removed again before
+        the exception is raised.
+        """
+        if data is None:
+            data = {}
+        else:
+            data = dict((f, v) for f, v in data.items() if v is not f.default)
+        self._add_data(record, data)
+        inserted = []
+        try:
+            for field, index in self.indexes.items():
+                index.insert(data.get(field, field.default), record)
+                inserted.append((field, index))
+            if self.unique_index is not None:
+                self.unique_index.insert(self._unique_values(record), record)
+        except:
+            for field, index in inserted:
+                index.remove(data.get(field, field.default), record)
+            self._remove_data(record)
+            raise
+        self._changed(records=[record])
+
+    def bulk_add(self, records):
+        """
+        Add many records at once.  *records* is an iterable of
+        ``(record, data)`` pairs, where *data* is a `dict` of values keyed
+        by field.  Missing fields use their default values.  Each index is
+        updated once for all the new records.
+
+        If the unique fields of the new records are not unique, a
+        `ValidationError` is raised before any records are added.
+        """
+        records = list(records)
+        self.check_unique(records)
+        added = []
+        updated = []
+        inserted = []
+        try:
+            for record, data in records:
+                self._add_data(record, dict((f, v) for f, v in data.items()
+                                            if v is not f.default))
+                added.append(record)
+            for field, index in self.indexes.items():
+                index.update((data.get(field, field.default), record)
+                             for record, data in records)
+                updated.append((field, index))
+            if self.unique_index is not None:
+                for record in added:
+                    values = self._unique_values(record)
+                    self.unique_index.insert(values, record)
+                    inserted.append((values, record))
+        except:
+            for values, record in inserted:
+                self.unique_index.remove(values, record)
+            for field, index in updated:
+                index.remove_many((data.get(field, field.default), record)
+                                  for record, data in records)
+            for record in added:
+                self._remove_data(record)
+            raise
+        self._changed(records=[record for record, _ in records])
+
+    def bulk_set(self, records):
+        """
+        Set values in many records at once.  *records* is an iterable of
+        ``(record, data)`` pairs, where *data* is a `dict` of new values keyed
+        by field.  The changed records are removed from each affected index
+        in one batch, and then inserted again in one batch.
+        """
+        records = list(records)
+        fields = set()
+        for record, data in records:
+            fields.update(data)
+        unique = (self.unique_index is not None and
+                  any(f.unique for f in fields))
+        if unique:
+            oldvalues = [(self._unique_values(r), r) for r, _ in records]
+        applied = []
+        try:
+            for field in fields:
+                changes = []
+                applied.append((field, changes))
+                for record, data in records:
+                    if field in data:
+                        old = self.get(record, field)
+                        if old is not data[field]:
+                            self._set_data(record, field, data[field])
+                            changes.append((record, old, data[field]))
+        except:
+            for field, changes in applied:
+                for record, old, _ in changes:
+                    self._set_data(record, field, old)
+            raise
+        # All the data is set, so update the indexes
+        for field, changes in applied:
+            index = self.indexes.get(field)
+            if index is None:
+                continue
+            index.remove_many((old, record) for record, old, _ in changes)
+            index.update((value, record) for record, _, value in changes)
+        if unique:
+            for values, record in oldvalues:
+                self.unique_index.remove(values, record)
+            for record, _ in records:
+                self.unique_index.insert(self._unique_values(record), record)
+        self._changed([field for field, changes in applied if changes],
+                      [record for record, _ in records])
+
+    def check_unique(self, records):
+        """
+        Raise a `ValidationError` if setting values in *records* would
+        result in duplicate values in the unique fields.  *records* is an
+        iterable of ``(record, data)`` pairs, as used by `bulk_add` and
+        `bulk_set`, and may contain new or existing records.  Missing values
+        are taken from existing records, or are the field defaults.
+
+        The list of keys in `unique_index` for each record is returned, or
+        `None` if there are no unique fields.
+        """
+        unique_index = self.unique_index
+        if unique_index is None:
+            return None
+        batch = set(record for record, _ in records)
+        keys = []
+        seen = set()
+        for record, data in records:
+            values = tuple(data[f] if f in data else self.get(record, f)
+                           for f in unique_index.fields)
+            key = unique_index.key(values)
+            existing = unique_index._data.get(key, set()) - batch
+            if existing:
+                raise ValidationError('Not unique: ' + str(existing.pop()))
+            if key in seen:
+                raise ValidationError('Not unique: ' + repr(values))
+            seen.add(key)
+            keys.append(key)
+        return keys
+
+    def clear(self):
+        """
+        Delete all records in the store.
+        """
+        self._clear_data()
+        for i in self.indexes.values():
+            i.clear()
+        if self.unique_index is not None:
+            self.unique_index.clear()
+        self._changed()
+
+    def get(self, record, field):
+        """
+        Return the value in a cell specified by *record* and *field*.  This
+        should respect any field defaults.  If this is called with a record
+        that has not been added, it will be added.
+        """
+        return self._data.get(record, {}).get(field, field.default)
+
+    def has_record(self, record):
+        """
+        Return True if the record has an entry in the data store.
+        """
+        return record in self._data
+
+    def iter_field(self, field):
+        """
+        Iterate over pairs of ``(record, value)`` for the specified field.
+        This should respect any field defaults.  If this is called with a
+        field that has not been added, the behaviour is unspecified.
+        """
+        default = field.default
+        for record, data in self._data.items():
+            yield record, data.get(field, default)
+
+    def iter_records(self):
+        """
+        Return an iterator over all records in the data store.
+        """
+        return iter(self._data.keys())
+
+    def record_count(self):
+        """
+        Return the number of records in the table.
+        """
+        return len(self._data)
+
+    def remove_record(self, record):
+        """
+        Remove a record.
+        """
+        if self.unique_index is not None:
+            self.unique_index.remove(self._unique_values(record), record)
+        for field, index in self.indexes.items():
+            index.remove(self.get(record, field), record)
+        self._remove_data(record)
+        self._changed(records=[record])
+
+    def remove_records(self, records):
+        """
+        Remove many records.  Each index is updated in a single batch.
+        """
+        records = list(records)
+        if self.unique_index is not None:
+            for record in records:
+                self.unique_index.remove(self._unique_values(record), record)
+        for field, index in self.indexes.items():
+            index.remove_many((self.get(r, field), r) for r in records)
+        for record in records:
+            self._remove_data(record)
+        self._changed(records=records)
+
+    def remove_field(self, field):
+        """
+        Remove a field.
+        """
+        for r in self._data.values():
+            r.pop(field, None)
+        self._changed([field])
+
+    def set(self, record, field, value):
+        """
+        Set the data in a record.
+        """
+        old = self.get(record, field)
+        if old is not value:
+            unique = self.unique_index is not None and field.unique
+            if unique:
+                oldvalues = self._unique_values(record)
+            self._set_data(record, field, value)
+            index = self.indexes.get(field)
+            if index is not None:
+                index.remove(old, record)
+                index.insert(value, record)
+            if unique:
+                self.unique_index.remove(oldvalues, record)
+                self.unique_index.insert(self._unique_values(record), record)
+            self._changed([field], [record])
+
+    def setdefault(self, field, value):
+        """
+        Called when the default value of a field in changed.
+        """
+        if value != field.default:
+            index = self.indexes.get(field)
+            unset = list(self._unset_records(field))
+            if index is not None:
+                for r in unset:
+                    index.remove(field.default, r)
+                    index.insert(value, r)
+            if self.unique_index is not None and field.unique:
+                position = self.unique_index.fields.index(field)
+                for r in unset:
+                    values = list(self._unique_values(r))
+                    self.unique_index.remove(tuple(values), r)
+                    values[position] = value
+                    self.unique_index.insert(tuple(values), r)
+            self._changed([field], unset)
+
+    # The following methods, together with `get`, `has_record`,
+    # `iter_field`, `iter_records`, `record_count` and `remove_field`, are
+    # the only ones which access the data directly.  Subclasses may
+    # override them to change the way data is stored.
+
+    def _add_data(self, record, data):
+        """
+        Add a new record, with a `dict` of field values which have been set.
+        """
+        self._data[record] = data
+
+    def _clear_data(self):
+        self._data = {}
+
+    def _remove_data(self, record):
+        del self._data[record]
+
+    def _set_data(self, record, field, value):
+        self._data[record][field] = value
+
+    def _unset_records(self, field):
+        """
+        Iterate over records for which *field* has not been set.
+        """
+        return (r for r, d in self._data.items() if field not in d)
+
+    def _changed(self, fields=None, records=None):
+        """
+        Increment `version`, and the `field_versions` of *fields*, or of
+        every field if *fields* is `None`.  Then call the `listeners`.
+        """
+        self.version += 1
+        for field in self.field_versions if fields is None else fields:
+            self.field_versions[field] += 1
+        for listener in list(self.listeners):
+            listener(records, fields)
+
+    def _create_index(self, field):
+        """
+        Return a new, empty index for *field*.
+        """
+        if field.multi:
+            if field.index is not True:
+                raise ValueError('Multi-valued fields only support '
+                                 'index=True')
+            return MultiIndex(field)
+        try:
+            index_type = self.index_types[field.index]
+        except KeyError:
+            raise ValueError('Unknown index type: %r' % (field.index,))
+        return index_type(field)
+
+    def _unique_values(self, record):
+        return tuple(self.get(record, f) for f in self.unique_index.fields)
+
+    def reindex_unique(self):
+        """
+        Rebuild `unique_index` for all fields which have `Field.unique` set.
+        This should be called whenever `Field.unique` is changed.  If the
+        existing records are not unique, a `ValidationError` is raised and
+        the index is left unchanged.
+        """
+        fields = [f for f in self.fields.values() if f.unique]
+        if not fields:
+            self.unique_index = None
+            return
+        # Only the index tokens are used, so empty indexes are enough
+        unique_index = CompositeIndex(fields,
+                                      [self._create_index(f) for f in fields])
+        for record in self.iter_records():
+            values = tuple(self.get(record, f) for f in fields)
+            existing = set(unique_index == values)
+            if existing:
+                raise ValidationError('Not unique: ' + str(existing.pop()))
+            unique_index.insert(values, record)
+        self.unique_index = unique_index
+
+
+class _IndexMap(dict):
+
+    """
+    The indexes of a lazy `Store`, by field.  Missing indexes are built
+    from the data in the store when they are first looked up.
+    """
+
+    def __init__(self, store):
+        super(_IndexMap, self).__init__()
+        self.store = store
+
+    def __missing__(self, field):
+        if self.store.fields.get(field.name) is not field:
+            raise KeyError(field)
+        index = self.store._create_index(field)
+        index.update((v, r) for r, v in self.store.iter_field(field))
+        self[field] = index
+        return index
+
+
+class _Default(object):
+    def __repr__(self):
+        return '_Default'
+
+
+# Sentinel for cells in a `ColumnarStore` which have not been set.
+_Default = _Default()
+
+
+class ColumnarStore(Store):
+
+    """
+    A `Store` which keeps the data for each field in a single column, instead
+    of a `dict` for each record.  Each record is assigned a row number in
+    the columns, and rows of deleted records are reused by new records.
+    This uses less memory than `Store` for large tables, and scanning a
+    field with `iter_field` is faster.  It is used by setting it as the
+    `Table._store` when the table is created::
+
+        >>> from norman import Table, Field, ColumnarStore
+        >>> class Point(Table):
+        ...     _store = ColumnarStore(typecodes={'x': 'd', 'y': 'd'})
+        ...     x = Field(default=0.0)
+        ...     y = Field(default=0.0)
+        ...     name = Field()
+
+    *typecodes* optionally maps field names to `array.array` type codes.
+    These fields are stored in a compact `array.array` instead of
+    a `list`, so they may only contain values of that type, and must have
+    a default value which is valid for the array.  Since every row stores a
+    value, changing the default value of a typed field does not affect
+    existing records.  *lazy* is the same as for `Store`.
+    """
+
+    def __init__(self, typecodes=None, lazy=False):
+        self.typecodes = {} if typecodes is None else dict(typecodes)
+        self._columns = {}
+        super(ColumnarStore, self).__init__(lazy)
+
+    def add_field(self, field):
+        """
+        Called whenever a new field is added to the table.
+        """
+        size = len(self._records)
+        typecode = self.typecodes.get(field.name)
+        if typecode is None:
+            self._columns[field] = [_Default] * size
+        else:
+            try:
+                column = array.array(typecode, [field.default])
+            except TypeError:
+                raise ValueError('Invalid default for typed field: %r'
+                                 % (field.default,))
+            self._columns[field] = column * size
+        super(ColumnarStore, self).add_field(field)
+
+    def get(self, record, field):
+        """
+        Return the value in a cell specified by *record* and *field*.
+        """
+        row = self._rows.get(record)
+        if row is None:
+            return field.default
+        value = self._columns[field][row]
+        return field.default if value is _Default else value
+
+    def has_record(self, record):
+        """
+        Return True if the record has an entry in the data store.
+        """
+        return record in self._rows
+
+    def iter_field(self, field):
+        """
+        Iterate over pairs of ``(record, value)`` for the specified field.
+        """
+        default = field.default
+        for record, value in zip(self._records, self._columns[field]):
+            if record is not None:
+                yield record, default if value is _Default else value
+
+    def iter_records(self):
+        """
+        Return an iterator over all records in the data store.
+        """
+        return iter(self._rows.keys())
+
+    def record_count(self):
+        """
+        Return the number of records in the table.
+        """
+        return len(self._rows)
+
+    def remove_field(self, field):
+        """
+        Remove a field.
+        """
+        column = self._columns[field]
+        if isinstance(column, list):
+            self._columns[field] = [_Default] * len(column)
+        self._changed([field])
+
+    def _add_data(self, record, data):
+        cells = [(c, self._cell(f, c, data)) for f, c in self._columns.items()]
+        if self._free:
+            row = self._free[-1]
+            for column, value in cells:
+                column[row] = value
+            self._free.pop()
+            self._records[row] = record
+        else:
+            row = len(self._records)
+            try:
+                for column, value in cells:
+                    column.append(value)
+            except:
+                for column, _ in cells:
+                    del column[row:]
+                raise
+            self._records.append(record)
+        self._rows[record] = row
+
+    @staticmethod
+    def _cell(field, column, data):
+        if isinstance(column, list):
+            return data.get(field, _Default)
+        return data.get(field, field.default)
+
+    def _clear_data(self):
+        self._rows = {}
+        self._records = []
+        self._free = []
+        for field, column in self._columns.items():
+            del column[:]
+
+    def _remove_data(self, record):
+        row = self._rows.pop(record)
+        self._records[row] = None
+        for column in self._columns.values():
+            if isinstance(column, list):
+                column[row] = _Default
+        self._free.append(row)
+
+    def _set_data(self, record, field, value):
+        self._columns[field][self._rows[record]] = value
+
+    def _unset_records(self, field):
+        column = self._columns[field]
+        if not isinstance(column, list):
+            return iter(())
+        return (r for r, v in zip(self._records, column)
+                if r is not None and v is _Default)
+
+
+class SlotStore(Store):
+
+    """
+    A `Store` used by `CompactTable`, which keeps field values in slots on
+    the records themselves.  Only the indexes and a `set` of records are
+    kept by the store.  It is created automatically for each `CompactTable`
+    and cannot be used with other tables, but may also be set explicitly
+    as the `Table._store` of a `CompactTable`, e.g. to use
+    ``SlotStore(lazy=True)``.
+    """
+
+    def __init__(self, lazy=False):
+        self._records = set()
+        super(SlotStore, self).__init__(lazy)
+
+    def add_field(self, field):
+        """
+        Called whenever a new field is added to the table.
+        """
+        if getattr(field, '_slot', None) is None:
+            raise ValueError('SlotStore can only be used with a CompactTable')
+        super(SlotStore, self).add_field(field)
+
+    def get(self, record, field):
+        """
+        Return the value in a cell specified by *record* and *field*.
+        """
+        return getattr(record, field._slot, field.default)
+
+    def has_record(self, record):
+        """
+        Return True if the record has an entry in the data store.
+        """
+        return record in self._records
+
+    def iter_field(self, field):
+        """
+        Iterate over pairs of ``(record, value)`` for the specified field.
+        """
+        slot, default = field._slot, field.default
+        for record in self._records:
+            yield record, getattr(record, slot, default)
+
+    def iter_records(self):
+        """
+        Return an iterator over all records in the data store.
+        """
+        return iter(self._records)
+
+    def record_count(self):
+        """
+        Return the number of records in the table.
+        """
+        return len(self._records)
+
+    def remove_field(self, field):
+        """
+        Remove a field.
+        """
+        for record in self._records:
+            self._unset(record, field)
+        self._changed([field])
+
+    @staticmethod
+    def _unset(record, field):
+        if hasattr(record, field._slot):
+            object.__delattr__(record, field._slot)
+
+    def _add_data(self, record, data):
+        for field, value in data.items():
+            object.__setattr__(record, field._slot, value)
+        self._records.add(record)
+
+    def _clear_data(self):
+        for record in self._records:
+            for field in self.fields.values():
+                self._unset(record, field)
+        self._records = set()
+
+    def _remove_data(self, record):
+        self._records.remove(record)
+        for field in self.fields.values():
+            self._unset(record, field)
+
+    def _set_data(self, record, field, value):
+        object.__setattr__(record, field._slot, value)
+
+    def _unset_records(self, field):
+        slot = field._slot
+        return (r for r in self._records if not hasattr(r, slot))
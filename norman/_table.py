@@ -18,16 +18,14 @@
 
 import collections
 import copy
-import operator
 import re
+import types
 import uuid
 
 from ._except import ConsistencyError, ValidationError
 from ._field import Field, Join, NotSet
-from ._six import (integer_types, recursive_repr, string_types, u,
-                   with_metaclass)
-from ._six.moves import reduce
-from ._store import Store
+from ._six import integer_types, recursive_repr, string_types, u
+from ._store import Store, SlotStore
 
 
 _re_uuid = '^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$'
@@ -49,13 +47,23 @@ class TableMeta(type):
         fulldict = {}
         for base in bases:
             for n, value in base.__dict__.items():
+                # Slots are created by type, so should not be copied
+                if (n in ('__slots__', '__dict__', '__weakref__') or
+                        isinstance(value, types.MemberDescriptorType)):
+                    continue
                 if isinstance(value, (Field, Join)):
                     value = copy.copy(value)
                 fulldict[n] = value
         fulldict.update(cdict)
+        compact = any(getattr(base, '_compact', False) for base in bases)
+        if compact:
+            store = cdict.get('_store')
+            if store is not None and not isinstance(store, SlotStore):
+                raise ConsistencyError('CompactTable requires a SlotStore')
+            mcs._add_slots(bases, cdict, fulldict)
         cls = type.__new__(mcs, name, bases, fulldict)
         if '_store' not in cdict:
-            cls._store = Store()
+            cls._store = SlotStore() if compact else Store()
         for n, value in fulldict.items():
             if isinstance(value, (Field, Join)):
                 value._name = n
@@ -69,6 +77,30 @@ class TableMeta(type):
     def __init__(cls, name, bases, cdict):
         super(TableMeta, cls).__init__(name, bases, cdict)
 
+    @staticmethod
+    def _add_slots(bases, cdict, fulldict):
+        """
+        Add a slot to *fulldict* for each field which is not already
+        provided by *bases*.
+        """
+        inherited = set()
+        for base in bases:
+            for cls in base.__mro__:
+                slots = cls.__dict__.get('__slots__', ())
+                if isinstance(slots, string_types):
+                    slots = [slots]
+                inherited.update(slots)
+        slots = cdict.get('__slots__', ())
+        if isinstance(slots, string_types):
+            slots = [slots]
+        slots = list(slots)
+        for n, value in fulldict.items():
+            if isinstance(value, Field):
+                value._slot = '_value_' + n
+                if value._slot not in inherited:
+                    slots.append(value._slot)
+        fulldict['__slots__'] = tuple(slots)
+
     def __len__(cls):
         return cls._store.record_count()
 
@@ -80,6 +112,9 @@ class TableMeta(type):
 
     def __setattr__(cls, name, value):
         if isinstance(value, (Field, Join)):
+            if isinstance(value, Field) and getattr(cls, '_compact', False):
+                raise ConsistencyError('Fields cannot be added to a '
+                                       'CompactTable after it is created')
             if hasattr(cls, name):
                 raise ConsistencyError("Field '{}' already exists".format(name))
             if hasattr(value, '_owner'):
@@ -99,6 +134,11 @@ class TableMeta(type):
         """
         Delete delete all instances in *records*.  If *records* is
         omitted then all records in the table are deleted.
+
+        `Table.validate_delete` and the delete hooks are run for every
+        record first, and then all the records are removed from the table
+        in a single batch.  If validation fails for a record, the records
+        which have already been validated are still deleted.
         """
         if records is None:
             records = set(cls)
@@ -106,19 +146,51 @@ class TableMeta(type):
             records = set([records])
         else:
             records = set(records)
-        for r in records:
-            # Check if its been deleted by validate_delete
-            if r in cls:
-                try:
-                    r.validate_delete()
-                    for v in cls.hooks['delete']:
-                        v(r)
-                except AssertionError as err:
-                    raise ValidationError(*err.args)
-                except:
-                    raise
-                else:
-                    cls._store.remove_record(r)
+        validated = []
+        try:
+            for r in records:
+                # Check if its been deleted by validate_delete
+                if r in cls:
+                    try:
+                        r.validate_delete()
+                        for v in cls.hooks['delete']:
+                            v(r)
+                    except AssertionError as err:
+                        raise ValidationError(*err.args)
+                    except:
+                        raise
+                    else:
+                        validated.append(r)
+        finally:
+            # Records may also have been deleted by validate_delete
+            cls._store.remove_records(r for r in validated if r in cls)
+
+    def bulk_create(cls, records):
+        """
+        Create a new record for each `dict` of field values in *records*,
+        and return a list of the new records.
+
+        This is equivalent to calling ``cls(**kwargs)`` for each item,
+        but is much faster for large numbers of records.  All field
+        values are validated and checked for uniqueness before any
+        records are added, and each index is sorted once for all the new
+        records.  If any record fails validation, none of them are created.
+        """
+        store = cls._store
+        datas = [cls._field_data(kwargs) for kwargs in records]
+
+        new = [cls.__new__(cls) for _ in datas]
+        # This checks uniqueness before adding anything
+        store.bulk_add(zip(new, datas))
+
+        # Validate records
+        try:
+            for record in new:
+                record._validate()
+        except:
+            store.remove_records(r for r in new if store.has_record(r))
+            raise
+        return new
 
     def fields(cls):
         """
@@ -127,7 +199,12 @@ class TableMeta(type):
         return cls._store.fields.keys()
 
 
-class Table(with_metaclass(TableMeta)):
+# Table and its base have empty slots, so that `CompactTable` records have
+# no instance dict.  Other subclasses get one as usual.
+_TableBase = TableMeta('_TableBase', (object,), {'__slots__': ()})
+
+
+class Table(_TableBase):
 
     """
     Records are created by instantiating a `Table` subclass.  Tables
@@ -152,39 +229,18 @@ class Table(with_metaclass(TableMeta)):
         >>> record = MyTable(field1='value', field2='other value')
     """
 
+    __slots__ = ()
+
     def __init__(self, **kwargs):
         store = self.__class__._store
-        badkw = set(kwargs.keys()) - set(store.fields.keys())
-        if badkw:
-            raise AttributeError(badkw)
-        kwargs
-        # Get new values by validation
-        data = {}
-        for field in store.fields.values():
-            if field.name in kwargs:
-                if field.readonly:
-                    raise ValidationError('Field is read only')
-                value = kwargs[field.name]
-            else:
-                value = field.default
-            try:
-                for validator in field.validators:
-                    value = validator(value)
-            except Exception as err:
-                if isinstance(err, AssertionError):
-                    raise ValidationError(*err.args)
-                else:
-                    raise
-            data[field] = value
+        data = self.__class__._field_data(kwargs)
 
         # Check uniqueness
-        if any(f.unique for f in store.fields.values()):
+        if store.unique_index is not None:
             self._assert_unique(data)
 
         # All good so far, so add the data to the store
-        store.add_record(self)
-        for field, value in data.items():
-            store.set(self, field, value)
+        store.add_record(self, data)
 
         # Validate record
         try:
@@ -224,20 +280,76 @@ class Table(with_metaclass(TableMeta)):
                 store.set(self, field, oldvalue)
                 raise
 
-    def _assert_unique(self, replacevalues):
-        store = self.__class__._store
-        # Don't use a Query here because it is too slow
-        matches = []
+    @classmethod
+    def _field_data(cls, kwargs):
+        """
+        Return a `dict` of validated values for every field, given field
+        values by name in *kwargs*.
+        """
+        store = cls._store
+        badkw = set(kwargs.keys()) - set(store.fields.keys())
+        if badkw:
+            raise AttributeError(badkw)
+        # Get new values by validation
+        data = {}
         for field in store.fields.values():
-            if field.unique:
-                if field in replacevalues:
-                    value = replacevalues[field]
+            if field.name in kwargs:
+                if field.readonly:
+                    raise ValidationError('Field is read only')
+                value = kwargs[field.name]
+            else:
+                value = field.default
+            try:
+                for validator in field.validators:
+                    value = validator(value)
+            except Exception as err:
+                if isinstance(err, AssertionError):
+                    raise ValidationError(*err.args)
                 else:
-                    value = store.get(self, field)
-                matches.append(set(store.indexes[field] == value))
+                    raise
+            data[field] = value
+        return data
 
-        matches = reduce(operator.and_, matches)
-        existing = set(matches) - set([self])
+    @classmethod
+    def _update_data(cls, records, kwargs):
+        """
+        Return a `dict` of validated values by field, for setting the
+        fields named in *kwargs* in every record in *records*.  Validators
+        are only run once for each field.
+        """
+        store = cls._store
+        badkw = set(kwargs.keys()) - set(store.fields.keys())
+        if badkw:
+            raise AttributeError(badkw)
+        data = {}
+        for name, value in kwargs.items():
+            field = store.fields[name]
+            try:
+                for validator in field.validators:
+                    value = validator(value)
+            except Exception as err:
+                if isinstance(err, AssertionError):
+                    raise ValidationError(*err.args)
+                else:
+                    raise
+            if field.readonly:
+                for record in records:
+                    oldvalue = store.get(record, field)
+                    if oldvalue is not NotSet and oldvalue != value:
+                        raise ValidationError('Field is read only')
+            data[field] = value
+        return data
+
+    def _assert_unique(self, replacevalues):
+        store = self.__class__._store
+        # Don't use a Query here because it is too slow
+        values = []
+        for field in store.unique_index.fields:
+            if field in replacevalues:
+                values.append(replacevalues[field])
+            else:
+                values.append(store.get(self, field))
+        existing = set(store.unique_index == tuple(values)) - set([self])
         if existing:
             raise ValidationError('Not unique: ' + str(existing.pop()))
 
@@ -375,12 +487,21 @@ class AutoTable(Table):
         else:
             return super(AutoTable, cls).__new__(cls)
 
-    def __init__(self, **kwargs):
-        badkw = set(kwargs.keys()) - set(self.__class__._store.fields.keys())
+    @classmethod
+    def _field_data(cls, kwargs):
+        badkw = set(kwargs.keys()) - set(cls._store.fields.keys())
+        for kw in badkw:
+            if not kw.startswith('_'):
+                setattr(cls, kw, Field())
+        return super(AutoTable, cls)._field_data(kwargs)
+
+    @classmethod
+    def _update_data(cls, records, kwargs):
+        badkw = set(kwargs.keys()) - set(cls._store.fields.keys())
         for kw in badkw:
             if not kw.startswith('_'):
-                setattr(self.__class__, kw, Field())
-        super(AutoTable, self).__init__(**kwargs)
+                setattr(cls, kw, Field())
+        return super(AutoTable, cls)._update_data(records, kwargs)
 
     def __setattr__(self, attr, value):
         try:
@@ -389,3 +510,31 @@ class AutoTable(Table):
             if not attr.startswith('_'):
                 setattr(self.__class__, attr, Field())
         return super(Table, self).__setattr__(attr, value)
+
+
+class CompactTable(Table):
+
+    """
+    This is a special type of `Table` which stores field values in
+    ``__slots__`` on the records, instead of in the `Table._store`.  Records
+    have no instance ``__dict__``, so they use much less memory than normal
+    records, which is useful for very large tables.  It should be
+    subclassed in exactly the same way as `Table`::
+
+        >>> class Point(CompactTable):
+        ...     x = Field(default=0)
+        ...     y = Field(default=0)
+        >>> p = Point(x=1)
+        >>> p.x, p.y
+        (1, 0)
+
+    All fields must be defined when the table is created, since the slots
+    cannot be changed afterwards, so adding a field later raises a
+    `ConsistencyError`.  For the same reason, attributes other than fields
+    cannot be set on records, unless they are listed in ``__slots__``.
+    The `Table._store` is always a `SlotStore`.
+    """
+
+    __slots__ = ('_Table__uid',)
+
+    _compact = True
@@ -14,8 +14,12 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 675 Mass Ave, Cambridge, MA 02139, USA.
 
-from norman._six import assert_raises
-from norman import Database, Field, NotSet, Table, Join, ValidationError
+from unittest import SkipTest
+
+from norman._six import assert_raises, PY3
+from norman import (Database, Field, NotSet, Table, Join, ValidationError,
+                    BitmapIndex, FullTextIndex, HashIndex, MultiIndex,
+                    NgramIndex, ScanIndex, SpatialIndex)
 
 
 class TestNotSet(object):
@@ -114,6 +118,130 @@ class TestOperations(object):
         got = set(self.T.a <= 2)
         assert got == set(self.records[:3]), got
 
+    def test_min_max(self):
+        self.T(a='x')
+        self.T(a=[1])
+        assert self.T.a.min() == 0
+        assert self.T.a.max() == 'x'
+
+    def test_min_max_empty(self):
+        class U(Table):
+            a = Field()
+        U()
+        assert U.a.min() is NotSet
+        assert U.a.max() is NotSet
+
+    def test_count_range(self):
+        assert self.T.a.count_range(1, 3) == 2
+        assert self.T.a.count_range(3, 1) == 0
+
+    def test_startswith(self):
+        r = [self.T(a=s) for s in ('ab', 'abc', 'b', 'a')]
+        q = self.T.a.startswith('ab')
+        assert set(q) == set(r[:2])
+        assert len(q) == 2
+        assert q._match(r[1])
+        assert set(self.T.a.startswith('')) == set(r)
+        r[0].a = 'b'
+        assert set(self.T.a.startswith('ab')) == set(r[1:2])
+        with assert_raises(TypeError):
+            self.T.a.startswith(5)
+
+    def test_startswith_bytes(self):
+        # Text and bytes are the same type on Python 2
+        if not PY3:
+            raise SkipTest
+        r = [self.T(a=s) for s in ('ab', b'ab', b'b')]
+        q = self.T.a.startswith('ab')
+        assert set(q) == set(r[:1])
+        assert not q._match(r[1])
+        assert set(self.T.a.startswith(b'a')) == set(r[1:2])
+        assert set(self.T.a.startswith('')) == set(r[:1])
+
+    def test_contains(self):
+        r = [self.T(a=s) for s in ('abcd', 'bcde', 'ab', 'b')]
+        q = self.T.a.contains('bcd')
+        assert set(q) == set(r[:2])
+        assert q._match(r[0]) and not q._match(r[2])
+        assert set(self.T.a.contains('b')) == set(r)
+        assert set(self.T.a.contains('xyz')) == set()
+        self.T.delete(r[0])
+        r[1].a = 'bce'
+        assert set(self.T.a.contains('bcd')) == set()
+        assert set(self.T.a.contains('bc')) == set(r[1:2])
+        with assert_raises(TypeError):
+            self.T.a.contains(None)
+
+    def test_contains_bytes(self):
+        # Text and bytes are the same type on Python 2
+        if not PY3:
+            raise SkipTest
+        r = [self.T(a=s) for s in ('abcd', b'bcd')]
+        q = self.T.a.contains('bcd')
+        assert set(q) == set(r[:1])
+        assert not q._match(r[1])
+        assert set(self.T.a.contains(b'bc')) == set(r[1:])
+
+    def test_has(self):
+        lst = [1]
+        r = [self.T(a=v) for v in (['x', 'y'], ('y', lst), set(['x']), 'xy')]
+        q = self.T.a.has('x')
+        assert set(q) == set(r[0:3:2])
+        assert q._match(r[2]) and not q._match(r[3])
+        assert set(self.T.a.has(lst)) == set(r[1:2])
+        r[0].a = ['z']
+        self.T.delete(r[1])
+        assert set(self.T.a.has('y')) == set()
+        assert set(self.T.a.has('z')) == set(r[:1])
+
+    def test_within_box(self):
+        r = [self.T(a=p) for p in ((0, 0), (1, 2.5), (3, 1), (2, 2), 'ab')]
+        q = self.T.a.within_box((0, 1), (2, 3))
+        assert set(q) == set([r[1], r[3]])
+        assert q._match(r[1]) and not q._match(r[4])
+        r[3].a = (2, 4)
+        assert set(self.T.a.within_box((0, 1), (2, 3))) == set(r[1:2])
+
+    def test_within_radius(self):
+        r = [self.T(a=p) for p in ((0, 0), (3, 4), (1, -1), (10, 0))]
+        q = self.T.a.within_radius((0, 0), 5)
+        assert set(q) == set(r[:3])
+        assert q._match(r[1]) and not q._match(r[3])
+
+    def test_nearest(self):
+        r = [self.T(a=p) for p in ((0, 0), (3, 4), (1, -1), (10, 0), 'x')]
+        assert set(self.T.a.nearest((9, 1))) == set(r[3:4])
+        assert set(self.T.a.nearest((0, 1), k=2)) == set([r[0], r[2]])
+        assert set(self.T.a.nearest((0, 1), k=10)) == set(r[:4])
+        self.T.delete(r[0])
+        assert set(self.T.a.nearest((0, 1), k=2)) == set([r[1], r[2]])
+
+    def test_match(self):
+        r = [self.T(a=s) for s in ('Red fox', 'red hat, red', 'fox', [1])]
+        q = self.T.a.match('fox RED')
+        assert set(q) == set(r[:1])
+        assert q._match(r[0]) and not q._match(r[2])
+        assert set(self.T.a.match('')) == set()
+        r[0].a = 'red'
+        assert set(self.T.a.match('red')) == set(r[:2])
+        assert set(self.T.a.match('red fox')) == set()
+
+    def test_match_any(self):
+        r = [self.T(a=s) for s in ('Red fox', 'red hat, red', 'fox', 'x')]
+        q = self.T.a.match_any('fox hat')
+        assert set(q) == set(r[:3])
+        assert q._match(r[1]) and not q._match(r[3])
+        self.T.delete(r[2])
+        assert set(self.T.a.match_any('fox')) == set(r[:1])
+
+    def test_ranked(self):
+        # All scores are different, so the order does not depend on ties
+        r = [self.T(a=s) for s in ('red fox', 'red hat, red', 'blue', 'hat')]
+        assert self.T.a.ranked('red') == [r[1], r[0]]
+        assert self.T.a.ranked('red fox') == [r[0], r[1]]
+        assert self.T.a.ranked('red fox', limit=1) == [r[0]]
+        assert self.T.a.ranked('green') == []
+
     def test_ne(self):
         got = set(self.T.a != 2)
         assert got == set(self.records[:2]) | set(self.records[3:])
@@ -122,6 +250,15 @@ class TestOperations(object):
         got = set(self.T.a & [0, 3])
         assert got == set([self.records[0], self.records[3]])
 
+    def test_and_mixed(self):
+        lst = [1]
+        r = [self.T(), self.T(a='x'), self.T(a=lst)]
+        q = self.T.a & [4, 2, lst, NotSet, 'x', 9, 2]
+        assert set(q) == set(self.records[2:5:2] + r)
+        assert all(q._match(x) for x in self.records[2:5:2] + r)
+        assert not q._match(self.records[0])
+        assert set(self.T.a & []) == set()
+
     def test_indexed_and(self):
         # Test a bug where multiple matches on an indexed field were removed
         class T(Table):
@@ -133,6 +270,108 @@ class TestOperations(object):
         assert got == set([r[0], r[1], r[3]]), got
 
 
+class TestHashOperations(TestOperations):
+
+    def setup(self):
+        class T(Table):
+            a = Field(index='hash')
+        self.records = [T(a=n) for n in range(5)]
+        self.T = T
+
+    def test_index_type(self):
+        assert isinstance(self.T._store.indexes[self.T.a], HashIndex)
+
+    def test_unknown_index(self):
+        with assert_raises(ValueError):
+            class T(Table):
+                a = Field(index='unknown')
+
+
+class TestScanOperations(TestOperations):
+
+    def setup(self):
+        class T(Table):
+            a = Field(index=False)
+        self.records = [T(a=n) for n in range(5)]
+        self.T = T
+
+    def test_index_type(self):
+        index = self.T._store.indexes[self.T.a]
+        assert isinstance(index, ScanIndex)
+        assert len(index) == 5
+
+    def test_set(self):
+        self.records[0].a = 10
+        self.T.delete(self.records[1])
+        assert set(self.T.a > 3) == set([self.records[0], self.records[4]])
+
+
+class TestNgramOperations(TestOperations):
+
+    def setup(self):
+        class T(Table):
+            a = Field(index='ngram')
+        self.records = [T(a=n) for n in range(5)]
+        self.T = T
+
+    def test_index_type(self):
+        assert isinstance(self.T._store.indexes[self.T.a], NgramIndex)
+
+
+class TestFullTextOperations(TestOperations):
+
+    def setup(self):
+        class T(Table):
+            a = Field(index='fulltext')
+        self.records = [T(a=n) for n in range(5)]
+        self.T = T
+
+    def test_index_type(self):
+        assert isinstance(self.T._store.indexes[self.T.a], FullTextIndex)
+
+
+class TestMultiOperations(TestOperations):
+
+    def setup(self):
+        class T(Table):
+            a = Field(multi=True)
+        self.records = [T(a=n) for n in range(5)]
+        self.T = T
+
+    def test_index_type(self):
+        assert self.T.a.multi
+        assert isinstance(self.T._store.indexes[self.T.a], MultiIndex)
+
+    def test_index_error(self):
+        with assert_raises(ValueError):
+            class T(Table):
+                a = Field(multi=True, index='hash')
+
+
+class TestBitmapOperations(TestOperations):
+
+    def setup(self):
+        class T(Table):
+            a = Field(index='bitmap')
+        self.records = [T(a=n) for n in range(5)]
+        self.T = T
+
+    def test_index_type(self):
+        assert isinstance(self.T._store.indexes[self.T.a], BitmapIndex)
+
+
+class TestSpatialOperations(TestOperations):
+
+    def setup(self):
+        class T(Table):
+            a = Field(index='spatial')
+        self.records = [T(a=n) for n in range(5)]
+        self.T = T
+
+    def test_index_type(self):
+        assert isinstance(self.T._store.indexes[self.T.a], SpatialIndex)
+
+
 class TestJoin(object):
 
     def test_field(self):
@@ -338,3 +577,21 @@ class TestCopy(object):
         assert T2.f.readonly
         assert T2.f.default == 4
         assert T1.f.key == T2.f.key
+
+    def test_index(self):
+        class T1(Table):
+            f = Field(index='hash')
+        class T2(Table):
+            pass
+        T2.f = T1.f
+        assert T2.f.index == 'hash'
+        assert isinstance(T2._store.indexes[T2.f], HashIndex)
+
+    def test_multi(self):
+        class T1(Table):
+            f = Field(multi=True)
+        class T2(Table):
+            pass
+        T2.f = T1.f
+        assert T2.f.multi
+        assert isinstance(T2._store.indexes[T2.f], MultiIndex)
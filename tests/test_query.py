@@ -14,9 +14,18 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 675 Mass Ave, Cambridge, MA 02139, USA.
 
+import itertools
+import re
+
 from norman._six import assert_raises
-from norman import Table, Field, Join, query
-from norman._query import _Adder
+from norman import Table, Field, Join, NotSet, ValidationError, query
+from norman._query import _Adder, Query, _between, _collapse
+from norman._store import _SortedList
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
 
 
 class TestCase(object):
@@ -196,7 +205,7 @@ class TestQuery(TestCase):
         q = self.A.a == 1
         assert len(q) == 2
         self.A(a=1)
-        assert len(q) == 2
+        assert len(q) == 3
         q2 = q()
         assert q2 is q
         assert len(q2) == 3
@@ -211,6 +220,615 @@ class TestQuery(TestCase):
         assert str(q) == expect, str(q)
 
 
+class TestStream(TestCase):
+
+    def counter(self, func):
+        self.calls = 0
+
+        def f(record):
+            self.calls += 1
+            return func(record)
+        return query(f, self.A)
+
+    def test_one(self):
+        q = self.counter(lambda r: True)
+        assert q.one() in self.ar
+        assert self.calls == 1
+
+    def test_bool(self):
+        q = self.counter(lambda r: True) | (self.A.a == 1)
+        assert q
+        assert self.calls == 1
+
+    def test_contains(self):
+        q = self.counter(lambda r: r.a >= 3)
+        assert self.ar[4] in q
+        assert not self.ar[0] in q
+        assert q._results is None
+
+    def test_stream(self):
+        q = self.counter(lambda r: r.a > 1)
+        got = list(itertools.islice(q.stream(), 2))
+        assert len(got) == 2
+        assert set(got) <= set(self.ar[2:])
+        assert self.calls < len(self.ar)
+        assert q._results is None
+
+    def test_and_small(self):
+        # The larger side is only read until the first match is found
+        def large():
+            yield self.ar[1]
+            yield self.ar[3]
+            raise AssertionError('Read too far')
+        q = (self.A.c == 'z') & Query(large, table=self.A)
+        assert q.one() is self.ar[3]
+        q = Query(large, table=self.A) & (self.A.c == 'z')
+        assert q.one() is self.ar[3]
+
+    def test_and(self):
+        q1 = (self.A.a >= 2) & (self.A.a <= 4)
+        assert set(q1.stream()) == set(self.ar[2:5])
+        q2 = (self.A.a <= 4) & (self.A.c == 'b')
+        assert set(q2.stream()) == set(self.ar[1:3])
+        assert set(q2.stream()) == set(q2)
+
+    def test_or(self):
+        q = (self.A.a == 1) | (self.A.c == 'b')
+        got = list(q.stream())
+        assert len(got) == 3
+        assert set(got) == set(self.ar[:3])
+
+    def test_sub(self):
+        q = (self.A.c == 'b') - (self.A.a == 1)
+        assert list(q.stream()) == [self.ar[2]]
+
+    def test_results(self):
+        q = self.A.a == 1
+        q()
+        q._results = set([self.ar[5]])
+        assert list(q.stream()) == [self.ar[5]]
+        assert self.ar[5] in q
+
+
+class TestPlanner(TestCase):
+
+    def test_estimate(self):
+        assert (self.A.a == 1)._estimate() == 2
+        assert (self.A.a > 2)._estimate() == 3
+        assert ((self.A.a == 1) | (self.A.c == 'b'))._estimate() == 4
+        assert ((self.A.a == 1) & (self.A.c == 'b'))._estimate() == 2
+        assert ((self.A.a > 1) - (self.A.c == 'b'))._estimate() == 4
+        assert query(lambda r: True, self.A)._estimate() is None
+
+    def test_selective_first(self):
+        # The larger side is only used to check records from the smaller
+        large = self.A.a >= 1
+        large._iter = lambda: iter(self.ar[-1:])
+        q = large & (self.A.c == 'z')
+        assert list(q.stream()) == [self.ar[3]]
+
+    def test_unknown_last(self):
+        def func():
+            yield self.ar[3]
+            raise AssertionError('Read too far')
+        q = Query(func, table=self.A) & (self.A.a >= 2) & (self.A.c == 'z')
+        assert q.one() is self.ar[3]
+
+    def test_collapse(self):
+        q = (self.A.a > 1) & (self.A.c != 'q') & (self.A.a <= 4)
+        terms = _collapse(q._conjuncts())
+        assert len(terms) == 2
+        assert _between in [t._op for t in terms]
+        assert set(q.stream()) == set(self.ar[2:5])
+        assert set(q) == set(self.ar[2:5])
+
+    def test_collapse_empty(self):
+        q = (self.A.a > 3) & (self.A.a < 2)
+        assert list(q.stream()) == []
+
+    def test_list_key(self):
+        # The residual filter compares keys which cannot be hashed
+        class T(Table):
+            a = Field(key=lambda x: re.findall(r'\d+', x))
+            b = Field()
+        r = [T(a='x 1', b=1), T(a='x 2', b=1)]
+        r += [T(a='z 1', b=2) for i in range(5)]
+        q = (T.a == 'y 1') & (T.b == 1)
+        assert list(q.stream()) == r[:1]
+        assert set(q) == set(r[:1])
+
+    def test_no_estimate(self):
+        q = (query(lambda r: r.a > 2, self.A) &
+             query(lambda r: r.a < 5, self.A))
+        assert set(q.stream()) == set(self.ar[3:5])
+
+
+class TestExplain(TestCase):
+
+    def test_index(self):
+        plan = (self.A.a == 1).explain()
+        assert plan.kind == 'index'
+        assert plan.index is self.A._store.indexes[self.A.a]
+        assert plan.estimate == 2
+        assert plan.rows is None and plan.time is None
+        assert plan.children == []
+
+    def test_analyze(self):
+        q = (self.A.a == 1) | (self.A.c == 'b')
+        plan = q.explain(analyze=True)
+        assert plan.kind == 'set'
+        assert (plan.estimate, plan.rows) == (4, 3)
+        assert [c.rows for c in plan.children] == [2, 2]
+        assert plan.time >= 0
+        assert q._results is None
+
+    def test_planned(self):
+        q = (self.A.a > 1) & (self.A.c == 'z') & (self.A.a < 5)
+        plan = q.explain(True)
+        assert [c.kind for c in plan.children] == ['index', 'range']
+        assert [c.rows for c in plan.children] == [1, 3]
+        assert plan.rows == 1
+
+    def test_results(self):
+        q1 = (self.A.a == 1)()
+        plan = (q1 | (self.A.a == 2)).explain()
+        assert plan.children[0].kind == 'results'
+        assert q1.explain().kind == 'index'
+
+    def test_other(self):
+        q = query(lambda r: r.a == 1, self.A).field('b')
+        plan = q.explain(True)
+        assert plan.kind == 'field'
+        assert plan.estimate is None
+        assert plan.rows == 2
+        assert plan.children[0].kind == 'function'
+        assert plan.children[0].rows == 2
+
+    def test_str(self):
+        plan = ((self.A.a > 1) & (self.A.a <= 3)).explain(True)
+        assert str(plan).startswith('set: planned (1 < A.a <= 3)')
+        assert len(str(plan).splitlines()) == 2
+        assert 'rows 2' in str(plan)
+
+
+class TestCount(TestCase):
+
+    def test_index(self):
+        # Counts from the index do not read any records
+        index = self.A._store.indexes[self.A.a]
+        index.between = index._sorted.values = None
+        assert (self.A.a == 1).count() == 2
+        assert (self.A.a != 1).count() == 4
+        assert (self.A.a > 2).count() == 3
+        assert ((self.A.a >= 2) & (self.A.a < 5)).count() == 3
+        assert ((self.A.a > 2) & (self.A.a < 2)).count() == 0
+        assert len((self.A.a >= 2) & (self.A.a < 5)) == 3
+
+    def test_set(self):
+        q = (self.A.a > 8) & (self.A.c == 'z')
+        assert q._count() == 0
+        q = ((self.A.a == 1) | (self.A.a > 8))
+        assert q._count() == 2
+        q = (self.A.c == 'b') - (self.A.a == 3)
+        assert q._count() is None
+        assert q.count() == 2
+
+    def test_stored(self):
+        q = query(lambda r: r.a > 2, self.A)
+        assert q._count() is None
+        assert q.count() == 3
+        assert q._results is None
+        assert len(q) == 3
+        assert q._results is not None
+        assert q._count() == 3
+
+
+class TestOrder(TestCase):
+
+    def setup(self):
+        super(TestOrder, self).setup()
+        self.A(c='m')
+
+    def test_index(self):
+        # Whole tables are read from the index in order
+        q = query(self.A).order_by(self.A.a)
+        assert q.query._read_index(self.A._store.indexes[self.A.a], None)
+        assert [r.a for r in q] == [1, 1, 2, 3, 4, 5, NotSet]
+        q = query(self.A).order_by(self.A.a, reverse=True)
+        assert [r.a for r in q] == [5, 4, 3, 2, 1, 1, NotSet]
+
+    def test_top(self):
+        q = (self.A.c == 'b').order_by(self.A.a, reverse=True)
+        index = self.A._store.indexes[self.A.a]
+        assert not q.query._read_index(index, None)
+        assert list(q) == [self.ar[2], self.ar[1]]
+        q = (self.A.a > 1).order_by(self.A.c)
+        assert [r.c for r in q] == ['b', 'x', 'y', 'z']
+        assert [r.c for r in q.limit(2)] == ['b', 'x']
+
+    def test_limit_offset(self):
+        q = query(self.A).order_by(self.A.a)
+        assert [r.a for r in q.limit(3)] == [1, 1, 2]
+        assert [r.a for r in q.offset(4)] == [4, 5, NotSet]
+        assert [r.a for r in q.offset(2).limit(2)] == [2, 3]
+        assert [r.a for r in q.limit(4).offset(2)] == [2, 3]
+        assert [r.a for r in q.limit(4).limit(5)] == [1, 1, 2, 3]
+        assert list(q.offset(10)) == []
+
+    def test_change_while_iterating(self):
+        # Changing the index does not affect records already being read
+        load = _SortedList._load
+        _SortedList._load = 2
+        try:
+            class C(Table):
+                a = Field()
+            records = C.bulk_create({'a': i} for i in range(20))
+            q = query(C).order_by(C.a).limit(15)
+            assert q.query._read_index(C._store.indexes[C.a], 15)
+            for r in q:
+                r.a = -r.a - 1
+            assert [r.a for r in records[:15]] == list(range(-1, -16, -1))
+            got = []
+            for r in q:
+                got.append(r)
+                C.delete(r)
+            assert got == records[14::-1]
+            assert len(C) == 5
+        finally:
+            _SortedList._load = load
+
+    def test_unindexed(self):
+        class C(Table):
+            a = Field(index='hash')
+        for a in (3, 1, 'z', 2):
+            C(a=a)
+        q = query(C).order_by(C.a)
+        assert [r.a for r in q] == [1, 2, 3, 'z']
+        assert [r.a for r in q.offset(1).limit(2)] == [2, 3]
+
+
+class TestAggregate(TestCase):
+
+    def test_aggregate(self):
+        self.A(c='m')
+        got = query(self.A).aggregate(sum=self.A.a, avg=self.A.a,
+                                      min=self.A.c, max=self.A.c,
+                                      count=self.A.a)
+        assert got == {'sum': 16, 'avg': 16 / 6.0, 'min': 'a', 'max': 'z',
+                       'count': 6}
+
+    def test_aggregate_few(self):
+        got = (self.A.a == 1).aggregate(sum=self.A.a, max=self.A.c)
+        assert got == {'sum': 2, 'max': 'b'}
+
+    def test_aggregate_empty(self):
+        got = (self.A.a > 10).aggregate(sum=self.A.a, avg=self.A.a,
+                                        min=self.A.a)
+        assert got == {'sum': 0, 'avg': NotSet, 'min': NotSet}
+
+    def test_aggregate_unknown(self):
+        with assert_raises(TypeError):
+            query(self.A).aggregate(median=self.A.a)
+
+    def test_group_by_index(self):
+        self.A(c='m')
+        q = query(self.A)
+        assert q._read_index(self.A._store.indexes[self.A.a], None)
+        groups = q.group_by(self.A.a)
+        assert [v for v, r in groups] == [1, 2, 3, 4, 5, NotSet]
+        assert set(groups[0][1]) == set(self.ar[:2])
+        # Most of the table is also read from the index
+        q = self.A.a >= 2
+        assert q._read_index(self.A._store.indexes[self.A.a], None)
+        groups = q.group_by(self.A.a)
+        assert [v for v, r in groups] == [2, 3, 4, 5]
+
+    def test_group_by_query(self):
+        groups = (self.A.a < 3).group_by(self.A.c)
+        assert [v for v, r in groups] == ['a', 'b']
+        assert set(groups[1][1]) == set(self.ar[1:3])
+        groups = (self.A.c == 'b').group_by(self.A.b)
+        assert sorted((len(r), v.d) for v, r in groups) == [(1, 1), (1, 2)]
+
+
+class TestBitmap(object):
+
+    def setup(self):
+        class T(Table):
+            s = Field(index='bitmap')
+            c = Field(index='bitmap')
+            n = Field()
+        self.T = T
+        self.r = [T(s=s, c=c, n=i) for i, (s, c) in
+                  enumerate(['ax', 'ay', 'bx', 'by', 'cx', 'ay'])]
+
+    def test_bitwise(self):
+        T, r = self.T, self.r
+        for q, expect in [((T.s == 'a') & (T.c == 'y'), [r[1], r[5]]),
+                          ((T.s == 'a') | (T.s == 'c'), r[:2] + r[4:]),
+                          ((T.s == 'a') - (T.c == 'x'), [r[1], r[5]]),
+                          ((T.s == 'b') ^ (T.c == 'x'), r[0:5:3] + r[4:5]),
+                          ((T.s == 'z') | (T.c == 'x'), r[0:5:2])]:
+            assert q._bitmap() is not None
+            assert q._count() == len(expect)
+            assert set(q) == set(expect), q
+
+    def test_mixed(self):
+        T, r = self.T, self.r
+        q = ((T.s == 'a') | (T.s == 'b')) & (T.n > 2)
+        assert q._bitmap() is None
+        assert q._args[0]._bitmap() is not None
+        assert set(q) == set(r[3:4] + r[5:])
+
+    def test_update(self):
+        T, r = self.T, self.r
+        q = (T.s == 'a') & (T.c == 'y')
+        assert set(q) == set([r[1], r[5]])
+        r[1].s = 'b'
+        T.delete(r[5])
+        new = T(s='a', c='y')
+        assert set(q) == set([new])
+        assert len(T._store.row_ids) == 6
+
+
+class TestContains(TestCase):
+
+    def no_evaluate(self, q):
+        def fail():
+            raise AssertionError('Query evaluated')
+        q._evaluate = fail
+        for a in q._args:
+            if isinstance(a, Query):
+                self.no_evaluate(a)
+        return q
+
+    def test_comparisons(self):
+        for q, expect in [(self.A.a == 1, self.ar[:2]),
+                          (self.A.a != 1, self.ar[2:]),
+                          (self.A.a > 3, self.ar[4:]),
+                          (self.A.a <= 2, self.ar[:3]),
+                          (self.A.c >= 'x', self.ar[3:])]:
+            expect = set(expect)
+            self.no_evaluate(q)
+            got = set(r for r in self.ar + self.br if r in q)
+            assert got == expect, (q, got)
+
+    def test_combined(self):
+        make = lambda: ((((self.A.a >= 2) & (self.A.c != 'z')) |
+                         (self.A.a == 1)) - (self.A.c == 'y') ^
+                        (self.A.b == self.br[0]))
+        expect = set(make())
+        q = self.no_evaluate(make())
+        assert set(r for r in self.ar if r in q) == expect
+        assert q._predicate is not None
+
+    def test_changed(self):
+        q = self.no_evaluate((self.A.a > 2) & (self.A.c == 'b'))
+        assert self.ar[2] not in q
+        self.ar[2].a = 3
+        assert self.ar[2] in q
+
+    def test_list_key(self):
+        class T(Table):
+            a = Field(key=lambda x: re.findall(r'\d+', x))
+        r = [T(a='c 1'), T(a='d 1 2'), T(a='e 2')]
+        q = self.no_evaluate(T.a == 'x 1')
+        assert r[0] in q
+        assert r[1] not in q
+        assert r[2] not in q
+        assert set(T.a == 'x 1') == set(r[:1])
+
+    def test_unmatchable(self):
+        q = query(self.A).field('b')
+        assert self.br[0] in q
+        assert self.br[1] in q
+        assert self.ar[0] not in q
+
+
+class TestCache(TestCase):
+
+    def test_reuse(self):
+        q = (self.A.a == 1) | (self.A.c == 'z')
+        results = set(q)
+        assert q._results is not None
+        cached = q._results
+        assert set(q) == results
+        assert q._results is cached
+        self.ar[5].b = None
+        self.B(d=5)
+        assert set(q) == results
+        assert q._results is cached
+
+    def test_set(self):
+        q = self.A.a == 1
+        assert set(q) == set(self.ar[:2])
+        self.ar[0].a = 2
+        assert set(q) == set(self.ar[1:2])
+        assert self.ar[0] not in q
+        assert q.one() is self.ar[1]
+
+    def test_add_delete(self):
+        q = self.A.c > 'x'
+        assert set(q) == set(self.ar[3:5])
+        new = self.A(c='zz')
+        assert set(q) == set(self.ar[3:5] + [new])
+        self.A.delete(self.ar[3])
+        assert set(q) == set([self.ar[4], new])
+
+    def test_func(self):
+        q = query(lambda r: r.a > 3, self.A)
+        assert set(q) == set(self.ar[4:])
+        self.ar[0].a = 10
+        assert set(q) == set([self.ar[0]] + self.ar[4:])
+
+    def test_volatile(self):
+        q = (self.A.a == 1).field('b')
+        assert set(q) == set(self.br[:2])
+        self.br[0].d = 10
+        self.ar[0].b = self.br[2]
+        assert set(q) == set(self.br[1:3])
+
+
+class TestLive(TestCase):
+
+    def setup(self):
+        super(TestLive, self).setup()
+        self.changes = []
+        self.callback = lambda added, removed: self.changes.append(
+            (added, removed))
+
+    def test_results(self):
+        live = ((self.A.a >= 2) & (self.A.c != 'z')).live()
+        assert set(live) == set([self.ar[2], self.ar[4], self.ar[5]])
+        assert len(live) == 3
+        assert self.ar[2] in live
+        live.close()
+
+    def test_update(self):
+        live = ((self.A.a >= 2) & (self.A.c != 'z')).live(self.callback)
+        self.ar[0].a = 2
+        self.ar[2].c = 'z'
+        new = self.A(a=10, c='a')
+        self.A.delete(self.ar[4])
+        assert live.results == set([self.ar[0], self.ar[5], new])
+        assert self.changes == [(set([self.ar[0]]), set()),
+                                (set(), set([self.ar[2]])),
+                                (set([new]), set()),
+                                (set(), set([self.ar[4]]))]
+        live.close()
+
+    def test_incremental(self):
+        q = (self.A.a == 1) | (self.A.c & ['x', 'y'])
+        live = q.live()
+        assert live.results == set([self.ar[0], self.ar[1], self.ar[4],
+                                    self.ar[5]])
+        q._evaluate = None
+        self.ar[3].c = 'x'
+        self.ar[0].a = 5
+        self.ar[1].b = self.br[2]
+        assert live.results == set([self.ar[1], self.ar[3], self.ar[4],
+                                    self.ar[5]])
+        live.close()
+
+    def test_func(self):
+        live = query(lambda r: r.a > 3, self.A).live(self.callback)
+        assert live.results == set(self.ar[4:])
+        self.ar[0].a = 4
+        assert live.results == set([self.ar[0]] + self.ar[4:])
+        assert self.changes == [(set([self.ar[0]]), set())]
+        live.close()
+
+    def test_list_key(self):
+        class T(Table):
+            a = Field(key=lambda x: re.findall(r'\d+', x))
+        live = (T.a == 'x 1').live(self.callback)
+        new = T(a='y 1')
+        T(a='y 2')
+        assert live.results == set([new])
+        assert self.changes == [(set([new]), set())]
+        live.close()
+
+    def test_close(self):
+        live = (self.A.a == 1).live(self.callback)
+        live.close()
+        assert self.A._store.listeners == []
+        self.A(a=1)
+        assert len(live) == 2
+        assert self.changes == []
+
+
+class TestUpdate(object):
+
+    def setup(self):
+        class T(Table):
+            a = Field(validators=[int])
+            b = Field()
+            c = Field(unique=True)
+
+            def validate(self):
+                assert self.b != 'bad'
+        self.T = T
+        self.records = [T(a=i, b=i % 2, c=i) for i in range(6)]
+
+    def test_update(self):
+        q = self.T.b == 1
+        q.update(a='10', b=2)
+        assert [r.a for r in self.records] == [0, 10, 2, 10, 4, 10]
+        assert set(self.T.b == 2) == set(self.records[1::2])
+        assert set(self.T.a == 10) == set(self.records[1::2])
+        assert set(self.T.b == 1) == set()
+        assert len(q) == 0
+
+    def test_update_few(self):
+        # A small batch is inserted into the indexes without reloading them
+        more = self.T.bulk_create({'a': i, 'b': 5, 'c': i}
+                                  for i in range(6, 100))
+        with patch.object(_SortedList, 'load', side_effect=AssertionError):
+            (self.T.a == 50).update(b=6)
+        assert set(self.T.b == 6) == set([more[44]])
+        assert len(self.T.b == 5) == 93
+
+    def test_validator_fails(self):
+        with assert_raises(ValueError):
+            (self.T.b == 1).update(a='x')
+        assert [r.a for r in self.records] == list(range(6))
+
+    def test_validate_fails(self):
+        with assert_raises(ValidationError):
+            (self.T.b == 1).update(a=20, b='bad')
+        assert [r.a for r in self.records] == list(range(6))
+        assert [r.b for r in self.records] == [0, 1] * 3
+        assert set(self.T.b == 1) == set(self.records[1::2])
+        assert set(self.T.a == 20) == set()
+
+    def test_unique(self):
+        with assert_raises(ValidationError):
+            (self.T.b == 1).update(c=10)
+        with assert_raises(ValidationError):
+            (self.T.a == 1).update(c=2)
+        (self.T.a == 1).update(c=10)
+        assert self.records[1].c == 10
+        assert set(self.T._store.unique_index == (10,)) == set(
+            self.records[1:2])
+
+    def test_readonly(self):
+        self.T.a.readonly = True
+        with assert_raises(ValidationError):
+            (self.T.b == 1).update(a=3)
+        (self.T.a == 3).update(a=3)
+
+    def test_bad_field(self):
+        with assert_raises(AttributeError):
+            (self.T.b == 1).update(d=3)
+
+
+class TestUniqueLookup(object):
+
+    def setup(self):
+        class T(Table):
+            a = Field(unique=True)
+            b = Field(unique=True)
+            c = Field()
+        self.T = T
+        self.records = [T(a=1, b=1, c=1), T(a=1, b=2, c=1), T(a=2, b=1, c=2)]
+
+    def test_lookup(self):
+        q = (self.T.a == 1) & (self.T.b == 2)
+        assert q._unique_lookup() == set([self.records[1]])
+        assert set(q) == set([self.records[1]])
+
+    def test_lookup_extra(self):
+        q = (self.T.c == 1) & (self.T.a == 1) & (self.T.b == 2)
+        assert q._unique_lookup() == set([self.records[1]])
+        q = (self.T.c == 2) & (self.T.a == 1) & (self.T.b == 2)
+        assert q._unique_lookup() == set()
+
+    def test_no_lookup(self):
+        assert ((self.T.a == 1) & (self.T.c == 1))._unique_lookup() is None
+        assert ((self.T.a == 1) | (self.T.b == 1))._unique_lookup() is None
+        assert ((self.T.a == 1) & (self.T.b > 1))._unique_lookup() is None
+
+
 class TestAdder(TestCase):
 
     def test_settable(self):
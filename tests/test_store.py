@@ -16,9 +16,16 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 675 Mass Ave, Cambridge, MA 02139, USA.
 
-from norman._six import assert_raises
+import numbers
+import operator
+from unittest import SkipTest
 
-from norman import NotSet, Field, Store, Index
+from norman._six import assert_raises, PY3
+
+from norman import (NotSet, Field, Table, Store, ColumnarStore, SlotStore,
+                    Index, HashIndex, ValidationError)
+from norman._store import CompositeIndex
+from norman._store import _SortedList, _RowIds, _successor
 
 try:
     from unittest.mock import Mock, patch
@@ -26,6 +33,80 @@ except ImportError:
     from mock import Mock, patch
 
 
+##### Sorted list tests
+
+class TestSortedList(object):
+
+    def setup(self):
+        self.load = _SortedList._load
+        _SortedList._load = 2
+        self.s = _SortedList()
+        for i, k in enumerate([5, 1, 3, 3, 9, 0, 7, 3]):
+            self.s.add(k, 'v' + str(i))
+
+    def teardown(self):
+        _SortedList._load = self.load
+
+    def test_blocks_bounded(self):
+        assert len(self.s._keys) > 1
+        assert all(len(b) <= 4 for b in self.s._keys)
+
+    def test_sorted(self):
+        assert list(self.s.keys()) == [0, 1, 3, 3, 3, 5, 7, 9]
+        assert list(self.s.values()) == ['v5', 'v1', 'v2', 'v3', 'v7',
+                                         'v0', 'v6', 'v4']
+
+    def test_len(self):
+        assert len(self.s) == 8
+
+    def test_range(self):
+        i = self.s.bisect_left(3)
+        j = self.s.bisect_right(3)
+        assert list(self.s.values(i, j)) == ['v2', 'v3', 'v7']
+        assert list(self.s.values(i, j, reverse=True)) == ['v7', 'v3', 'v2']
+        assert list(self.s.values(None, i)) == ['v5', 'v1']
+        assert list(self.s.values(j, None)) == ['v0', 'v6', 'v4']
+
+    def test_remove(self):
+        self.s.remove(3, 'v3')
+        self.s.remove(9, 'v4')
+        self.s.remove(0, 'v5')
+        assert list(self.s.keys()) == [1, 3, 3, 5, 7]
+        assert list(self.s.values()) == ['v1', 'v2', 'v7', 'v0', 'v6']
+        assert self.s._maxes == [b[-1] for b in self.s._keys]
+
+    def test_remove_missing(self):
+        with assert_raises(ValueError):
+            self.s.remove(3, 'v0')
+        with assert_raises(ValueError):
+            self.s.remove(10, 'v0')
+
+    def test_load(self):
+        self.s.load([1, 2, 3, 4, 5], 'abcde')
+        assert list(self.s.values()) == list('abcde')
+        assert len(self.s._keys) == 3
+
+    def test_find(self):
+        assert list(self.s.find([])) == []
+        assert list(self.s.find([3])) == ['v2', 'v3', 'v7']
+        assert list(self.s.find([-1, 0, 0, 3, 4, 9, 10])) == \
+            ['v5', 'v2', 'v3', 'v7', 'v4']
+
+    def test_runs(self):
+        runs = list(self.s.runs())
+        assert [k for k, v in runs] == [0, 1, 3, 5, 7, 9]
+        assert runs[2] == (3, ['v2', 'v3', 'v7'])
+
+    def test_count(self):
+        i = self.s.bisect_left(3)
+        j = self.s.bisect_right(7)
+        assert self.s.count(i, j) == 5
+        assert self.s.count(None, i) == 2
+        assert self.s.count(j, None) == 1
+        assert self.s.count(j, i) == 0
+        assert self.s.count() == 8
+
+
 ##### Index tests
 
 class TestIndex_Ordered(object):
@@ -63,6 +144,49 @@ class TestIndex_Ordered(object):
         assert self.i._ordered == expect
         assert self.i._unordered == self.unordered
 
+    def test_update(self):
+        r = [Mock(), Mock(), Mock()]
+        self.i.update([(3, r[0]), (-1, r[1]), (3, r[2])])
+        self.orecords[5:5] = [r[0], r[2]]
+        self.orecords.insert(0, r[1])
+        assert self.i._ordered == ([-1, 0, 1, 2, 3, 3, 3, 3, 4],
+                                   self.orecords)
+        assert self.i._unordered == self.unordered
+
+    def test_remove_many(self):
+        self.i.remove_many([(3, self.orecords[4]), (0, self.orecords[0])])
+        del self.orecords[4]
+        del self.orecords[0]
+        assert self.i._ordered == ([1, 2, 3, 4], self.orecords)
+        assert self.i._unordered == self.unordered
+
+    def test_update_few(self):
+        self.i.update((i + 10, 'X' + str(i)) for i in range(100))
+        r = [Mock(), Mock()]
+        self.i.update([(3, r[0]), (50, r[1])])
+        expect = self.orecords[:5] + [r[0]] + self.orecords[5:]
+        expect += ['X' + str(i) for i in range(41)] + [r[1]]
+        expect += ['X' + str(i) for i in range(41, 100)]
+        assert self.i._ordered[1] == expect
+
+    def test_remove_many_few(self):
+        self.i.update((i + 10, 'X' + str(i)) for i in range(100))
+        self.i.remove_many([(3, self.orecords[3]), (50, 'X40')])
+        expect = self.orecords[:3] + self.orecords[4:]
+        expect += ['X' + str(i) for i in range(100) if i != 40]
+        assert self.i._ordered[1] == expect
+
+    def test_remove_many_missing(self):
+        with assert_raises(ValueError):
+            self.i.remove_many([(3, self.orecords[0])])
+        assert self.i._ordered == self.ordered
+
+    def test_update_unsortable(self):
+        r = [Mock(), Mock()]
+        self.i.update([(3, r[0]), ('a', r[1])])
+        assert set(self.i == 'a') == set([r[1]])
+        assert set(self.i == 3) == set(self.orecords[3:5] + [r[0]])
+
     def test_iter_eq(self):
         got = set(self.i == 3)
         expect = set(self.orecords[3:5])
@@ -196,6 +320,340 @@ class TestIndexCornerCases(object):
         assert i._unordered[NotSet] == [(NotSet, r)]
 
 
+def _number_key(value):
+    # Only numbers can be ordered, on both Python 2 and 3
+    if not isinstance(value, numbers.Number):
+        raise TypeError
+    return value
+
+
+class TestIndexEstimate(object):
+
+    def setup(self):
+        self.i = Index(Mock(key=_number_key))
+        for r, v in enumerate([0, 1, 1, 2, 3, 3, 3, NotSet, 'a', 'a', [1]]):
+            self.i.insert(v, r)
+
+    def test_estimate(self):
+        assert self.i.estimate(operator.eq, 3) == 3
+        assert self.i.estimate(operator.eq, 5) == 0
+        assert self.i.estimate(operator.lt, 3) == 4
+        assert self.i.estimate(operator.le, 1) == 3
+        assert self.i.estimate(operator.gt, 1) == 4
+        assert self.i.estimate(operator.ge, 1) == 6
+        assert self.i.estimate(operator.ne, 1) == 9
+        assert self.i.estimate(operator.ne, [1]) == 11
+
+    def test_estimate_unordered(self):
+        assert self.i.estimate(operator.eq, NotSet) == 1
+        assert self.i.estimate(operator.eq, [1]) == 0
+
+    def test_count(self):
+        assert self.i.count(operator.eq, 3) == 3
+        assert self.i.count(operator.ge, 1) == 6
+        assert self.i.count(operator.ne, NotSet) == 10
+        assert self.i.count(operator.eq, [1]) is None
+        assert self.i.count(operator.lt, NotSet) is None
+        assert self.i.count_between(operator.ge, 1, operator.lt, 3) == 3
+        assert self.i.count_between(operator.gt, 3, operator.lt, 1) == 0
+
+    def test_isin(self):
+        got = self.i.isin([3, 0, NotSet, 'a', [1], 10])
+        assert got == set([0, 4, 5, 6, 7, 8, 9])
+
+    def test_between(self):
+        assert list(self.i.between(operator.gt, 0, operator.lt, 3)) == \
+            [1, 2, 3]
+        assert list(self.i.between(operator.ge, 1, operator.le, 3)) == \
+            [1, 2, 3, 4, 5, 6]
+        assert list(self.i.between(operator.ge, 3, operator.le, 1)) == []
+
+
+class TestPrefix(object):
+
+    def test_successor(self):
+        assert _successor('ab') == 'ac'
+        assert _successor(b'a\xff') == b'b'
+        assert _successor(b'\xff') is None
+        assert _successor('') is None
+
+    def test_count_prefix(self):
+        i = Index(Field())
+        for r, v in enumerate(['a', 'ab', 'abc', 'b', 1, NotSet]):
+            i.insert(v, r)
+        assert i.count_prefix('a') == 3
+        assert i.count_prefix('ab') == 2
+        assert i.count_prefix('c') == 0
+        assert Index(Field(key=str)).count_prefix('a') is None
+
+    def test_count_prefix_bytes(self):
+        # Text and bytes are the same type on Python 2
+        if not PY3:
+            raise SkipTest
+        i = Index(Field())
+        for r, v in enumerate(['a', 'ab', b'ab']):
+            i.insert(v, r)
+        assert i.count_prefix('a') == 2
+        assert i.count_prefix(b'a') == 1
+
+
+class TestNgramIndex(object):
+
+    def setup(self):
+        class T(Table):
+            a = Field(index='ngram')
+        self.T = T
+        self.i = T._store.indexes[T.a]
+
+    def test_grams(self):
+        r = self.T(a='abcd')
+        assert set(self.i._grams) == set(['abc', 'bcd'])
+        r.a = 'ab'
+        assert self.i._grams == {}
+        assert self.i._short == {'ab': set([r])}
+        self.T.delete(r)
+        assert self.i._short == {}
+
+    def test_bulk(self):
+        r = self.T.bulk_create([{'a': 'abcd'}, {'a': 'bcde'}, {'a': 1}])
+        assert self.i._grams['bcd'] == set(r[:2])
+        self.T.delete(r)
+        assert self.i._grams == {}
+
+    def test_contains_not_string(self):
+        self.T(a='abcd')
+        with assert_raises(TypeError):
+            self.i.contains(12345)
+
+
+class TestFullTextIndex(object):
+
+    def setup(self):
+        class T(Table):
+            a = Field(index='fulltext')
+        self.T = T
+        self.i = T._store.indexes[T.a]
+
+    def test_postings(self):
+        r = self.T.bulk_create([{'a': 'a b a'}, {'a': 'B c'}, {'a': 1}])
+        assert self.i.postings(['a', 'b', 'd']) == \
+            {'a': {r[0]: 2}, 'b': {r[0]: 1, r[1]: 1}}
+        assert self.i.count_token('b') == 2
+        assert self.i.count_token('d') == 0
+        r[0].a = 'c'
+        assert self.i.postings(['a', 'c']) == {'c': {r[0]: 1, r[1]: 1}}
+        self.T.delete(r)
+        assert self.i._postings == {}
+
+    def test_scan(self):
+        r = self.T(a='a b a')
+        i = Index(self.T.a)
+        assert i.postings(['a', 'c']) == {'a': {r: 2}}
+        assert i.count_token('a') is None
+
+
+class TestMultiIndex(object):
+
+    def setup(self):
+        class T(Table):
+            a = Field(multi=True)
+        self.T = T
+        self.i = T._store.indexes[T.a]
+
+    def test_elements(self):
+        r = self.T.bulk_create([{'a': ['x', 'y', 'x']}, {'a': ('y', [1])},
+                                {'a': 1}])
+        assert self.i._elements == {'x': set(r[:1]), 'y': set(r[:2])}
+        assert self.i.count_element('y') == 2
+        assert self.i.count_element('z') == 0
+        assert self.i.count_element([1]) is None
+        r[0].a = ['z']
+        assert self.i._elements == {'z': set(r[:1]), 'y': set(r[1:2])}
+        self.T.delete(r)
+        assert self.i._elements == {}
+
+    def test_scan(self):
+        r = self.T(a=['x'])
+        assert list(Index(self.T.a).has('x')) == [r]
+        assert Index(self.T.a).count_element('x') is None
+
+
+class TestRowIds(object):
+
+    def test_acquire(self):
+        rows = _RowIds()
+        assert rows.acquire('a') == 0
+        assert rows.acquire('b') == 1
+        assert rows.acquire('a') == 0
+        rows.release('a')
+        assert len(rows) == 2
+        rows.release('a')
+        assert len(rows) == 1
+        assert rows.acquire('c') == 0
+        assert list(rows.records(3)) == ['c', 'b']
+        assert list(rows.records(0)) == []
+
+    def test_discard(self):
+        rows = _RowIds()
+        rows.acquire('a')
+        rows.acquire('b')
+        rows.acquire('b')
+        assert rows.discard('b') == 1
+        assert rows.discard('b') == 1
+        assert len(rows) == 1
+        assert rows.acquire('c') == 1
+
+
+class TestBitmapIndex(object):
+
+    def setup(self):
+        class T(Table):
+            a = Field(index='bitmap')
+        self.T = T
+        self.i = T._store.indexes[T.a]
+
+    def test_bitmap(self):
+        lst = [1]
+        r = self.T.bulk_create([{'a': 1}, {'a': 2}, {'a': 1}, {'a': lst}])
+        rows, bits = self.i.bitmap(1)
+        assert rows is self.T._store.row_ids
+        assert set(rows.records(bits)) == set([r[0], r[2]])
+        assert self.i.bitmap(3)[1] == 0
+        assert self.i.bitmap(lst) is None
+        assert len(rows) == 3
+        r[0].a = 2
+        assert set(rows.records(self.i.bitmap(2)[1])) == set(r[:2])
+        self.T.delete(r[2])
+        assert 1 not in self.i._bitmaps
+
+    def test_clear(self):
+        self.T(a=1)
+        self.T._store.clear()
+        assert len(self.T._store.row_ids) == 0
+        assert self.i.bitmap(1)[1] == 0
+
+
+class TestSpatialIndex(object):
+
+    def setup(self):
+        class T(Table):
+            a = Field(index='spatial')
+        self.T = T
+        self.i = T._store.indexes[T.a]
+
+    def test_points(self):
+        r = self.T.bulk_create([{'a': (1, 2)}, {'a': (0, 5)}, {'a': (1, 2)},
+                                {'a': 'xy'}, {'a': (1, 2, 3)}])
+        assert list(self.i._points.keys()) == [(0, 5), (1, 2), (1, 2)]
+        r[0].a = (3, 3)
+        self.T.delete(r[1])
+        assert list(self.i._points.keys()) == [(1, 2), (3, 3)]
+        assert list(self.i._points.values()) == [r[2], r[0]]
+
+    def test_nearest(self):
+        r = self.T.bulk_create([{'a': (x, y)} for x in range(5)
+                                for y in range(5)])
+        assert self.i.nearest((2, 2), 1) == [r[12]]
+        assert set(self.i.nearest((0.1, 2), 2)) == set([r[2], r[7]])
+        assert self.i.nearest((2, 2), 0) == []
+        assert len(self.i.nearest((10, 10), 30)) == 25
+
+
+class TestHashIndex(object):
+
+    def setup(self):
+        field = Mock(key=_number_key)
+        self.i = HashIndex(field)
+        self.records = ['R' + str(i) for i in range(6)]
+        self.values = [0, 1, 1, NotSet, [1], 'a']
+        for v, r in zip(self.values, self.records):
+            self.i.insert(v, r)
+
+    def test_len(self):
+        assert len(self.i) == 6
+
+    def test_insert(self):
+        assert self.i._hashed[1] == set(self.records[1:3])
+        assert self.i._unhashed == {id(self.values[4]): [([1], 'R4')]}
+
+    def test_remove(self):
+        self.i.remove(1, 'R1')
+        self.i.remove(0, 'R0')
+        self.i.remove(self.values[4], 'R4')
+        assert self.i._hashed[1] == set(['R2'])
+        assert 0 not in self.i._hashed
+        assert self.i._unhashed == {}
+
+    def test_iter_eq(self):
+        assert set(self.i == 1) == set(self.records[1:3])
+        assert set(self.i == NotSet) == set(['R3'])
+        assert set(self.i == self.values[4]) == set(['R4'])
+        assert set(self.i == [1]) == set()
+        assert set(self.i == 5) == set()
+
+    def test_iter_ne(self):
+        expect = set(['R0', 'R3', 'R4', 'R5'])
+        assert set(self.i != 1) == expect
+
+    def test_iter_range(self):
+        # Unsortable values and NotSet are skipped
+        assert set(self.i < 1) == set(['R0'])
+        assert set(self.i <= 1) == set(self.records[:3])
+        assert set(self.i > 0) == set(['R1', 'R2'])
+        assert set(self.i >= 1) == set(['R1', 'R2'])
+
+    def test_estimate(self):
+        assert self.i.estimate(operator.eq, 1) == 2
+        assert self.i.estimate(operator.eq, self.values[4]) == 1
+        assert self.i.estimate(operator.eq, 5) == 0
+        assert self.i.estimate(operator.lt, 1) == 6
+
+    def test_first(self):
+        i = HashIndex(Field())
+        assert i.first() is NotSet
+        for r, v in enumerate([3, 'a', NotSet, 1, [1]]):
+            i.insert(v, r)
+        assert i.first() == 1
+        assert i.first(reverse=True) == 'a'
+
+    def test_count(self):
+        assert self.i.count(operator.eq, 1) == 2
+        assert self.i.count(operator.eq, self.values[4]) == 1
+        assert self.i.count(operator.lt, 1) is None
+        # Unhashable values may be equal to hashable ones
+        assert self.i.count(operator.ne, 1) is None
+        self.i.remove(self.values[4], 'R4')
+        assert self.i.count(operator.ne, 1) == 3
+
+
+class TestCompositeIndex(object):
+
+    def setup(self):
+        self.fields = [Field(), Field(key=len), Field(index='hash')]
+        indexes = [Index(self.fields[0]), Index(self.fields[1]),
+                   HashIndex(self.fields[2])]
+        self.i = CompositeIndex(self.fields, indexes)
+        self.value = [1]
+        self.i.insert((1, 'abc', 1), 'R0')
+        self.i.insert((1, 'abc', 2), 'R1')
+        self.i.insert((NotSet, 'abc', self.value), 'R2')
+
+    def test_len(self):
+        assert len(self.i) == 3
+
+    def test_iter_eq(self):
+        assert set(self.i == (1, 'abc', 1)) == set(['R0'])
+        assert set(self.i == (1.0, 'xyz', 1)) == set(['R0'])
+        assert set(self.i == (1, 'abc', 3)) == set()
+        assert set(self.i == (NotSet, 'abc', self.value)) == set(['R2'])
+        assert set(self.i == (NotSet, 'abc', [1])) == set()
+
+    def test_remove(self):
+        self.i.remove((1, 'xyz', 2), 'R1')
+        assert len(self.i) == 2
+        assert set(self.i == (1, 'abc', 2)) == set()
+
+
 class TestStore(object):
 
     def setup(self):
@@ -220,11 +678,33 @@ class TestStore(object):
         self.populate()
         self.store.add_field(self.missing)
         assert self.store.get('0', self.missing) == NotSet
+        got = set(self.store.indexes[self.missing] == NotSet)
+        assert got == set('01234')
 
     def test_add_record(self):
         self.store.add_record('new')
         assert self.store.has_record('new')
 
+    def test_bulk_add(self):
+        self.populate()
+        self.store.bulk_add([('5', {self.full: 5}), ('6', {self.sparse: 6})])
+        assert self.store.record_count() == 7
+        assert self.store.get('5', self.full) == 5
+        assert self.store.get('5', self.sparse) == -1
+        assert set(self.store.indexes[self.full] == NotSet) == set(['6'])
+        assert set(self.store.indexes[self.sparse] > 1) == set(['3', '6'])
+
+    def test_bulk_set(self):
+        self.populate()
+        self.store.bulk_set([('1', {self.full: 10, self.sparse: 10}),
+                             ('2', {self.full: 20})])
+        assert self.store.get('1', self.full) == 10
+        assert self.store.get('1', self.sparse) == 10
+        assert self.store.get('2', self.full) == 20
+        assert set(self.store.indexes[self.full] >= 10) == set('12')
+        assert set(self.store.indexes[self.sparse] >= 10) == set('1')
+        assert len(self.store.indexes[self.full]) == 5
+
     def test_clear(self):
         self.populate()
         self.store.clear()
@@ -267,6 +747,14 @@ class TestStore(object):
         self.store.remove_record('3')
         assert set(self.store.iter_records()) == set('0124')
 
+    def test_remove_records(self):
+        self.populate()
+        self.store.remove_records(['1', '3', '4'])
+        assert set(self.store.iter_records()) == set('02')
+        assert set(self.store.indexes[self.full] >= 0) == set('02')
+        assert set(self.store.indexes[self.sparse] == -1) == set('02')
+        assert len(self.store.indexes[self.sparse]) == 2
+
     def test_remove_field(self):
         # This merely tests that it runs.
         self.populate()
@@ -277,6 +765,86 @@ class TestStore(object):
         self.store.set('1', self.sparse, 'new value')
         assert self.store.get('1', self.sparse) == 'new value'
 
+    def test_version(self):
+        self.populate()
+        version = self.store.version
+        full = self.store.field_versions[self.full]
+        sparse = self.store.field_versions[self.sparse]
+        self.store.set('1', self.sparse, 5)
+        assert self.store.version > version
+        assert self.store.field_versions[self.full] == full
+        assert self.store.field_versions[self.sparse] > sparse
+        version = self.store.version
+        self.store.set('1', self.sparse, 5)
+        assert self.store.version == version
+        self.store.remove_record('1')
+        assert self.store.version > version
+        assert self.store.field_versions[self.full] > full
+
+
+class TestColumnarStore(TestStore):
+
+    def setup(self):
+        super(TestColumnarStore, self).setup()
+        self.store = ColumnarStore()
+        self.store.add_field(self.full)
+        self.store.add_field(self.sparse)
+
+    def test_reuse_rows(self):
+        self.populate()
+        self.store.remove_record('1')
+        self.store.add_record('new')
+        assert self.store._rows['new'] == 1
+        assert self.store.get('new', self.full) is NotSet
+        assert self.store.get('new', self.sparse) == -1
+        assert set(self.store.iter_records()) == set(['0', 'new', '2', '3',
+                                                      '4'])
+
+    def test_setdefault(self):
+        self.populate()
+        self.store.setdefault(self.sparse, -2)
+        self.sparse._default = -2
+        assert self.store.get('0', self.sparse) == -2
+        assert set(self.store.indexes[self.sparse] == -2) == set('024')
+
+    def test_typed(self):
+        store = ColumnarStore(typecodes={'x': 'd'})
+        x = Field(default=0.0)
+        x._name = 'x'
+        store.add_field(x)
+        store.add_record('a')
+        store.set('a', x, 1.5)
+        store.add_record('b')
+        assert store._columns[x].typecode == 'd'
+        assert list(store.iter_field(x)) == [('a', 1.5), ('b', 0.0)]
+        with assert_raises(TypeError):
+            store.set('b', x, 'text')
+        assert store.get('b', x) == 0.0
+        with assert_raises(TypeError):
+            store.bulk_add([('c', {x: 1.0}), ('d', {x: 'text'})])
+        assert store.record_count() == 2
+        assert list(store.iter_field(x)) == [('a', 1.5), ('b', 0.0)]
+
+    def test_typed_bad_default(self):
+        store = ColumnarStore(typecodes={'x': 'd'})
+        x = Field()
+        x._name = 'x'
+        with assert_raises(ValueError):
+            store.add_field(x)
+
+    def test_table(self):
+        class T(Table):
+            _store = ColumnarStore(typecodes={'b': 'l'})
+            a = Field()
+            b = Field(default=0)
+        r = [T(a=i, b=i * 2) for i in range(5)]
+        T.delete(r[1])
+        r.append(T(a=10))
+        assert r[5].b == 0
+        assert set(T.a > 2) == set([r[3], r[4], r[5]])
+        assert set(T.b == 4) == set([r[2]])
+        assert len(T) == 5
+
 
 class TestStoreIndex(object):
 
@@ -292,6 +860,23 @@ class TestStoreIndex(object):
         assert self.index._unordered[NotSet] == [(NotSet, 'new')]
         assert self.index._ordered == ([], [])
 
+    def test_add_record_data(self):
+        self.store.add_record('new', {self.f: 'value'})
+        assert self.store.get('new', self.f) == 'value'
+        assert self.index._unordered == {}
+        assert self.index._ordered == ([('1str', 'value')], ['new'])
+
+    def test_add_record_fail(self):
+        g = Field()
+        g._name = 'g'
+        self.store.add_field(g)
+        self.store.indexes[g].insert = Mock(side_effect=TypeError)
+        with assert_raises(TypeError):
+            self.store.add_record('new', {self.f: 'value', g: 'value'})
+        assert not self.store.has_record('new')
+        assert self.index._unordered == {}
+        assert self.index._ordered == ([], [])
+
     def test_remove_record(self):
         self.store.add_record('new')
         self.store.remove_record('new')
@@ -303,3 +888,169 @@ class TestStoreIndex(object):
         self.store.set('new', self.f, 'value')
         assert self.index._unordered == {}
         assert self.index._ordered == ([('1str', 'value')], ['new'])
+
+
+class TestStoreUnique(object):
+
+    def setup(self):
+        self.a = Field(unique=True)
+        self.b = Field(unique=True, default=0)
+        self.a._name = 'a'
+        self.b._name = 'b'
+        self.store = Store()
+        self.store.add_field(self.a)
+        self.store.add_field(self.b)
+        for i in range(3):
+            self.store.add_record(str(i))
+            self.store.set(str(i), self.a, i)
+
+    def test_fields(self):
+        assert set(self.store.unique_index.fields) == set([self.a, self.b])
+
+    def test_add_record(self):
+        values = tuple(v if f is self.a else 0
+                       for f, v in zip(self.store.unique_index.fields,
+                                       (1, 1)))
+        assert set(self.store.unique_index == values) == set(['1'])
+
+    def test_set(self):
+        self.store.set('1', self.b, 5)
+        fields = self.store.unique_index.fields
+        values = tuple({self.a: 1, self.b: 5}[f] for f in fields)
+        assert set(self.store.unique_index == values) == set(['1'])
+
+    def test_remove_record(self):
+        self.store.remove_record('1')
+        assert len(self.store.unique_index) == 2
+
+    def test_bulk_add(self):
+        self.store.bulk_add([('3', {self.a: 3}), ('4', {self.a: 4})])
+        assert len(self.store.unique_index) == 5
+        fields = self.store.unique_index.fields
+        values = tuple({self.a: 4, self.b: 0}[f] for f in fields)
+        assert set(self.store.unique_index == values) == set(['4'])
+
+    def test_bulk_add_rollback(self):
+        index = self.store.indexes[self.b]
+        with patch.object(index, 'update', side_effect=RuntimeError):
+            with assert_raises(RuntimeError):
+                self.store.bulk_add([('3', {self.a: 3}), ('4', {self.a: 4})])
+        assert self.store.record_count() == 3
+        assert len(self.store.indexes[self.a]) == 3
+        assert len(self.store.unique_index) == 3
+
+    def test_reindex_fails(self):
+        # All values of b are the default
+        fields = self.store.unique_index.fields
+        self.a._unique = False
+        with assert_raises(ValidationError):
+            self.store.reindex_unique()
+        assert self.store.unique_index.fields == fields
+
+
+class TestSlotStore(object):
+
+    def test_table_only(self):
+        f = Field()
+        f._name = 'f'
+        with assert_raises(ValueError):
+            SlotStore().add_field(f)
+
+
+class TestLazyStore(TestStore):
+
+    def setup(self):
+        super(TestLazyStore, self).setup()
+        self.store = Store(lazy=True)
+        self.store.add_field(self.full)
+        self.store.add_field(self.sparse)
+
+    def test_lazy(self):
+        self.populate()
+        assert self.store.indexes == {}
+        assert set(self.store.indexes[self.full] > 2) == set('34')
+        assert list(self.store.indexes.keys()) == [self.full]
+        self.store.set('0', self.full, 10)
+        self.store.remove_record('4')
+        assert set(self.store.indexes[self.full] > 2) == set('03')
+
+    def test_missing(self):
+        with assert_raises(KeyError):
+            self.store.indexes[self.missing]
+
+    def test_unique(self):
+        self.populate()
+        self.full.unique = True
+        self.store.reindex_unique()
+        assert self.store.indexes == {}
+        assert set(self.store.unique_index == (1,)) == set('1')
+
+    def test_table(self):
+        class T(Table):
+            _store = Store(lazy=True)
+            a = Field()
+            b = Field(index='hash')
+        r = [T(a=i, b=i % 2) for i in range(5)]
+        assert set(T.a >= 3) == set(r[3:])
+        r[0].a = 5
+        assert set(T.a >= 3) == set([r[0]] + r[3:])
+        assert set(T.b == 1) == set([r[1], r[3]])
+        T.delete(r[3])
+        assert set(T.a >= 3) == set([r[0], r[4]])
+
+
+class TestMatches(object):
+
+    def setup(self):
+        class T(Table):
+            a = Field()
+            b = Field(index='hash')
+            c = Field(index=False)
+        self.values = [1, 2.5, 3, 'x', 'y', None, NotSet, [1], (1,), b'z']
+        self.records = [T(a=v, b=v, c=v) for v in self.values]
+        self.T = T
+
+    def check(self, field):
+        index = self.T._store.indexes[field]
+        ops = [operator.eq, operator.ne, operator.lt, operator.le,
+               operator.gt, operator.ge]
+        values = self.values + [[1], 2]
+        for op in ops:
+            for value in values:
+                try:
+                    expect = set(op(index, value))
+                except TypeError:
+                    continue
+                got = set(r for r in self.records
+                          if index.matches(op, value, getattr(r, field.name)))
+                assert got == expect, (op, value, got, expect)
+
+    def test_index(self):
+        self.check(self.T.a)
+
+    def test_hash(self):
+        self.check(self.T.b)
+
+    def test_scan(self):
+        self.check(self.T.c)
+
+
+class TestListeners(object):
+
+    def setup(self):
+        self.f = Field()
+        self.f._name = 'f'
+        self.store = Store()
+        self.store.add_field(self.f)
+        self.calls = []
+        self.store.listeners.append(lambda *args: self.calls.append(args))
+
+    def test_events(self):
+        self.store.add_record('a')
+        self.store.set('a', self.f, 1)
+        self.store.bulk_set([('a', {self.f: 2})])
+        self.store.remove_record('a')
+        self.store.clear()
+        assert self.calls == [(['a'], None), (['a'], [self.f]),
+                              (['a'], [self.f]), (['a'], None),
+                              (None, None)], self.calls
@@ -16,7 +16,9 @@
 
 import re
 from norman._six import assert_raises
-from norman import AutoTable, Table, Field, NotSet, Join, ValidationError
+from norman import (AutoTable, CompactTable, Table, Field, NotSet, Join,
+                    ValidationError, ConsistencyError, Store, SlotStore,
+                    MultiIndex)
 
 
 class TestFields(object):
@@ -261,6 +263,18 @@ class TestInheritance(object):
         assert set(b.j) == set([o1])
         assert set(i.j) == set([o2])
 
+    def test_multi(self):
+        class M(Table):
+            tags = Field(multi=True)
+
+        class N(M):
+            pass
+
+        assert N.tags.multi
+        assert isinstance(N._store.indexes[N.tags], MultiIndex)
+        n = N(tags=['x', 'y'])
+        assert set(N.tags.has('y')) == set([n])
+
 
 class TestUid(object):
 
@@ -336,6 +350,39 @@ class TestUnique(object):
         with assert_raises(ValueError):
             T(a=1, b=2)
 
+    def test_unique_key(self):
+        'Unique values are compared using the field key'
+        class T(Table):
+            a = Field(unique=True, key=len)
+            b = Field(unique=True, index='hash')
+        T(a='abc', b=1)
+        T(a='abc', b=2)
+        with assert_raises(ValidationError):
+            T(a='xyz', b=1)
+
+    def test_unique_list_key(self):
+        'Keys which are lists are compared by their items'
+        class T(Table):
+            a = Field(unique=True, key=lambda x: re.findall(r'\d+', x))
+        T(a='x 1')
+        T(a='x 1 2')
+        with assert_raises(ValidationError):
+            T(a='y 1')
+
+    def test_unique_index(self):
+        'Unique fields share a single composite index'
+        class T(Table):
+            a = Field(unique=True)
+            b = Field(unique=True)
+            c = Field()
+        t = T(a=1, b=2, c=3)
+        assert set(T._store.unique_index.fields) == set([T.a, T.b])
+        assert set(T._store.unique_index == (t.a, t.b)) == set([t])
+        T.c.unique = True
+        assert set(T._store.unique_index.fields) == set([T.a, T.b, T.c])
+        T.a.unique = T.b.unique = T.c.unique = False
+        assert T._store.unique_index is None
+
     def test_validation(self):
         'Test changing to a unique value during validation'
         class T(Table):
@@ -353,6 +400,58 @@ class TestUnique(object):
             t2.b = 1
 
 
+class TestBulkCreate(object):
+
+    def setup(self):
+        class T(Table):
+            oid = Field(unique=True)
+            name = Field(default='', validators=[str])
+
+            def validate(self):
+                assert self.oid != -1
+        self.T = T
+
+    def test_create(self):
+        records = self.T.bulk_create([{'oid': 2, 'name': 1}, {'oid': 1}])
+        assert len(self.T) == 2
+        assert [r.oid for r in records] == [2, 1]
+        assert [r.name for r in records] == ['1', '']
+        assert set(self.T.oid < 2) == set([records[1]])
+        assert set(self.T.name == '') == set([records[1]])
+
+    def test_existing(self):
+        self.T(oid=5)
+        self.T.bulk_create([{'oid': 6}, {'oid': 4}])
+        got = [r.oid for r in self.T._store.indexes[self.T.oid] >= 0]
+        assert got == [4, 5, 6], got
+        with assert_raises(ValidationError):
+            self.T.bulk_create([{'oid': 7}, {'oid': 5}])
+        assert len(self.T) == 3
+
+    def test_duplicates(self):
+        with assert_raises(ValidationError):
+            self.T.bulk_create([{'oid': 1}, {'oid': 2}, {'oid': 1}])
+        assert len(self.T) == 0
+
+    def test_validate(self):
+        with assert_raises(ValidationError):
+            self.T.bulk_create([{'oid': 1}, {'oid': -1}])
+        assert len(self.T) == 0
+        assert len(self.T._store.indexes[self.T.oid]) == 0
+        assert len(self.T._store.unique_index) == 0
+
+    def test_bad_field(self):
+        with assert_raises(AttributeError):
+            self.T.bulk_create([{'oid': 1}, {'bad': -1}])
+        assert len(self.T) == 0
+
+    def test_autotable(self):
+        class A(AutoTable): pass
+        a1, a2 = A.bulk_create([{'a': 1}, {'b': 2}])
+        assert (a1.a, a1.b, a2.a, a2.b) == (1, NotSet, NotSet, 2)
+        assert set(A.b == NotSet) == set([a1])
+
+
 class TestValidateDelete(object):
 
     def setup(self):
@@ -391,6 +490,21 @@ class TestValidateDelete(object):
         T.delete(t1)
         assert set(T) == set([t2])
 
+    def test_batch(self):
+        records = [self.T(value=i) for i in range(2, 20)]
+        self.T.delete(records[::2])
+        assert set(self.T) == set(records[1::2])
+        got = set(self.T._store.indexes[self.T.value] > 0)
+        assert got == set(records[1::2])
+
+    def test_batch_invalid(self):
+        'Records validated before the failure are deleted.'
+        records = [self.T(value=2), self.T(value=0)]
+        with assert_raises(ValidationError):
+            self.T.delete(records)
+        assert records[1] in self.T
+        assert len(self.T._store.indexes[self.T.value]) == len(self.T)
+
 
 class TestHooks:
 
@@ -476,3 +590,78 @@ class TestAutoTable(object):
         t._a = 1
         assert t._a == 1
         assert not hasattr(T, '_a')
+
+
+class TestCompactTable(object):
+
+    def setup(self):
+        class T(CompactTable):
+            a = Field(unique=True)
+            b = Field(default=0)
+        self.T = T
+
+    def test_slots(self):
+        t = self.T(a=1)
+        assert not hasattr(t, '__dict__')
+        assert isinstance(self.T._store, SlotStore)
+        with assert_raises(AttributeError):
+            t.other = 1
+
+    def test_values(self):
+        t = self.T(a=1)
+        assert t.a == 1
+        assert t.b == 0
+        t.b = 2
+        assert t.b == 2
+        assert set(self.T.b == 2) == set([t])
+        assert set(self.T.b == 0) == set()
+
+    def test_unique(self):
+        self.T(a=1)
+        with assert_raises(ValidationError):
+            self.T(a=1)
+        assert len(self.T) == 1
+
+    def test_delete(self):
+        t1 = self.T(a=1, b=1)
+        t2 = self.T(a=2, b=2)
+        self.T.delete(t1)
+        assert set(self.T) == set([t2])
+        assert t1.b == 0
+        assert set(self.T.b > 0) == set([t2])
+
+    def test_default(self):
+        t = self.T(a=1)
+        self.T.b.default = 5
+        assert t.b == 5
+        assert set(self.T.b == 5) == set([t])
+
+    def test_uid(self):
+        t = self.T(a=1)
+        t._uid = 5
+        assert t._uid == 5
+
+    def test_add_field(self):
+        with assert_raises(ConsistencyError):
+            self.T.c = Field()
+
+    def test_inheritance(self):
+        class T2(self.T):
+            c = Field()
+        t = T2(a=1, c=3)
+        assert (t.a, t.b, t.c) == (1, 0, 3)
+        assert not hasattr(t, '__dict__')
+        assert len(self.T) == 0
+
+    def test_store(self):
+        with assert_raises(ConsistencyError):
+            class T(CompactTable):
+                _store = Store()
+                a = Field()
+
+    def test_table_dict(self):
+        class T(Table):
+            a = Field()
+        t = T(a=1)
+        t.other = 2
+        assert t.other == 2